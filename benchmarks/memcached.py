@@ -0,0 +1,88 @@
+'''
+Compares the throughput of the Memcached engine with the previous client (a
+plain memcache.Client, with modulo hashing and one request per session) and
+with the current one (the shared HashRingClient, using get_multi and set_multi
+to read and write many sessions at once).
+
+Run it with the servers to be used (localhost:11211, by default):
+$ python benchmarks/memcached.py localhost:11211 localhost:11212
+
+or with in-process stand-in servers (which measures the client overhead more
+than the servers):
+$ python benchmarks/memcached.py --stand-in 2
+'''
+
+from __future__ import print_function
+
+import sys
+import timeit
+
+import memcache
+
+from pycket.driver import MemcachedDriver
+
+
+SESSION = {
+    'user': 'john.doe@example.com',
+    'user_id': 1234,
+    'roles': ['admin', 'editor'],
+    'last_page': '/dashboard/reports?page=3',
+}
+
+BATCH_SIZE = 50
+
+
+def measure(function, number):
+    seconds = min(timeit.repeat(function, number=number, repeat=3))
+    return number / seconds
+
+
+def plain_driver(servers):
+    driver = MemcachedDriver({'servers': servers})
+    driver.client = memcache.Client(servers, cache_cas=True)
+    return driver
+
+
+def hash_ring_driver(servers):
+    return MemcachedDriver({'servers': servers})
+
+
+def one_by_one(driver, session_ids):
+    for session_id in session_ids:
+        driver.get(session_id)
+
+
+def main(arguments):
+    stand_ins = []
+    if arguments[:1] == ['--stand-in']:
+        from tests.memcached_server import MemcachedServer
+        stand_ins = [MemcachedServer().start() for _ in range(int(arguments[1]))]
+        servers = tuple(server.address for server in stand_ins)
+    else:
+        servers = tuple(arguments) or MemcachedDriver.DEFAULT_SERVERS
+
+    session_ids = ['session-%d' % index for index in range(BATCH_SIZE)]
+    print('servers: %s' % ', '.join(servers))
+    print('%-12s %10s %10s %10s %16s %16s' % (
+        'client', 'set/s', 'get/s', 'update/s', 'batch get/s', 'batch set/s'))
+    for name, create in (('plain', plain_driver), ('hash ring', hash_ring_driver)):
+        driver = create(servers)
+        sessions = dict((session_id, SESSION) for session_id in session_ids)
+        set_rate = measure(lambda: driver.set('session-id', SESSION), 2000)
+        get_rate = measure(lambda: driver.get('session-id'), 2000)
+        update_rate = measure(lambda: driver.update('session-id', {'last_page': '/'}), 1000)
+        if create is plain_driver:
+            batch_get_rate = measure(lambda: one_by_one(driver, session_ids), 50)
+            batch_set_rate = measure(lambda: [driver.set(session_id, SESSION) for session_id in session_ids], 50)
+        else:
+            batch_get_rate = measure(lambda: driver.get_many(session_ids), 50)
+            batch_set_rate = measure(lambda: driver.set_many(sessions), 50)
+        print('%-12s %10.0f %10.0f %10.0f %16.0f %16.0f' % (
+            name, set_rate, get_rate, update_rate, batch_get_rate * BATCH_SIZE, batch_set_rate * BATCH_SIZE))
+
+    for server in stand_ins:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,61 @@
+'''
+Measures the throughput of the session serializers, with a typical small
+session and with a larger one (such as a session holding a shopping cart).
+
+Run it with:
+$ python benchmarks/serializers.py
+'''
+
+from __future__ import print_function
+
+import pickle
+import timeit
+
+from pycket.serializer import (
+    JSONSerializer, MsgpackSerializer, PickleSerializer)
+
+
+SMALL_SESSION = {
+    'user': 'john.doe@example.com',
+    'user_id': 1234,
+    'roles': ['admin', 'editor'],
+    'last_page': '/dashboard/reports?page=3',
+}
+
+LARGE_SESSION = dict(SMALL_SESSION, cart=[
+    {'sku': 'SKU-%05d' % index, 'quantity': index % 5, 'price': index * 1.5, 'tags': ['a', 'b', 'c']}
+    for index in range(200)
+])
+
+SERIALIZERS = (
+    ('pickle (protocol 0)', lambda: PickleSerializer(protocol=0)),
+    ('pickle (protocol 2)', lambda: PickleSerializer(protocol=2)),
+    ('pickle (default)', PickleSerializer),
+    ('pickle (highest)', lambda: PickleSerializer(protocol=pickle.HIGHEST_PROTOCOL)),
+    ('json', JSONSerializer),
+    ('msgpack', MsgpackSerializer),
+)
+
+
+def measure(function, number):
+    seconds = min(timeit.repeat(function, number=number, repeat=3))
+    return number / seconds
+
+
+def main():
+    print('%-20s %-6s %8s %12s %12s' % ('serializer', 'size', 'bytes', 'dumps/s', 'loads/s'))
+    for name, create in SERIALIZERS:
+        try:
+            serializer = create()
+        except ImportError:
+            print('%-20s (not installed)' % name)
+            continue
+        for size, session, number in (('small', SMALL_SESSION, 20000), ('large', LARGE_SESSION, 200)):
+            data = serializer.dumps(session)
+            dumps = measure(lambda: serializer.dumps(session), number)
+            loads = measure(lambda: serializer.loads(data), number)
+            print('%-20s %-6s %8d %12.0f %12.0f' % (name, size, len(data), dumps, loads))
+
+
+if __name__ == '__main__':
+    main()
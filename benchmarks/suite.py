@@ -0,0 +1,349 @@
+'''
+Measures the throughput and the latency percentiles of the session operations
+(get, set, update, delete and notification pop, with the drivers and with the
+SessionManager) with each engine, and of the serializers, for many session
+sizes and numbers of sessions. Engines whose servers (or packages) aren't
+available are skipped, and so are the cases that would store more than
+"--max-bytes" (like a thousand sessions of 1MB).
+
+Run it with:
+$ python benchmarks/suite.py
+
+or, to save the results as JSON and compare them with the ones of another
+commit (listing the operations that got slower than "--threshold"):
+$ python benchmarks/suite.py --output before.json
+$ git checkout other-branch
+$ python benchmarks/suite.py --output after.json --compare before.json
+
+The engines, sizes (in bytes) and numbers of sessions can be chosen:
+$ python benchmarks/suite.py --engines memory,redis --sizes 100,10000 --keys 1,1000
+'''
+
+from __future__ import print_function
+
+import argparse
+import binascii
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from timeit import default_timer
+
+from pycket.driver import DriverFactory, registry
+from pycket.notification import NotificationManager
+from pycket.serializer import JSONSerializer, MsgpackSerializer, PickleSerializer
+from pycket.session import SessionManager
+
+
+SESSION = {
+    'user': 'john.doe@example.com',
+    'user_id': 1234,
+    'roles': ('admin', 'editor'),
+    'last_page': '/dashboard/reports?page=3',
+}
+
+ENGINES = ('memory', 'shared_memory', 'sqlite', 'redis', 'redis_hash', 'memcached')
+STORAGE_SETTINGS = {
+    'sqlite': {'path': os.path.join(tempfile.gettempdir(), 'pycket-benchmark.sqlite3')},
+}
+SIZES = (100, 1000, 10000, 100000, 1000000)
+KEYS = (1, 100, 1000)
+OPERATIONS = ('set', 'get', 'get_value', 'update', 'delete', 'notification_pop', 'manager_get', 'manager_set')
+# The operations that need the sessions to be stored before they run.
+READ_OPERATIONS = ('get', 'get_value', 'update', 'manager_get')
+
+SERIALIZERS = (
+    ('pickle', PickleSerializer),
+    ('json', JSONSerializer),
+    ('msgpack', MsgpackSerializer),
+)
+
+MIN_ITERATIONS = 10
+PERCENTILES = (50, 90, 99)
+
+
+class StubHandler(object):
+    '''
+    Stands in for a tornado.web.RequestHandler in the SessionManager
+    operations, with one instance for each request.
+    '''
+
+    def __init__(self, settings, session_id):
+        self.settings = settings
+        self.session_id = session_id
+
+    def get_secure_cookie(self, name):
+        return self.session_id
+
+    def set_secure_cookie(self, name, value, **kwargs):
+        self.session_id = value
+
+
+class Case(object):
+    '''
+    Runs the operations of an engine with sessions of "size" bytes, cycling
+    through "keys" session ids.
+    '''
+
+    def __init__(self, engine, size, keys, iterations, seconds):
+        self.engine = engine
+        self.size = size
+        self.session_ids = ['benchmark-%d' % index for index in range(keys)]
+        self.iterations = iterations
+        self.seconds = seconds
+        self.session = dict(SESSION, payload=payload(size))
+        storage_settings = STORAGE_SETTINGS.get(engine, {})
+        self.settings = {'pycket': {'engine': engine, 'storage': storage_settings}}
+        # The same drivers as the managers, or the memory engines would store
+        # the sessions of the driver and of the manager operations apart.
+        self.driver = registry.get(engine, storage_settings, SessionManager.STORAGE_CATEGORY, self.settings['pycket'])
+        self.notifications = registry.get(
+            engine, storage_settings, NotificationManager.STORAGE_CATEGORY, self.settings['pycket'])
+
+    def run(self, operation):
+        prepare, function = getattr(self, operation)()
+        if operation in READ_OPERATIONS:
+            self.populate()
+        durations = []
+        started = default_timer()
+        index = 0
+        while index < MIN_ITERATIONS or (index < self.iterations and default_timer() - started < self.seconds):
+            session_id = self.session_ids[index % len(self.session_ids)]
+            if prepare is not None:
+                prepare(session_id)
+            start = default_timer()
+            function(session_id)
+            durations.append(default_timer() - start)
+            index += 1
+        return durations
+
+    def populate(self):
+        for session_id in self.session_ids:
+            self.driver.set(session_id, self.session)
+
+    def clear(self):
+        for session_id in self.session_ids:
+            self.driver.pop_all(session_id)
+            self.notifications.pop_all(session_id)
+
+    def set(self):
+        return None, lambda session_id: self.driver.set(session_id, self.session)
+
+    def get(self):
+        return None, self.driver.get
+
+    def get_value(self):
+        return None, lambda session_id: self.driver.get_value(session_id, 'user')
+
+    def update(self):
+        return None, lambda session_id: self.driver.update(session_id, {'last_page': '/'})
+
+    def delete(self):
+        return lambda session_id: self.driver.set(session_id, self.session), self.driver.pop_all
+
+    def notification_pop(self):
+        def prepare(session_id):
+            self.notifications.set(session_id, {'message': self.session['payload']})
+
+        def pop(session_id):
+            NotificationManager(StubHandler(self.settings, session_id)).get('message')
+        return prepare, pop
+
+    def manager_get(self):
+        def get(session_id):
+            SessionManager(StubHandler(self.settings, session_id)).get('payload')
+        return None, get
+
+    def manager_set(self):
+        def set(session_id):
+            SessionManager(StubHandler(self.settings, session_id)).set('payload', self.session['payload'])
+        return None, set
+
+
+def payload(size):
+    '''
+    Returns a string that makes the session take about "size" bytes, without
+    repeating itself (so that it doesn't compress better than real data).
+    '''
+
+    length = max(0, size - len(repr(SESSION)))
+    return binascii.hexlify(os.urandom((length + 1) // 2)).decode('ascii')[:length]
+
+
+def summarize(durations):
+    durations = sorted(durations)
+    latency = dict(
+        ('p%d' % percentile, to_microseconds(durations[min(len(durations) - 1, len(durations) * percentile // 100)]))
+        for percentile in PERCENTILES)
+    latency['max'] = to_microseconds(durations[-1])
+    return {
+        'iterations': len(durations),
+        'ops_per_second': round(len(durations) / sum(durations), 1),
+        'latency_us': latency,
+    }
+
+
+def to_microseconds(seconds):
+    return round(seconds * 1000000, 1)
+
+
+def is_available(engine):
+    try:
+        driver = DriverFactory().create(engine, STORAGE_SETTINGS.get(engine, {}), 'db_sessions')
+        driver.set('benchmark-check', SESSION)
+        return driver.get('benchmark-check') == SESSION
+    except Exception:
+        return False
+
+
+def run_engines(arguments, results):
+    for engine in arguments.engines:
+        if not is_available(engine):
+            print('%-14s (not available)' % engine)
+            continue
+        for size in arguments.sizes:
+            for keys in arguments.keys:
+                if size * keys <= arguments.max_bytes:
+                    run_case(Case(engine, size, keys, arguments.iterations, arguments.seconds), arguments, results)
+        registry.clear()
+
+
+def run_case(case, arguments, results):
+    for operation in arguments.operations:
+        result = {'engine': case.engine, 'operation': operation, 'size': case.size, 'keys': len(case.session_ids)}
+        try:
+            result.update(summarize(case.run(operation)))
+        except Exception as error:
+            result['error'] = '%s: %s' % (type(error).__name__, error)
+        results.append(result)
+        report(result)
+    try:
+        case.clear()
+    except Exception:
+        pass
+
+
+def run_serializers(arguments, results):
+    for name, create in SERIALIZERS:
+        try:
+            serializer = create()
+        except ImportError:
+            print('%-14s (not installed)' % name)
+            continue
+        for size in arguments.sizes:
+            session = dict(SESSION, payload=payload(size))
+            data = serializer.dumps(session)
+            for operation, function in (('dumps', lambda: serializer.dumps(session)),
+                                        ('loads', lambda: serializer.loads(data))):
+                durations = []
+                started = default_timer()
+                while len(durations) < MIN_ITERATIONS or (
+                        len(durations) < arguments.iterations and default_timer() - started < arguments.seconds):
+                    start = default_timer()
+                    function()
+                    durations.append(default_timer() - start)
+                result = {'serializer': name, 'operation': operation, 'size': size, 'bytes': len(data)}
+                result.update(summarize(durations))
+                results.append(result)
+                report(result)
+
+
+def report(result):
+    subject = result.get('engine') or result.get('serializer')
+    prefix = '%-14s %-16s %8d %5s' % (subject, result['operation'], result['size'], result.get('keys', '-'))
+    if 'error' in result:
+        print('%s  %s' % (prefix, result['error']))
+        return
+    latency = result['latency_us']
+    print('%s %12.0f %10.1f %10.1f %10.1f %10.1f' % (
+        prefix, result['ops_per_second'], latency['p50'], latency['p90'], latency['p99'], latency['max']))
+
+
+def result_key(result):
+    return (result.get('engine') or result.get('serializer'), result['operation'], result['size'], result.get('keys'))
+
+
+def compare(results, baseline_path, threshold):
+    '''
+    Prints how the throughput of each result changed from the baseline, and
+    returns how many results got slower than "threshold" (a fraction).
+    '''
+
+    with open(baseline_path) as baseline_file:
+        baseline = dict((result_key(result), result) for result in json.load(baseline_file)['results'])
+    regressions = 0
+    print()
+    print('compared with %s:' % baseline_path)
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None or 'ops_per_second' not in before or 'ops_per_second' not in result:
+            continue
+        change = result['ops_per_second'] / before['ops_per_second'] - 1
+        slower = change < -threshold
+        regressions += slower
+        print('%-14s %-16s %8d %5s %+8.1f%%%s' % (
+            result_key(result)[0], result['operation'], result['size'], result.get('keys', '-'), change * 100,
+            '  SLOWER' if slower else ''))
+    return regressions
+
+
+def metadata(arguments):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).decode().strip()
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'iterations': arguments.iterations,
+        'seconds': arguments.seconds,
+    }
+
+
+def parse_arguments(arguments):
+    def numbers(text):
+        return [int(number) for number in text.split(',')]
+
+    def names(text):
+        return text.split(',')
+
+    parser = argparse.ArgumentParser(description='Benchmarks the pycket engines, operations and serializers.')
+    parser.add_argument('--engines', type=names, default=list(ENGINES))
+    parser.add_argument('--operations', type=names, default=list(OPERATIONS))
+    parser.add_argument('--sizes', type=numbers, default=list(SIZES), help='session sizes, in bytes')
+    parser.add_argument('--keys', type=numbers, default=list(KEYS), help='numbers of sessions to cycle through')
+    parser.add_argument('--iterations', type=int, default=1000, help='maximum iterations of each operation')
+    parser.add_argument('--seconds', type=float, default=1.0, help='maximum time of each operation')
+    parser.add_argument('--max-bytes', type=int, default=64 * 1024 * 1024,
+                        help='skips the cases that store more than this')
+    parser.add_argument('--no-serializers', dest='serializers', action='store_false')
+    parser.add_argument('--output', help='file to write the results to, as JSON')
+    parser.add_argument('--compare', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown (as a fraction) counted as a regression by --compare')
+    return parser.parse_args(arguments)
+
+
+def main(arguments):
+    arguments = parse_arguments(arguments)
+    results = []
+    print('%-14s %-16s %8s %5s %12s %10s %10s %10s %10s' % (
+        'engine', 'operation', 'size', 'keys', 'ops/s', 'p50 us', 'p90 us', 'p99 us', 'max us'))
+    run_engines(arguments, results)
+    if arguments.serializers:
+        run_serializers(arguments, results)
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            json.dump({'metadata': metadata(arguments), 'results': results}, output, indent=2, sort_keys=True)
+    if arguments.compare and compare(results, arguments.compare, arguments.threshold):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
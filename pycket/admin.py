@@ -0,0 +1,261 @@
+'''
+This module contains tools to administer the stored sessions in bulk, like
+counting them, deleting the ones that hold an obsolete item or expiring the
+old ones, with the engines that can list their sessions ("redis", "redis_hash",
+"memory" and "sqlite").
+
+The sessions are listed in batches (with SCAN, in Redis, which doesn't block
+the server like KEYS), and the batches are loaded, decoded and changed by a
+pool of worker threads, with a single round trip (or a few) for each batch,
+while the next batches are being listed. The number of sessions per second can
+be limited, so that the administration doesn't take the datastore away from
+the application.
+
+It can be used from Python:
+
+>>> admin = SessionAdmin(registry.get('redis', {}, 'db_sessions'), workers=8)
+>>> progress = admin.purge('obsolete_item')
+
+or from the command line, with the "pycket-admin" command (see "--help"):
+
+$ pycket-admin --engine redis --storage '{"host": "redis1"}' purge obsolete_item
+
+This module requires the "futures" package in Python 2.
+'''
+
+from __future__ import print_function
+
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import sys
+import time
+
+from pycket.driver import Driver, DriverFactory
+
+
+class Progress(object):
+    '''
+    Counts the sessions that were "processed", how many of them were
+    "matched" by the operation and how many were "changed" (deleted or
+    rewritten; none, in dry runs).
+    '''
+
+    def __init__(self):
+        self.started = time.time()
+        self.batches = 0
+        self.processed = 0
+        self.matched = 0
+        self.changed = 0
+
+    def elapsed(self):
+        return time.time() - self.started
+
+    def rate(self):
+        '''
+        Returns how many sessions were processed per second.
+        '''
+
+        elapsed = self.elapsed()
+        if not elapsed:
+            return 0.0
+        return self.processed / elapsed
+
+    def __str__(self):
+        return '%d processed, %d matched, %d changed in %.1fs (%.0f sessions/s)' % (
+            self.processed, self.matched, self.changed, self.elapsed(), self.rate())
+
+
+class SessionAdmin(object):
+    '''
+    Runs bulk operations on the sessions of "driver", "batch_size" sessions
+    at a time, with "workers" threads, processing at most "max_rate" sessions
+    per second (if it's set). With "dry_run", the sessions are only counted,
+    not changed. After each batch, "report" (if it's set) is called with the
+    Progress of the operation.
+    '''
+
+    DEFAULT_WORKERS = 4
+
+    def __init__(self, driver, batch_size=Driver.DEFAULT_SCAN_BATCH, workers=DEFAULT_WORKERS, max_rate=None,
+                 dry_run=False, report=None):
+        self.driver = driver
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_rate = max_rate
+        self.dry_run = dry_run
+        self.report = report
+
+    def count(self):
+        '''
+        Counts the sessions, without loading them.
+        '''
+
+        return self._run(lambda session_ids: []).processed
+
+    def purge(self, name):
+        '''
+        Deletes the sessions that have an item called "name".
+        '''
+
+        return self.delete_where(lambda session_id, session: name in session)
+
+    def delete_where(self, predicate):
+        '''
+        Deletes the sessions for which "predicate" (called with the id and the
+        session) returns True.
+        '''
+
+        def process(session_ids):
+            sessions = self.driver.get_many(session_ids)
+            matched = [session_id for session_id in session_ids
+                       if sessions[session_id] and predicate(session_id, sessions[session_id])]
+            if matched and not self.dry_run:
+                self.driver.delete_many(matched)
+            return matched
+        return self._run(process)
+
+    def remove_item(self, name):
+        '''
+        Removes the item called "name" from the sessions that have it, keeping
+        their other items and their expiration.
+        '''
+
+        def process(session_ids):
+            sessions = self.driver.get_many(session_ids)
+            matched = [session_id for session_id in session_ids if name in sessions[session_id]]
+            if matched and not self.dry_run:
+                self.driver.update_many(dict((session_id, ({}, (name,))) for session_id in matched))
+            return matched
+        return self._run(process)
+
+    def expire_older_than(self, seconds):
+        '''
+        Deletes the sessions that were last written (or touched) more than
+        "seconds" ago, which is known from their expiration times.
+        '''
+
+        def process(session_ids):
+            ttls = self.driver.ttl_many(session_ids)
+            matched = [session_id for session_id in session_ids
+                       if ttls[session_id] is not None and self.driver.EXPIRE_SECONDS - ttls[session_id] > seconds]
+            if matched and not self.dry_run:
+                self.driver.delete_many(matched)
+            return matched
+        return self._run(process)
+
+    def _run(self, process):
+        '''
+        Calls "process" with each batch of session ids, in the worker threads,
+        and adds up the sessions it returns (as the matched ones). At most two
+        batches per worker are listed ahead of the processed ones.
+        '''
+
+        progress = Progress()
+        executor = ThreadPoolExecutor(self.workers)
+        pending = deque()
+        try:
+            listed = 0
+            for session_ids in self.driver.scan(self.batch_size):
+                self._throttle(listed, progress)
+                listed += len(session_ids)
+                pending.append((len(session_ids), executor.submit(process, session_ids)))
+                while len(pending) >= 2 * self.workers:
+                    self._collect(pending.popleft(), progress)
+            while pending:
+                self._collect(pending.popleft(), progress)
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+        return progress
+
+    def _collect(self, batch, progress):
+        size, future = batch
+        matched = future.result()
+        progress.batches += 1
+        progress.processed += size
+        progress.matched += len(matched)
+        if not self.dry_run:
+            progress.changed += len(matched)
+        if self.report is not None:
+            self.report(progress)
+
+    def _throttle(self, listed, progress):
+        if self.max_rate:
+            delay = float(listed) / self.max_rate - progress.elapsed()
+            if delay > 0:
+                time.sleep(delay)
+
+
+class ProgressReporter(object):
+    '''
+    Writes the progress to "stream", at most once every "interval" seconds.
+    '''
+
+    def __init__(self, stream, interval=1):
+        self.stream = stream
+        self.interval = interval
+        self.reported_at = 0
+
+    def __call__(self, progress):
+        if time.time() - self.reported_at >= self.interval:
+            self.reported_at = time.time()
+            self.stream.write('%s\n' % progress)
+            self.stream.flush()
+
+
+def main(arguments=None):
+    '''
+    Runs the "pycket-admin" command.
+    '''
+
+    parser = argparse.ArgumentParser(prog='pycket-admin', description='Administers the sessions stored by pycket.')
+    parser.add_argument('--engine', default='redis')
+    parser.add_argument('--storage', type=json.loads, default={}, help='the "storage" settings, as JSON')
+    parser.add_argument('--settings', type=json.loads, default={},
+                        help='other "pycket" settings (like "serializer" or "expire_seconds"), as JSON')
+    parser.add_argument('--notifications', action='store_true',
+                        help='administers the notifications instead of the sessions')
+    parser.add_argument('--batch-size', type=int, default=Driver.DEFAULT_SCAN_BATCH)
+    parser.add_argument('--workers', type=int, default=SessionAdmin.DEFAULT_WORKERS)
+    parser.add_argument('--max-rate', type=float, help='the maximum number of sessions processed per second')
+    parser.add_argument('--dry-run', action='store_true', help='only counts the sessions that would be changed')
+    parser.add_argument('--quiet', action='store_true', help="doesn't report the progress")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('count', help='counts the sessions')
+    commands.add_parser('purge', help='deletes the sessions that have an item').add_argument('name')
+    commands.add_parser('remove-item', help='removes an item from the sessions').add_argument('name')
+    commands.add_parser('expire', help='deletes the sessions last written more than some seconds ago '
+                        '(needs the "expire_seconds" of the application in --settings)').add_argument(
+        'seconds', type=float)
+    arguments = parser.parse_args(arguments)
+    if arguments.command == 'expire' and 'expire_seconds' not in arguments.settings:
+        # The age of a session is known from its expiration, so guessing the default would delete live sessions.
+        parser.error('expire needs the "expire_seconds" of the application in --settings')
+
+    storage_category = 'db_notifications' if arguments.notifications else 'db_sessions'
+    driver = DriverFactory().create(arguments.engine, arguments.storage, storage_category, arguments.settings)
+    admin = SessionAdmin(driver, batch_size=arguments.batch_size, workers=arguments.workers,
+                         max_rate=arguments.max_rate, dry_run=arguments.dry_run,
+                         report=None if arguments.quiet else ProgressReporter(sys.stderr))
+    try:
+        if arguments.command == 'count':
+            print(admin.count())
+            return 0
+        elif arguments.command == 'purge':
+            progress = admin.purge(arguments.name)
+        elif arguments.command == 'remove-item':
+            progress = admin.remove_item(arguments.name)
+        else:
+            progress = admin.expire_older_than(arguments.seconds)
+    except NotImplementedError as error:
+        parser.exit(2, '%s: %s\n' % (parser.prog, error))
+    print(progress)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
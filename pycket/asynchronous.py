@@ -0,0 +1,188 @@
+'''
+This module contains non-blocking versions of the session and notification
+managers and mixins, to be used in Tornado coroutines. The methods that touch
+the datastore return Futures, so they can be yielded (or awaited, in Python
+3.5+):
+
+>>> class MyHandler(tornado.web.RequestHandler, AsyncSessionMixin):
+...     @gen.coroutine
+...     def get(self):
+...         yield self.session.set('user', 'John')
+...         user = yield self.session.get('user')
+
+The datastore calls are made by the same (shared) drivers used by the
+synchronous managers, but they run in a thread pool, so the IOLoop can keep
+serving other requests while the session I/O is in flight. The handler itself
+(which isn't thread-safe) is only used in the IOLoop thread: the session id is
+read from the cookie (or a new one is created, setting the cookie) before the
+operation is sent to the pool. The pool can be
+replaced by setting "AsyncSessionManager.executor" to any
+concurrent.futures.Executor.
+
+With "write_back", the changes left when the handler finishes are written by
+"finish()" itself, which can't wait for a Future, so it blocks the IOLoop while
+writing them: yield "flush()" before finishing to avoid that.
+
+This module requires Tornado 3.0+ (and the "futures" package in Python 2).
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from tornado import gen
+
+from pycket.notification import NotificationManager
+from pycket.session import create_mixin, SessionManager
+
+
+class AsyncSessionManager(SessionManager):
+    '''
+    Same as SessionManager, but "get", "set", "pop", "pop_all", "delete",
+    "keys", "contains", "iterkeys", "load", "sessions_of",
+    "delete_sessions_of" and "flush" return Futures instead of blocking.
+    Dict-like access also returns Futures, except for "in" and iteration,
+    which can't be asynchronous and, therefore, are not supported.
+    '''
+
+    MAX_WORKERS = 10
+
+    executor = None
+    executor_lock = threading.Lock()
+
+    @gen.coroutine
+    def set(self, name, value):
+        yield self._run(super(AsyncSessionManager, self).set, name, value)
+
+    @gen.coroutine
+    def get(self, name, default=None):
+        value = yield self._run(super(AsyncSessionManager, self).get, name, default)
+        raise gen.Return(value)
+
+    @gen.coroutine
+    def pop(self, name, default=None):
+        value = yield self._run(super(AsyncSessionManager, self).pop, name, default)
+        raise gen.Return(value)
+
+    @gen.coroutine
+    def pop_all(self):
+        values = yield self._run(super(AsyncSessionManager, self).pop_all)
+        raise gen.Return(values)
+
+    @gen.coroutine
+    def delete(self, *names):
+        yield self._run(super(AsyncSessionManager, self).delete, *names)
+    __delitem__ = delete
+
+    @gen.coroutine
+    def keys(self):
+        keys = yield self._run(super(AsyncSessionManager, self).keys)
+        raise gen.Return(keys)
+
+    @gen.coroutine
+    def iterkeys(self):
+        keys = yield self.keys()
+        raise gen.Return(iter(keys))
+
+    @gen.coroutine
+    def contains(self, name):
+        result = yield self._run(super(AsyncSessionManager, self).__contains__, name)
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def load(self, *managers):
+        yield self._run(super(AsyncSessionManager, self).load, *managers)
+
+    @gen.coroutine
+    def sessions_of(self, value):
+        session_ids = yield self._submit(super(AsyncSessionManager, self).sessions_of, value)
+        raise gen.Return(session_ids)
+
+    @gen.coroutine
+    def delete_sessions_of(self, value):
+        session_ids = yield self._submit(super(AsyncSessionManager, self).delete_sessions_of, value)
+        raise gen.Return(session_ids)
+
+    @gen.coroutine
+    def flush(self):
+        # Changes can only be made after the session id is known, so flushing never needs the cookie.
+        yield self._submit(super(AsyncSessionManager, self).flush)
+
+    @gen.coroutine
+    def __getitem__(self, key):
+        value = yield self.get(key)
+        if value is None:
+            raise KeyError('%s not found in session' % key)
+        raise gen.Return(value)
+
+    def __setitem__(self, key, value):
+        return self.set(key, value)
+
+    def __contains__(self, key):
+        raise TypeError('Use "yield manager.contains(key)" with asynchronous managers')
+
+    def __iter__(self):
+        raise TypeError('Use "yield manager.iterkeys()" with asynchronous managers')
+
+    def _run(self, method, *args):
+        '''
+        Runs "method" in the thread pool, after getting the session id in the
+        IOLoop thread (so that the pool never uses the handler).
+        '''
+
+        self._get_session_id()
+        return self._submit(method, *args)
+
+    def _submit(self, method, *args):
+        return self._get_executor().submit(method, *args)
+
+    @classmethod
+    def _get_executor(cls):
+        with cls.executor_lock:
+            if AsyncSessionManager.executor is None:
+                AsyncSessionManager.executor = ThreadPoolExecutor(cls.MAX_WORKERS)
+        return AsyncSessionManager.executor
+
+
+class AsyncNotificationManager(AsyncSessionManager, NotificationManager):
+    '''
+    Same as NotificationManager, but with the asynchronous methods of
+    AsyncSessionManager, and with "push" and "consume" returning Futures.
+    '''
+
+    @gen.coroutine
+    def push(self, *values):
+        yield self._run(super(AsyncNotificationManager, self).push, *values)
+
+    @gen.coroutine
+    def consume(self, count=None):
+        values = yield self._run(super(AsyncNotificationManager, self).consume, count)
+        raise gen.Return(values)
+
+
+class AsyncSessionMixin(object):
+    '''
+    Same as SessionMixin, but the "session" property is an AsyncSessionManager.
+    '''
+
+    @property
+    def session(self):
+        '''
+        Returns an AsyncSessionManager instance
+        '''
+
+        return create_mixin(self, '__session_manager', AsyncSessionManager)
+
+
+class AsyncNotificationMixin(object):
+    '''
+    Same as NotificationMixin, but the "notifications" property is an
+    AsyncNotificationManager.
+    '''
+
+    @property
+    def notifications(self):
+        '''
+        Returns an AsyncNotificationManager instance
+        '''
+
+        return create_mixin(self, '__notification_manager', AsyncNotificationManager)
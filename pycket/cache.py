@@ -0,0 +1,142 @@
+'''
+This module contains the in-process session cache that the drivers can keep
+in front of the datastore, when the "cache" setting is used.
+
+The cache is bounded by a maximum number of sessions and, optionally, by the
+total size of their stored payloads, evicting the least recently used sessions
+first, and each session is only kept for a limited time (so that, even if an
+invalidation message is lost, stale sessions don't live for long).
+
+The sessions are kept already deserialized, and the cache hands out (and
+keeps) copies of them, so changing a session, or its values in place, doesn't
+change the cached one. Only the immutable values (and the values of lazy
+sessions that are still serialized) are shared, while the others are deep
+copied.
+'''
+
+from collections import OrderedDict
+from copy import deepcopy
+import threading
+import time
+
+from pycket.lazy import LazySession
+from pycket.memory import is_immutable
+
+
+class SessionCache(object):
+    DEFAULT_MAX_ENTRIES = 10000
+    DEFAULT_TTL = 60
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=None, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, session_id):
+        '''
+        Returns a copy of the cached session, or None if it's not cached (or
+        expired).
+        '''
+
+        session_id = _text(session_id)
+        with self.lock:
+            entry = self.entries.pop(session_id, None)
+            if entry is None or entry[2] < time.time():
+                if entry is not None:
+                    self.size -= entry[1]
+                self.misses += 1
+                return None
+            self.entries[session_id] = entry
+            self.hits += 1
+        return _copy(entry[0])
+
+    def set(self, session_id, session, size):
+        '''
+        Caches a copy of "session", whose stored payload has "size" bytes.
+        '''
+
+        session_id = _text(session_id)
+        entry = (_copy(session), size, time.time() + self.ttl)
+        with self.lock:
+            self._remove(session_id)
+            self.entries[session_id] = entry
+            self.size += size
+            self._evict()
+
+    def invalidate(self, session_id):
+        with self.lock:
+            if self._remove(_text(session_id)):
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        '''
+        Returns the "hits", "misses", "evictions" and "invalidations" counters,
+        and the number of "entries" and "bytes" currently cached.
+        '''
+
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self.entries),
+                'bytes': self.size,
+            }
+
+    def _remove(self, session_id):
+        entry = self.entries.pop(session_id, None)
+        if entry is None:
+            return False
+        self.size -= entry[1]
+        return True
+
+    def _evict(self):
+        while self.entries and self._is_full():
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry[1]
+            self.evictions += 1
+
+    def _is_full(self):
+        if len(self.entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.size > self.max_bytes
+
+
+def _copy(session):
+    copied = session.copy()
+    values = copied.values if isinstance(copied, LazySession) else copied
+    for name, value in list(values.items()):
+        if not is_immutable(value):
+            values[name] = deepcopy(value)
+    return copied
+
+
+def _text(session_id):
+    # Session ids read from cookies are bytes, but the ids in invalidation messages are text.
+    if isinstance(session_id, bytes):
+        return session_id.decode('utf-8')
+    return session_id
+
+
+def create_cache(settings):
+    '''
+    Creates a cache from the "cache" setting, which is either True (to use the
+    defaults) or a dict with "max_entries", "max_bytes" and/or "ttl".
+    '''
+
+    if settings is True:
+        settings = {}
+    return SessionCache(**settings)
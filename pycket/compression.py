@@ -0,0 +1,137 @@
+'''
+This module contains the compressors that can be used by the drivers to
+compress large sessions before storing them.
+
+Only payloads with at least "threshold" bytes are compressed, and compressed
+payloads are prefixed with a header byte, so compressed and uncompressed data
+can live side by side in the same datastore (and compression can be turned on
+or off at any time).
+
+Supported compressors are:
+- "zlib"
+- "lzma" (Python 3.3+)
+'''
+
+import threading
+import zlib
+
+
+class Compressor(object):
+    TAG = None
+    DEFAULT_THRESHOLD = 1024
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, level=None):
+        self.threshold = threshold
+        self.level = level
+        self.lock = threading.Lock()
+        self.compressed = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def compress(self, data):
+        if len(data) < self.threshold:
+            self._count(skipped=1)
+            return data
+        compressed_data = self.TAG + self._compress(data)
+        if len(compressed_data) >= len(data):
+            self._count(skipped=1)
+            return data
+        self._count(compressed=1, bytes_in=len(data), bytes_out=len(compressed_data))
+        return compressed_data
+
+    def decompress(self, data):
+        return self._decompress(data[len(self.TAG):])
+
+    def stats(self):
+        '''
+        Returns how many payloads were "compressed" and "skipped" (because they
+        were too small, or wouldn't get smaller), the total "bytes_in" and
+        "bytes_out" of the compressed payloads and their compression "ratio".
+        '''
+
+        with self.lock:
+            ratio = float(self.bytes_out) / self.bytes_in if self.bytes_in else 1.0
+            return {
+                'compressed': self.compressed,
+                'skipped': self.skipped,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'ratio': ratio,
+            }
+
+    def _count(self, compressed=0, skipped=0, bytes_in=0, bytes_out=0):
+        with self.lock:
+            self.compressed += compressed
+            self.skipped += skipped
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+
+class ZlibCompressor(Compressor):
+    TAG = b'\x10'
+
+    def _compress(self, data):
+        if self.level is None:
+            return zlib.compress(data)
+        return zlib.compress(data, self.level)
+
+    def _decompress(self, data):
+        return zlib.decompress(data)
+
+
+class LZMACompressor(Compressor):
+    TAG = b'\x11'
+
+    def __init__(self, threshold=Compressor.DEFAULT_THRESHOLD, level=None):
+        import lzma
+        self.lzma = lzma
+        super(LZMACompressor, self).__init__(threshold, level)
+
+    def _compress(self, data):
+        return self.lzma.compress(data, preset=self.level)
+
+    def _decompress(self, data):
+        return self.lzma.decompress(data)
+
+
+COMPRESSORS = {
+    'zlib': ZlibCompressor,
+    'lzma': LZMACompressor,
+}
+
+TAGGED_COMPRESSORS = dict((compressor.TAG, compressor) for compressor in COMPRESSORS.values())
+
+
+def create_compressor(settings):
+    '''
+    Creates a compressor from its name, or from a dict with its "algorithm"
+    and, optionally, its "threshold" (in bytes) and "level".
+    '''
+
+    if isinstance(settings, Compressor):
+        return settings
+    if not isinstance(settings, dict):
+        settings = {'algorithm': settings}
+    settings = dict(settings)
+    algorithm = settings.pop('algorithm', 'zlib')
+    if algorithm not in COMPRESSORS:
+        raise ValueError('Compression algorithm "%s" is not supported' % algorithm)
+    return COMPRESSORS[algorithm](**settings)
+
+
+_readers = {}
+
+
+def decompress(data):
+    '''
+    Decompresses "data" with the compressor that compressed it, or returns it
+    untouched if it's not compressed.
+    '''
+
+    tag = data[:1]
+    if tag not in TAGGED_COMPRESSORS:
+        return data
+    if tag not in _readers:
+        _readers[tag] = TAGGED_COMPRESSORS[tag]()
+    return _readers[tag].decompress(data)
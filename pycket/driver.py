@@ -2,36 +2,481 @@
 This module is for internal use, only. It contains datastore drivers to be used
 with the session and notification managers.
 '''
+from collections import OrderedDict
 from copy import copy
-import pickle
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from uuid import uuid4
+
+from pycket import lazy
+from pycket.cache import create_cache
+from pycket.compression import create_compressor, decompress
+from pycket.hashring import HashRing
+from pycket.memory import MemoryStore, estimate_size, is_immutable
+from pycket.metrics import create_metrics
+from pycket.offload import create_offloader, is_reference, MissingBlobError, reference_digest
+from pycket.serializer import PickleSerializer, create_serializer, deserialize
 
 
 class Driver(object):
     EXPIRE_SECONDS = 24 * 60 * 60
+    DEFAULT_TOUCH_INTERVAL = 60
+    MAX_UPDATE_ATTEMPTS = 20
+    DEFAULT_MAX_QUEUE_LENGTH = 100
+    DEFAULT_SCAN_BATCH = 500
+    INSTRUMENTED_OPERATIONS = ('get', 'set', 'get_value', 'keys', 'contains', 'update', 'pop', 'pop_all', 'save',
+                               'get_many', 'set_many', 'get_together', 'update_many', 'delete_many', 'ttl_many',
+                               'sessions_of', 'delete_sessions_of', 'push', 'consume')
+    INDEXABLE = False
+    # Drivers that offload values implement _store_blob, _fetch_blob, _touch_blobs and _load_raw_values.
+    OFFLOADABLE = False
 
     client = None
+    serializer = PickleSerializer()
+    compressor = None
+    lazy_values = False
+    touches = None
+    cache = None
+    metrics = None
+    index = None
+    index_refreshes = None
+    offloader = None
+    blob_refreshes = None
+    session_blob_refreshes = None
+    max_queue_length = DEFAULT_MAX_QUEUE_LENGTH
+
+    def configure(self, options, storage_category=None):
+        '''
+        Applies the driver options from the "pycket" settings.
+        '''
+
+        if 'serializer' in options:
+            self.serializer = create_serializer(options['serializer'])
+        if options.get('compression'):
+            self.compressor = create_compressor(options['compression'])
+        self.lazy_values = bool(options.get('lazy_values'))
+        self._configure_expiration(options, storage_category)
+        if options.get('cache'):
+            self.cache = create_cache(options['cache'])
+        if options.get('max_notifications'):
+            self.max_queue_length = options['max_notifications']
+        if options.get('index') and storage_category != 'db_notifications':
+            self._configure_index(options['index'])
+        if options.get('offload'):
+            self._configure_offload(options['offload'])
+        if options.get('metrics'):
+            self._configure_metrics(options['metrics'])
+
+    def _configure_expiration(self, options, storage_category):
+        expire_seconds = options.get('expire_seconds')
+        if isinstance(expire_seconds, dict):
+            expire_seconds = expire_seconds.get(storage_category)
+        if expire_seconds is not None:
+            self.EXPIRE_SECONDS = expire_seconds
+        sliding_expiration = options.get('sliding_expiration')
+        if sliding_expiration:
+            interval = self.DEFAULT_TOUCH_INTERVAL if sliding_expiration is True else sliding_expiration
+            self.touches = TouchThrottle(interval)
+
+    def _configure_index(self, index):
+        if not self.INDEXABLE:
+            raise NotImplementedError('Indexing sessions is not supported by this engine')
+        self.index = index
+        # The indexes outlive their sessions by an interval, in which each session refreshes its index at most once.
+        self.index_refreshes = TouchThrottle(self.DEFAULT_TOUCH_INTERVAL if self.touches is None
+                                             else self.touches.interval)
+
+    def _configure_offload(self, settings):
+        if not self.OFFLOADABLE:
+            raise NotImplementedError('Offloading values is not supported by this engine')
+        self.offloader = create_offloader(settings)
+        self.blob_refreshes = TouchThrottle(self.offloader.refresh_interval)
+        self.session_blob_refreshes = TouchThrottle(self.offloader.refresh_interval)
+
+    def _configure_metrics(self, settings):
+        self.metrics = create_metrics(settings)
+        for operation in self.INSTRUMENTED_OPERATIONS:
+            setattr(self, operation, self.metrics.instrument(operation, getattr(self, operation)))
+        # Touches are only measured when they reach the datastore (and not when they're throttled).
+        self._touch = self.metrics.instrument('touch', self._touch)
+
+    def touch(self, session_id):
+        '''
+        Refreshes the expiration of the session, without rewriting it, if
+        sliding expiration is enabled and the session wasn't touched (or
+        written) in the last interval.
+        '''
+
+        if self.touches is None or not self.touches.should_touch(session_id):
+            return
+        self._setup_client()
+        self._touch(session_id)
+        self._refresh_session_blobs(session_id)
+
+    def _written(self, session_id, session=None, size=0):
+        if self.touches is not None:
+            self.touches.mark(session_id)
+        if self.metrics is not None and session is not None:
+            self.metrics.payload('bytes_written', size)
+            self.metrics.payload('raw_bytes_written', estimate_size(session))
+        if self.cache is not None:
+            if session is None:
+                self.cache.invalidate(session_id)
+            else:
+                self.cache.set(session_id, session, size)
+            self._publish_invalidation(session_id)
+
+    def _publish_invalidation(self, session_id):
+        pass
+
+    def _encode(self, value):
+        data = self.serializer.dumps(value)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if self.offloader is not None and self.offloader.should_offload(data):
+            data = self._offload(data)
+        return data
+
+    def _decode(self, data):
+        if is_reference(data):
+            data = self._load_blob(reference_digest(data))
+        return deserialize(decompress(data))
+
+    def _encode_session(self, session):
+        # Offloading works on each value, so the sessions are then stored in the lazy format, item by item.
+        if self.lazy_values or self.offloader is not None:
+            return lazy.dumps(session, self._encode)
+        if isinstance(session, lazy.LazySession):
+            session = dict(session)
+        return self._encode(session)
 
     def _to_dict(self, raw_session):
         if raw_session is None:
             return {}
+        elif lazy.is_record(raw_session):
+            session = lazy.loads(raw_session, self._decode)
+            self._refresh_blobs(session.raw_values.values())
+            return session
         else:
-            return pickle.loads(raw_session)
+            return self._decode(raw_session)
+
+    def _offload(self, data):
+        '''
+        Returns a reference to the blob with "data", uploading the blob only
+        if it's not known to exist (as it does if it was uploaded, or had its
+        expiration refreshed, in the last refresh interval).
+        '''
+
+        digest = self.offloader.digest(data)
+        if self.blob_refreshes.should_touch(digest):
+            self._setup_client()
+            try:
+                if self._store_blob(self._blob_id(digest), data):
+                    self.offloader.count(uploaded=1)
+            except Exception:
+                self.blob_refreshes.forget(digest)
+                raise
+        self.offloader.cache(digest, data)
+        self.offloader.count(offloaded=1)
+        return self.offloader.reference(digest)
+
+    def _load_blob(self, digest):
+        data = None if self.offloader is None else self.offloader.cached(digest)
+        if data is not None:
+            return data
+        self._setup_client()
+        data = self._fetch_blob(self._blob_id(digest))
+        if data is None:
+            raise MissingBlobError(digest)
+        if self.offloader is not None:
+            self.offloader.cache(digest, data)
+            self.offloader.count(fetched=1)
+        return data
+
+    def _refresh_blobs(self, raw_values):
+        '''
+        Refreshes the expiration of the blobs referenced by "raw_values" (the
+        values of a session, still serialized), so that they live as long as
+        the sessions that use them. Blobs that turn out to be missing are
+        forgotten, to be uploaded again by the next session that uses them.
+        '''
+
+        if self.offloader is None:
+            return
+        digests = [reference_digest(raw_value) for raw_value in raw_values if is_reference(raw_value)]
+        digests = [digest for digest in digests if self.blob_refreshes.should_touch(digest)]
+        if not digests:
+            return
+        self._setup_client()
+        refreshed = self._touch_blobs([self._blob_id(digest) for digest in digests])
+        for digest, exists in zip(digests, refreshed):
+            if not exists:
+                self.blob_refreshes.forget(digest)
+
+    def _refresh_session_blobs(self, session_id):
+        '''
+        Refreshes the expiration of all the blobs referenced by the session,
+        for the writes that extend the session's expiration without reading
+        the whole session (like touches), at most once per refresh interval.
+        Otherwise, the blobs of values that aren't read could expire before
+        the session.
+        '''
+
+        if self.offloader is None or not self.session_blob_refreshes.should_touch(session_id):
+            return
+        self._refresh_blobs(self._load_raw_values(session_id))
+
+    def _blob_id(self, digest):
+        return '%s:blob' % digest
+
+    def _blob_expire_seconds(self):
+        # Blobs are refreshed at most once per interval, so they must outlive the sessions by more than that.
+        return self.EXPIRE_SECONDS + 2 * self.offloader.refresh_interval
 
     def _setup_client(self):
         if self.client is None:
             self._create_client()
 
     def get(self, session_id):
+        session = self._cached(session_id)
+        if session is not None:
+            return session
         self._setup_client()
+        session, size = self._load(session_id)
+        self._loaded(session_id, session, size)
+
+        return session
+
+    def get_together(self, session_id, drivers):
+        '''
+        Returns a list with the sessions of "session_id" in this driver and in
+        each of the other "drivers" (like the session and the notifications
+        of a request). Drivers override this to get all of them in a single
+        round trip, when the drivers share the connection.
+        '''
+
+        return [self.get(session_id)] + [driver.get(session_id) for driver in drivers]
+
+    def _cached(self, session_id):
+        if self.cache is None:
+            return None
+        session = self.cache.get(session_id)
+        if self.metrics is not None:
+            self.metrics.cache(session is not None)
+        return session
+
+    def _loaded(self, session_id, session, size):
+        if self.metrics is not None:
+            self.metrics.payload('bytes_read', size)
+        if self.cache is not None:
+            self.cache.set(session_id, session, size)
+
+    def _load(self, session_id):
         raw_session = self.client.get(session_id)
 
-        return self._to_dict(raw_session)
+        return self._to_dict(raw_session), len(raw_session or b'')
 
     def set(self, session_id, session):
-        pickled_session = pickle.dumps(session)
+        serialized_session = self._encode_session(session)
         self._setup_client()
 
-        self._set_and_expire(session_id, pickled_session)
+        self._set_and_expire(session_id, serialized_session)
+        self._written(session_id, session, len(serialized_session))
+
+    def get_value(self, session_id, name, default=None):
+        return self.get(session_id).get(name, default)
+
+    def keys(self, session_id):
+        return list(self.get(session_id).keys())
+
+    def contains(self, session_id, name):
+        return name in self.get(session_id)
+
+    def update(self, session_id, values, deleted_names=()):
+        '''
+        Sets the "values" (a dict) in the session and removes the
+        "deleted_names" from it.
+        '''
+
+        def change(session):
+            self._apply(session, values, deleted_names)
+            return None, True
+        self._change(session_id, change)
+
+    def pop(self, session_id, name, default=None):
+        '''
+        Removes "name" from the session and returns its value, or "default" if
+        it's not in the session.
+        '''
+
+        def change(session):
+            if name not in session:
+                return default, False
+            return session.pop(name), True
+        return self._change(session_id, change)
+
+    def pop_all(self, session_id):
+        '''
+        Removes all the values from the session and returns them in a dict.
+        '''
+
+        def change(session):
+            values = dict(session)
+            session.clear()
+            return values, bool(values)
+        return self._change(session_id, change)
+
+    def get_many(self, session_ids):
+        '''
+        Returns a dict with the sessions of all the "session_ids" (with empty
+        dicts for the sessions that don't exist). Drivers override this to get
+        all the sessions in a single round trip.
+        '''
+
+        return dict((session_id, self.get(session_id)) for session_id in session_ids)
+
+    def set_many(self, sessions):
+        '''
+        Writes all the "sessions" (a dict of session ids to sessions). Drivers
+        override this to write all the sessions in a single round trip.
+        '''
+
+        for session_id, session in sessions.items():
+            self.set(session_id, session)
+
+    def update_many(self, changes):
+        '''
+        Applies "changes" (a dict of session ids to tuples of values and
+        deleted names, as in update()) to the sessions that still exist,
+        keeping their expiration, so that bulk changes (like removing an
+        obsolete item from all the sessions) neither bring back deleted
+        sessions nor keep idle ones alive.
+        '''
+
+        raise NotImplementedError('Changing sessions in bulk is not supported by this engine')
+
+    def delete_many(self, session_ids):
+        '''
+        Deletes all the sessions of "session_ids". Drivers override this to
+        delete all of them in a single round trip.
+        '''
+
+        for session_id in session_ids:
+            self.pop_all(session_id)
+
+    def scan(self, batch_size=DEFAULT_SCAN_BATCH):
+        '''
+        Yields lists of (about) "batch_size" ids of the stored sessions, going
+        through all of them without loading them all at once. Sessions
+        written during the scan may or may not be listed.
+        '''
+
+        raise NotImplementedError('Listing sessions is not supported by this engine')
+
+    def ttl_many(self, session_ids):
+        '''
+        Returns a dict with the number of seconds left until each session of
+        "session_ids" expires (or None, if it doesn't exist).
+        '''
+
+        raise NotImplementedError('Reading expiration times is not supported by this engine')
+
+    def sessions_of(self, value):
+        '''
+        Returns a list with the ids of the sessions whose indexed item (see
+        the "index" option) is "value", like the sessions of a user.
+        '''
+
+        raise NotImplementedError('Indexing sessions is not supported by this engine')
+
+    def delete_sessions_of(self, value):
+        '''
+        Deletes all the sessions whose indexed item is "value" (like all the
+        sessions of a user, to log them out everywhere), and returns a list
+        with their ids.
+        '''
+
+        raise NotImplementedError('Indexing sessions is not supported by this engine')
+
+    def push(self, session_id, values):
+        '''
+        Appends "values" to the end of the queue of the session, dropping the
+        oldest values if the queue gets longer than "max_queue_length".
+        '''
+
+        raise NotImplementedError('Queues are not supported by this engine')
+
+    def consume(self, session_id, count=None):
+        '''
+        Removes and returns (in a list) the "count" oldest values from the
+        queue of the session, or all of them, if "count" is None.
+        '''
+
+        raise NotImplementedError('Queues are not supported by this engine')
+
+    def _queue_id(self, session_id):
+        return '%s:queue' % session_id
+
+    def _is_queue_id(self, key):
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        return key.endswith(self._queue_id(''))
+
+    def _index_id(self, value):
+        '''
+        Returns the id under which the ids of the sessions whose indexed item
+        is "value" are kept (as a set).
+        '''
+
+        if self.index is None:
+            raise ValueError('The sessions are not indexed (see the "index" setting)')
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return '%s:%s:index' % (self.index, value)
+
+    def _is_session_id(self, key):
+        '''
+        Tells if the key is the id of a session, and not of a queue, an index
+        or a blob.
+        '''
+
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        return not key.endswith((self._queue_id(''), ':index', self._blob_id('')))
+
+    def _indexed_value(self, session):
+        if self.index is None:
+            return None
+        return session.get(self.index)
+
+    def save(self, session_id, session, changed_values, deleted_names):
+        '''
+        Persists a session that was fully loaded and then changed, knowing
+        which values were changed and which names were deleted from it. Only
+        the changes are applied, so that changes made to the session by other
+        requests in the meantime are kept.
+        '''
+
+        self.update(session_id, changed_values, deleted_names)
+
+    def _apply(self, session, values, deleted_names):
+        for name in deleted_names:
+            session.pop(name, None)
+        session.update(values)
+
+    def pool_stats(self):
+        '''
+        Returns a dict with the "pool_size" (connections opened by the client)
+        and "in_use" (connections currently taken) for this driver.
+        '''
+
+        if self.client is None:
+            return {'pool_size': 0, 'in_use': 0}
+        return self._pool_stats()
 
 
 class RedisDriver(Driver):
@@ -40,58 +485,1453 @@ class RedisDriver(Driver):
         'db_notifications': 1,
     }
 
-    def __init__(self, settings):
+    SCRIPTS = {
+        'get_and_delete': '''
+            local session = redis.call('GET', KEYS[1])
+            redis.call('DEL', KEYS[1])
+            return session
+        ''',
+        'hash_pop': '''
+            local value = redis.call('HGET', KEYS[1], ARGV[1])
+            if value then
+                redis.call('HDEL', KEYS[1], ARGV[1])
+            end
+            return value
+        ''',
+        'hash_pop_all': '''
+            local values = redis.call('HGETALL', KEYS[1])
+            redis.call('DEL', KEYS[1])
+            return values
+        ''',
+        'consume': '''
+            local values = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+            redis.call('LTRIM', KEYS[1], #values, -1)
+            return values
+        ''',
+        'index_add': '''
+            redis.call('SADD', KEYS[1], ARGV[2])
+            redis.call('EXPIRE', KEYS[1], ARGV[3])
+            for _, session_id in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+                if redis.call('EXISTS', ARGV[1] .. session_id) == 0 then
+                    redis.call('SREM', KEYS[1], session_id)
+                end
+            end
+        ''',
+        'index_members': '''
+            local session_ids = {}
+            for _, session_id in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+                if redis.call('EXISTS', ARGV[1] .. session_id) == 0 then
+                    redis.call('SREM', KEYS[1], session_id)
+                else
+                    table.insert(session_ids, session_id)
+                end
+            end
+            return session_ids
+        ''',
+        'index_delete': '''
+            local session_ids = {}
+            for _, session_id in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+                if redis.call('DEL', ARGV[1] .. session_id) == 1 then
+                    table.insert(session_ids, session_id)
+                end
+            end
+            redis.call('DEL', KEYS[1])
+            return session_ids
+        ''',
+    }
+
+    KEY_NAMESPACES = {
+        'db_sessions': 'sessions:',
+        'db_notifications': 'notifications:',
+    }
+
+    DEFAULT_REPLICA_LAG = 5
+    RESUBSCRIBE_INTERVAL = 1
+    INDEXABLE = True
+    OFFLOADABLE = True
+
+    ring = None
+    recent_writes = None
+    key_prefix = None
+
+    def __init__(self, settings, storage_category='db_sessions'):
         self.settings = settings
+        if settings.get('key_prefix') is not None:
+            self.key_prefix = settings['key_prefix'] + self.KEY_NAMESPACES[storage_category]
+        self.origin = uuid4().hex
+        self.scripts = {}
+        self.clients = {}
+        self.replicas = {}
+
+    def _client_for(self, session_id):
+        '''
+        Returns the client of the node where the session (and its queue) is
+        stored.
+        '''
+
+        if self.ring is None:
+            return self.client
+        return self.clients[self.ring.get_node(session_id)]
+
+    def _key(self, session_id):
+        '''
+        Returns the Redis key of the session: its id, or, with the
+        "key_prefix" setting, its id prefixed by the key prefix and by the
+        namespace of the storage category (so that sessions and notifications
+        can share a database).
+        '''
+
+        if self.key_prefix is None:
+            return session_id
+        if isinstance(session_id, bytes):
+            session_id = session_id.decode('utf-8')
+        return self.key_prefix + session_id
+
+    def _session_id(self, key):
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        if self.key_prefix is None:
+            return key
+        return key[len(self.key_prefix):]
 
-    def _set_and_expire(self, session_id, pickled_session):
-        self.client.set(session_id, pickled_session)
-        self.client.expire(session_id, self.EXPIRE_SECONDS)
+    def _group_by_client(self, session_ids):
+        '''
+        Returns a list of tuples with a client and the ids of the sessions
+        stored in its node.
+        '''
+
+        if self.ring is None:
+            return [(self.client, list(session_ids))]
+        groups = OrderedDict()
+        for session_id in session_ids:
+            groups.setdefault(self.ring.get_node(session_id), []).append(session_id)
+        return [(self.clients[node], node_session_ids) for node, node_session_ids in groups.items()]
+
+    def _reader_for(self, session_id):
+        '''
+        Returns the client to read the session from: one of the replicas of
+        its node, if there are any, unless the session was written by this
+        process in the last "replica_lag" seconds, in which case the replicas
+        might not have the changes yet, so the primary is used.
+        '''
+
+        replicas = self.replicas.get(None if self.ring is None else self.ring.get_node(session_id))
+        if not replicas or session_id in self.recent_writes:
+            return self._client_for(session_id)
+        return random.choice(replicas)
+
+    def _written(self, session_id, session=None, size=0):
+        if self.recent_writes is not None:
+            self.recent_writes.mark(session_id)
+        super(RedisDriver, self)._written(session_id, session, size)
+
+    def _load(self, session_id):
+        return self._parse_session(self._reader_for(session_id).get(self._key(session_id)))
+
+    def _queue_load(self, pipeline, session_id):
+        pipeline.get(self._key(session_id))
+
+    def _parse_session(self, raw_session):
+        return self._to_dict(raw_session), len(raw_session or b'')
+
+    def get_together(self, session_id, drivers):
+        '''
+        Gets the sessions in a single pipeline, when all the drivers use the
+        same client (as with the "key_prefix" setting); sessions found in the
+        caches of the drivers aren't fetched.
+        '''
+
+        for driver in drivers:
+            driver._setup_client()
+        self._setup_client()
+        client = self._client_for(session_id)
+        if not all(getattr(driver, '_queue_load', None) and driver._client_for(session_id) is client
+                   for driver in drivers):
+            return super(RedisDriver, self).get_together(session_id, drivers)
+        drivers = [self] + list(drivers)
+        if any(session_id in driver.recent_writes for driver in drivers):
+            reader = client
+        else:
+            reader = self._reader_for(session_id)
+        sessions = [driver._cached(session_id) for driver in drivers]
+        missing = [index for index, session in enumerate(sessions) if session is None]
+        if missing:
+            pipeline = reader.pipeline(transaction=False)
+            for index in missing:
+                drivers[index]._queue_load(pipeline, session_id)
+            for index, raw_session in zip(missing, pipeline.execute()):
+                sessions[index], size = drivers[index]._parse_session(raw_session)
+                drivers[index]._loaded(session_id, sessions[index], size)
+        return sessions
+
+    def get_many(self, session_ids):
+        '''
+        Gets the sessions (that aren't cached) with a pipeline for each node.
+        '''
+
+        self._setup_client()
+        sessions = {}
+        for session_id in session_ids:
+            session = self._cached(session_id)
+            if session is not None:
+                sessions[session_id] = session
+        missing_ids = [session_id for session_id in session_ids if session_id not in sessions]
+        for client, node_session_ids in self._group_by_client(missing_ids):
+            pipeline = client.pipeline(transaction=False)
+            for session_id in node_session_ids:
+                self._queue_load(pipeline, session_id)
+            for session_id, raw_session in zip(node_session_ids, pipeline.execute()):
+                sessions[session_id], size = self._parse_session(raw_session)
+                self._loaded(session_id, sessions[session_id], size)
+        return sessions
+
+    def update_many(self, changes):
+        '''
+        Changes the sessions in a transaction for each node, which watches,
+        reads and writes all of its sessions in pipelines; if any of them is
+        changed by someone else in the meantime, the sessions of the node are
+        updated one by one.
+        '''
+
+        self._setup_client()
+        for client, session_ids in self._group_by_client(changes):
+            if self._update_existing(client, session_ids, changes):
+                continue
+            for session_id in session_ids:
+                for _ in range(self.MAX_UPDATE_ATTEMPTS):
+                    if self._update_existing(client, [session_id], changes):
+                        break
+                else:
+                    raise UpdateConflictError(session_id, self.MAX_UPDATE_ATTEMPTS)
+
+    def _update_existing(self, client, session_ids, changes):
+        '''
+        Changes the sessions (of a single node) that exist, keeping their
+        expiration, in a transaction. Returns False, without changing
+        anything, if any of them was changed by someone else in the meantime.
+        '''
+
+        import redis
+        keys = [self._key(session_id) for session_id in session_ids]
+        written = []
+        with client.pipeline() as pipeline:
+            try:
+                pipeline.watch(*keys)
+                # Read on another connection, in a single round trip; the watched keys still guard the writes.
+                reader = client.pipeline(transaction=False)
+                for session_id in session_ids:
+                    self._queue_bulk_read(reader, session_id)
+                results = iter(reader.execute())
+                pipeline.multi()
+                for session_id in session_ids:
+                    change = self._queue_bulk_update(pipeline, session_id, results, *changes[session_id])
+                    if change is not None:
+                        written.append((session_id,) + change)
+                pipeline.execute()
+            except redis.WatchError:
+                return False
+        for change in written:
+            self._written(*change)
+        return True
+
+    def _queue_bulk_read(self, pipeline, session_id):
+        key = self._key(session_id)
+        pipeline.get(key)
+        pipeline.pttl(key)
+
+    def _queue_bulk_update(self, pipeline, session_id, results, values, deleted_names):
+        '''
+        Queues the change of a session in the transaction of update_many(),
+        taking the results of what _queue_bulk_read() queued from "results",
+        and returns the written session and its size, or None if the session
+        doesn't exist.
+        '''
+
+        raw_session, ttl = next(results), next(results)
+        if raw_session is None:
+            return None
+        session = self._to_dict(raw_session)
+        old_value = self._indexed_value(session)
+        self._apply(session, values, deleted_names)
+        serialized_session = self._encode_session(session)
+        key = self._key(session_id)
+        pipeline.set(key, serialized_session)
+        if ttl > 0:
+            pipeline.pexpire(key, ttl)
+        self._queue_reindex(pipeline, session_id, old_value, self._indexed_value(session))
+        return session, len(serialized_session)
+
+    def delete_many(self, session_ids):
+        '''
+        Deletes the sessions with a single DEL for each node.
+        '''
+
+        self._setup_client()
+        for client, node_session_ids in self._group_by_client(session_ids):
+            if node_session_ids:
+                client.delete(*[self._key(session_id) for session_id in node_session_ids])
+            for session_id in node_session_ids:
+                self._written(session_id)
+
+    def scan(self, batch_size=Driver.DEFAULT_SCAN_BATCH):
+        '''
+        Goes through the keys of each node with SCAN (which, unlike KEYS,
+        doesn't block Redis while listing them), skipping the queues. Without
+        the "key_prefix" setting, all the keys of the database are taken as
+        session ids. Needs redis-py 2.9+.
+        '''
+
+        self._setup_client()
+        match = '*' if self.key_prefix is None else self.key_prefix + '*'
+        for client in list(self.clients.values()) or [self.client]:
+            cursor = 0
+            while True:
+                cursor, keys = client.scan(cursor, match=match, count=batch_size)
+                session_ids = [self._session_id(key) for key in keys if self._is_session_id(key)]
+                if session_ids:
+                    yield session_ids
+                if int(cursor) == 0:
+                    break
+
+    def ttl_many(self, session_ids):
+        self._setup_client()
+        ttls = {}
+        for client, node_session_ids in self._group_by_client(session_ids):
+            pipeline = client.pipeline(transaction=False)
+            for session_id in node_session_ids:
+                pipeline.ttl(self._key(session_id))
+            for session_id, ttl in zip(node_session_ids, pipeline.execute()):
+                # Older Redis versions return -1 for missing keys, and newer ones return -2.
+                ttls[session_id] = ttl if ttl is not None and ttl >= 0 else None
+        return ttls
+
+    def sessions_of(self, value):
+        '''
+        Reads the index of "value" in each node (where it only has the
+        sessions of the node), dropping the sessions that no longer exist.
+        '''
+
+        self._setup_client()
+        return self._run_index_script('index_members', value)
+
+    def delete_sessions_of(self, value):
+        '''
+        Deletes the sessions listed in the index of "value", and the index,
+        with a single (atomic) script for each node.
+        '''
+
+        self._setup_client()
+        session_ids = self._run_index_script('index_delete', value)
+        for session_id in session_ids:
+            self._written(session_id)
+        return session_ids
+
+    def _run_index_script(self, name, value):
+        key = self._key(self._index_id(value))
+        session_ids = []
+        for client in list(self.clients.values()) or [self.client]:
+            session_ids.extend(self._to_name(session_id) for session_id in
+                               self._script(name)(keys=[key], args=[self._key('')], client=client))
+        return session_ids
+
+    def _queue_reindex(self, pipeline, session_id, old_value, new_value):
+        '''
+        Queues moving the session from the index of its old indexed value to
+        the index of the new one, in the transaction that writes the session,
+        and extending the expiration of the new index, so that it outlives the
+        session. The indexes are kept in the node of each session, and the
+        sessions that no longer exist are dropped from an index whenever a
+        session is added to it.
+        '''
+
+        old_id = None if old_value is None else self._index_id(old_value)
+        new_id = None if new_value is None else self._index_id(new_value)
+        if new_id is not None:
+            self.index_refreshes.mark(session_id)
+        if old_id == new_id:
+            if new_id is not None:
+                pipeline.expire(self._key(new_id), self._index_expire_seconds())
+            return
+        member = self._to_name(session_id)
+        if old_id is not None:
+            pipeline.srem(self._key(old_id), member)
+        if new_id is not None:
+            self._script('index_add')(keys=[self._key(new_id)],
+                                      args=[self._key(''), member, self._index_expire_seconds()], client=pipeline)
+
+    def _index_expire_seconds(self):
+        return self.EXPIRE_SECONDS + self.index_refreshes.interval
+
+    def _refresh_index(self, session_id):
+        '''
+        Extends the expiration of the index of the session, for the writes
+        that extend the session's expiration without knowing its indexed
+        value (like touches), at most once per interval.
+        '''
+
+        if self.index is None or not self.index_refreshes.should_touch(session_id):
+            return
+        client = self._client_for(session_id)
+        value = self._load_indexed_value(client, session_id)
+        if value is not None:
+            client.expire(self._key(self._index_id(value)), self._index_expire_seconds())
+
+    def _load_indexed_value(self, client, session_id):
+        return self._indexed_value(self._to_dict(client.get(self._key(session_id))))
+
+    def _to_name(self, raw_name):
+        if isinstance(raw_name, bytes):
+            return raw_name.decode('utf-8')
+        return raw_name
+
+    def set(self, session_id, session):
+        '''
+        Writes the session, in a transaction that also updates the index when
+        the sessions are indexed.
+        '''
+
+        if self.index is None:
+            return super(RedisDriver, self).set(session_id, session)
+
+        def change(stored_session):
+            stored_session.clear()
+            stored_session.update(session)
+            return None, True
+        self._change(session_id, change)
+
+    def _set_and_expire(self, session_id, serialized_session):
+        client = self._client_for(session_id)
+        client.set(self._key(session_id), serialized_session)
+        client.expire(self._key(session_id), self.EXPIRE_SECONDS)
+
+    def _store_blob(self, blob_id, data):
+        '''
+        Refreshes the expiration of the blob, with EXPIRE (which also tells
+        whether it exists), and only uploads it if it doesn't exist, returning
+        whether it was uploaded. Blobs are spread among the nodes by their
+        ids, like the sessions.
+        '''
+
+        client = self._client_for(blob_id)
+        key = self._key(blob_id)
+        if client.expire(key, self._blob_expire_seconds()):
+            return False
+        pipeline = client.pipeline()
+        pipeline.set(key, data)
+        pipeline.expire(key, self._blob_expire_seconds())
+        pipeline.execute()
+        return True
+
+    def _fetch_blob(self, blob_id):
+        # Blobs are read from the primary, since a lagging replica might not have them yet.
+        return self._client_for(blob_id).get(self._key(blob_id))
+
+    def _load_raw_values(self, session_id):
+        raw_session = self._reader_for(session_id).get(self._key(session_id))
+        if raw_session is None or not lazy.is_record(raw_session):
+            return []
+        return lazy.loads(raw_session, self._decode).raw_values.values()
+
+    def _touch_blobs(self, blob_ids):
+        '''
+        Refreshes the expiration of the blobs, and returns a list telling
+        whether each of them exists.
+        '''
+
+        exists = {}
+        for client, node_blob_ids in self._group_by_client(blob_ids):
+            pipeline = client.pipeline(transaction=False)
+            for blob_id in node_blob_ids:
+                pipeline.expire(self._key(blob_id), self._blob_expire_seconds())
+            for blob_id, refreshed in zip(node_blob_ids, pipeline.execute()):
+                exists[blob_id] = bool(refreshed)
+        return [exists[blob_id] for blob_id in blob_ids]
+
+    def _touch(self, session_id):
+        self._client_for(session_id).expire(self._key(session_id), self.EXPIRE_SECONDS)
+        self._refresh_index(session_id)
+
+    def pop_all(self, session_id):
+        if self.index is not None:
+            # The session has to be decoded to know which index it's in.
+            return super(RedisDriver, self).pop_all(session_id)
+        self._setup_client()
+        raw_session = self._run_script('get_and_delete', session_id, keys=[self._key(session_id)])
+        self._written(session_id)
+        return dict(self._to_dict(raw_session))
+
+    def push(self, session_id, values):
+        '''
+        Appends "values" to a Redis list, in a single round trip.
+        '''
+
+        if not values:
+            # RPUSH needs at least one value.
+            return
+        self._setup_client()
+        queue_id = self._key(self._queue_id(session_id))
+        pipeline = self._client_for(session_id).pipeline()
+        pipeline.rpush(queue_id, *[self._encode(value) for value in values])
+        pipeline.ltrim(queue_id, -self.max_queue_length, -1)
+        pipeline.expire(queue_id, self.EXPIRE_SECONDS)
+        pipeline.execute()
+
+    def consume(self, session_id, count=None):
+        '''
+        Removes and returns the oldest values from the Redis list, in a single
+        (atomic) round trip.
+        '''
+
+        self._setup_client()
+        raw_values = self._run_script('consume', session_id, keys=[self._key(self._queue_id(session_id))],
+                                      args=[count or 0])
+        return [self._decode(raw_value) for raw_value in raw_values]
+
+    def _change(self, session_id, change):
+        '''
+        Calls "change" with the session, which returns a result and whether it
+        changed the session, and writes the session (if changed) in a
+        transaction that fails if the session is changed by someone else
+        before it's written, in which case it's read and changed again. Every
+        driver implements this, to make update, pop and pop_all atomic.
+        '''
+
+        import redis
+        self._setup_client()
+        key = self._key(session_id)
+        with self._client_for(session_id).pipeline() as pipeline:
+            for _ in range(self.MAX_UPDATE_ATTEMPTS):
+                try:
+                    pipeline.watch(key)
+                    session = self._to_dict(pipeline.get(key))
+                    old_value = self._indexed_value(session)
+                    result, changed = change(session)
+                    if not changed:
+                        pipeline.unwatch()
+                        return result
+                    serialized_session = self._encode_session(session)
+                    pipeline.multi()
+                    pipeline.set(key, serialized_session)
+                    pipeline.expire(key, self.EXPIRE_SECONDS)
+                    self._queue_reindex(pipeline, session_id, old_value, self._indexed_value(session))
+                    pipeline.execute()
+                    break
+                except redis.WatchError:
+                    continue
+            else:
+                raise UpdateConflictError(session_id, self.MAX_UPDATE_ATTEMPTS)
+        self._written(session_id, session, len(serialized_session))
+        return result
+
+    def _script(self, name):
+        if name not in self.scripts:
+            self.scripts[name] = self.client.register_script(self.SCRIPTS[name])
+        return self.scripts[name]
+
+    def _run_script(self, name, session_id, keys, args=()):
+        return self._script(name)(keys=keys, args=list(args), client=self._client_for(session_id))
 
     def _create_client(self):
+        '''
+        Creates a client (with its own connection pool) for each of the
+        "nodes" in the settings, if they're provided, spreading the sessions
+        among them with consistent hashing; otherwise, creates a single client.
+        The client of the first node is also used for the invalidations.
+        '''
+
+        settings = copy(self.settings)
+        settings.pop('key_prefix', None)
+        nodes = settings.pop('nodes', None)
+        self.recent_writes = RecentWrites(settings.pop('replica_lag', self.DEFAULT_REPLICA_LAG))
+        if nodes:
+            names = []
+            for node in nodes:
+                node = _redis_node_settings(node)
+                names.append(_redis_node_name(node, settings))
+                self.clients[names[-1]], self.replicas[names[-1]] = self._create_node_clients(dict(settings, **node))
+            self.client = self.clients[names[0]]
+            self.ring = HashRing(names)
+        else:
+            self.client, self.replicas[None] = self._create_node_clients(settings)
+        if self.cache is not None:
+            self._listen_for_invalidations()
+
+    def _create_node_clients(self, settings):
+        '''
+        Returns the client of the primary of a node and the clients of its
+        replicas, either listed in "replicas" or discovered with the
+        "sentinel" settings.
+        '''
+
+        settings = copy(settings)
+        replicas = settings.pop('replicas', ())
+        sentinel_settings = settings.pop('sentinel', None)
+        if sentinel_settings is not None:
+            return self._create_sentinel_clients(sentinel_settings, settings)
+        replica_clients = [self._create_node_client(dict(settings, **_redis_node_settings(replica)))
+                           for replica in replicas]
+        return self._create_node_client(settings), replica_clients
+
+    def _create_sentinel_clients(self, sentinel_settings, settings):
+        from redis.sentinel import Sentinel
+        sentinel_settings = copy(sentinel_settings)
+        service = sentinel_settings.pop('service')
+        sentinel = Sentinel(sentinel_settings.pop('sentinels'), **sentinel_settings)
+        settings = copy(settings)
+        settings.pop('host', None)
+        settings.pop('port', None)
+        return sentinel.master_for(service, **settings), [sentinel.slave_for(service, **settings)]
+
+    def _create_node_client(self, settings):
+        if self.key_prefix is not None:
+            # The drivers of all the storage categories use the same database, so they can share the client.
+            return _shared_redis_client(settings)
+        return _create_redis_client(settings)
+
+    def _invalidation_channel(self):
+        if self.key_prefix is not None:
+            return 'pycket:invalidations:%s:%s' % (self.settings.get('db', 0), self.key_prefix)
+        return 'pycket:invalidations:%s' % self.settings.get('db', 0)
+
+    def _publish_invalidation(self, session_id):
+        self.client.publish(self._invalidation_channel(), '%s %s' % (self.origin, self._to_name(session_id)))
+
+    def _listen_for_invalidations(self):
+        thread = threading.Thread(target=self._receive_invalidations, args=(self._subscribe(),))
+        thread.daemon = True
+        thread.start()
+
+    def _subscribe(self):
+        pubsub = self.client.pubsub()
+        pubsub.subscribe(self._invalidation_channel())
+        return pubsub
+
+    def _receive_invalidations(self, pubsub):
         import redis
-        if 'max_connections' in self.settings:
-            connection_pool = redis.ConnectionPool(**self.settings)
-            settings = copy(self.settings)
-            del settings['max_connections']
-            settings['connection_pool'] = connection_pool
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = self._subscribe()
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self._invalidated(message['data'])
+            except redis.ConnectionError:
+                pubsub = None
+                self.cache.clear()
+                time.sleep(self.RESUBSCRIBE_INTERVAL)
+
+    def _invalidated(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        origin, session_id = data.split(' ', 1)
+        if origin != self.origin:
+            self.cache.invalidate(session_id)
+
+    def _pool_stats(self):
+        clients = list(self.clients.values()) or [self.client]
+        for replicas in self.replicas.values():
+            clients.extend(replicas)
+        pools = [client.connection_pool for client in clients]
+        return {
+            'pool_size': sum(pool._created_connections for pool in pools),
+            'in_use': sum(len(pool._in_use_connections) for pool in pools),
+        }
+
+
+class RedisHashDriver(RedisDriver):
+    '''
+    Stores each session as a Redis hash, with one serialized field per session
+    item, so that reading or changing an item doesn't need to transfer (or
+    deserialize) the whole session.
+    '''
+
+    def _load(self, session_id):
+        return self._parse_session(self._reader_for(session_id).hgetall(self._key(session_id)))
+
+    def _queue_load(self, pipeline, session_id):
+        pipeline.hgetall(self._key(session_id))
+
+    def _parse_session(self, raw_session):
+        raw_values = dict((self._to_name(name), raw_value) for name, raw_value in raw_session.items())
+        size = sum(len(raw_value) for raw_value in raw_values.values())
+        self._refresh_blobs(raw_values.values())
+
+        if self.lazy_values:
+            return lazy.LazySession(raw_values, self._decode), size
+        return dict((name, self._decode(raw_value)) for name, raw_value in raw_values.items()), size
+
+    def set(self, session_id, session):
+        self._setup_client()
+        serialized_values = self._serialize_values(session)
+        key = self._key(session_id)
+
+        def queue_write(pipeline):
+            pipeline.delete(key)
+            if session:
+                pipeline.hmset(key, serialized_values)
+                pipeline.expire(key, self.EXPIRE_SECONDS)
+        if self.index is None:
+            pipeline = self._client_for(session_id).pipeline()
+            queue_write(pipeline)
+            pipeline.execute()
+        else:
+            new_value = self._indexed_value(session)
+            self._reindexing(session_id, queue_write, lambda old_value: new_value)
+        self._written(session_id, session, sum(len(raw_value) for raw_value in serialized_values.values()))
+
+    def get_value(self, session_id, name, default=None):
+        self._setup_client()
+        raw_value = self._reader_for(session_id).hget(self._key(session_id), name)
+        if raw_value is None:
+            return default
+        self._refresh_blobs([raw_value])
+        return self._decode(raw_value)
+
+    def _load_raw_values(self, session_id):
+        return self._reader_for(session_id).hvals(self._key(session_id))
+
+    def _load_indexed_value(self, client, session_id):
+        raw_value = client.hget(self._key(session_id), self.index)
+        return None if raw_value is None else self._decode(raw_value)
+
+    def keys(self, session_id):
+        self._setup_client()
+        return [self._to_name(name) for name in self._reader_for(session_id).hkeys(self._key(session_id))]
+
+    def contains(self, session_id, name):
+        self._setup_client()
+        return self._reader_for(session_id).hexists(self._key(session_id), name)
+
+    def update(self, session_id, values, deleted_names=()):
+        self._setup_client()
+        if self._changes_index(values, deleted_names):
+            def new_value(old_value):
+                if self.index in values:
+                    return values[self.index]
+                return None
+            self._reindexing(
+                session_id, lambda pipeline: self._queue_update(pipeline, session_id, values, deleted_names),
+                new_value)
         else:
-            settings = self.settings
-        self.client = redis.Redis(**settings)
+            pipeline = self._client_for(session_id).pipeline()
+            self._queue_update(pipeline, session_id, values, deleted_names)
+            pipeline.execute()
+            self._refresh_index(session_id)
+        self._written(session_id)
+        # The fields are written blindly, extending the expiration of the fields that weren't read.
+        self._refresh_session_blobs(session_id)
+
+    def _queue_update(self, pipeline, session_id, values, deleted_names):
+        self._queue_field_changes(pipeline, self._key(session_id), values, deleted_names)
+        pipeline.expire(self._key(session_id), self.EXPIRE_SECONDS)
+
+    def _queue_field_changes(self, pipeline, key, values, deleted_names):
+        if deleted_names:
+            pipeline.hdel(key, *deleted_names)
+        if values:
+            pipeline.hmset(key, self._serialize_values(values))
+
+    def _queue_bulk_read(self, pipeline, session_id):
+        # The fields are changed without reading the session, so only its existence and indexed item are needed.
+        key = self._key(session_id)
+        pipeline.exists(key)
+        if self.index is not None:
+            pipeline.hget(key, self.index)
+
+    def _queue_bulk_update(self, pipeline, session_id, results, values, deleted_names):
+        exists = next(results)
+        raw_old_value = next(results) if self.index is not None else None
+        if not exists:
+            return None
+        # Changing fields keeps the expiration of the hash.
+        self._queue_field_changes(pipeline, self._key(session_id), values, deleted_names)
+        if self._changes_index(values, deleted_names):
+            old_value = None if raw_old_value is None else self._decode(raw_old_value)
+            self._queue_reindex(pipeline, session_id, old_value, values.get(self.index))
+        return None, 0
+
+    def save(self, session_id, session, changed_values, deleted_names):
+        self.update(session_id, changed_values, deleted_names)
+
+    def pop(self, session_id, name, default=None):
+        self._setup_client()
+        key = self._key(session_id)
+        if self._changes_index({}, (name,)):
+            raw_value, _ = self._reindexing(session_id, lambda pipeline: pipeline.hdel(key, name),
+                                            lambda old_value: None)
+        else:
+            raw_value = self._run_script('hash_pop', session_id, keys=[key], args=[name])
+        if raw_value is None:
+            return default
+        self._written(session_id)
+        return self._decode(raw_value)
+
+    def pop_all(self, session_id):
+        self._setup_client()
+        key = self._key(session_id)
+        if self.index is not None:
+            def queue_write(pipeline):
+                pipeline.hgetall(key)
+                pipeline.delete(key)
+            _, results = self._reindexing(session_id, queue_write, lambda old_value: None)
+            self._written(session_id)
+            return dict((self._to_name(name), self._decode(raw_value)) for name, raw_value in results[0].items())
+        raw_values = self._run_script('hash_pop_all', session_id, keys=[key])
+        self._written(session_id)
+        names = raw_values[0::2]
+        values = raw_values[1::2]
+        return dict((self._to_name(name), self._decode(raw_value)) for name, raw_value in zip(names, values))
+
+    def _changes_index(self, values, deleted_names):
+        return self.index is not None and (self.index in values or self.index in deleted_names)
+
+    def _reindexing(self, session_id, queue_write, new_value):
+        '''
+        Calls "queue_write" (which queues the writes of the session in a
+        pipeline) in a transaction that also moves the session to the index
+        of the value returned by "new_value" (called with the old indexed
+        value), which is retried if the session is changed by someone else in
+        the meantime. Returns the old indexed value (still serialized) and
+        the results of the transaction.
+        '''
+
+        import redis
+        key = self._key(session_id)
+        with self._client_for(session_id).pipeline() as pipeline:
+            for _ in range(self.MAX_UPDATE_ATTEMPTS):
+                try:
+                    pipeline.watch(key)
+                    raw_value = pipeline.hget(key, self.index)
+                    old_value = None if raw_value is None else self._decode(raw_value)
+                    pipeline.multi()
+                    queue_write(pipeline)
+                    self._queue_reindex(pipeline, session_id, old_value, new_value(old_value))
+                    return raw_value, pipeline.execute()
+                except redis.WatchError:
+                    continue
+        raise UpdateConflictError(session_id, self.MAX_UPDATE_ATTEMPTS)
+
+    def _serialize_values(self, values):
+        raw_values = values.raw_values if isinstance(values, lazy.LazySession) else {}
+        return dict((name, raw_values[name] if name in raw_values else self._encode(values[name]))
+                    for name in values)
 
 
 class MemcachedDriver(Driver):
+    DEFAULT_SERVERS = ('localhost:11211',)
+    KEY_PREFIXES = {
+        'db_sessions': '',
+        'db_notifications': 'notifications:',
+    }
+
+    def __init__(self, settings, storage_category='db_sessions'):
+        self.settings = settings
+        self.key_prefix = self.KEY_PREFIXES[storage_category]
+
+    def _key(self, session_id):
+        if isinstance(session_id, bytes):
+            session_id = session_id.decode('utf-8')
+        return self.key_prefix + session_id
+
+    def _load(self, session_id):
+        raw_session = self.client.get(self._key(session_id))
+
+        return self._to_dict(raw_session), len(raw_session or b'')
+
+    def _set_and_expire(self, session_id, serialized_session):
+        self.client.set(self._key(session_id), serialized_session, self.EXPIRE_SECONDS)
+
+    def _touch(self, session_id):
+        self.client.touch(self._key(session_id), self.EXPIRE_SECONDS)
+
+    def get_many(self, session_ids):
+        '''
+        Gets the sessions with get_multi, in a single request to each server.
+        '''
+
+        sessions = {}
+        if self.cache is not None:
+            for session_id in session_ids:
+                session = self.cache.get(session_id)
+                if session is not None:
+                    sessions[session_id] = session
+        missing_ids = [session_id for session_id in session_ids if session_id not in sessions]
+        if missing_ids:
+            self._setup_client()
+            raw_sessions = self.client.get_multi(missing_ids, key_prefix=self.key_prefix)
+            for session_id in missing_ids:
+                raw_session = raw_sessions.get(session_id)
+                sessions[session_id] = self._to_dict(raw_session)
+                if self.cache is not None:
+                    self.cache.set(session_id, sessions[session_id], len(raw_session or b''))
+        return sessions
+
+    def set_many(self, sessions):
+        '''
+        Sets the sessions with set_multi, in a single request to each server.
+        '''
+
+        serialized_sessions = dict((session_id, self._encode_session(session))
+                                   for session_id, session in sessions.items())
+        self._setup_client()
+        self.client.set_multi(serialized_sessions, self.EXPIRE_SECONDS, key_prefix=self.key_prefix)
+        for session_id, session in sessions.items():
+            self._written(session_id, session, len(serialized_sessions[session_id]))
+
+    def _change(self, session_id, change):
+        '''
+        Changes the session with "check and set", so that it's not written if
+        it was changed by someone else since it was read, in which case it's
+        read and changed again.
+        '''
+
+        self._setup_client()
+        key = self._key(session_id)
+        try:
+            for _ in range(self.MAX_UPDATE_ATTEMPTS):
+                raw_session = self.client.gets(key)
+                session = self._to_dict(raw_session)
+                result, changed = change(session)
+                if not changed:
+                    return result
+                serialized_session = self._encode_session(session)
+                if raw_session is None:
+                    stored = self.client.add(key, serialized_session, self.EXPIRE_SECONDS)
+                else:
+                    stored = self.client.cas(key, serialized_session, self.EXPIRE_SECONDS)
+                if stored:
+                    break
+            else:
+                raise UpdateConflictError(session_id, self.MAX_UPDATE_ATTEMPTS)
+        finally:
+            # The ids are kept for each thread, and this is the only place that uses them.
+            self.client.cas_ids.clear()
+        self._written(session_id, session, len(serialized_session))
+        return result
+
+    def _create_client(self):
+        from pycket.memcached import shared_client
+        settings = copy(self.settings)
+        servers = settings.pop('servers', self.DEFAULT_SERVERS)
+        settings['cache_cas'] = True
+        self.client = shared_client(servers, settings)
+
+    def _pool_stats(self):
+        connected = [server for server in self.client.servers if server.socket is not None]
+        return {
+            'pool_size': len(self.client.servers),
+            'in_use': len(connected),
+        }
+
+
+class MemoryDriver(Driver):
+    '''
+    Keeps the sessions in the memory of the process (see pycket.memory).
+    Sessions (and queued values) that only have immutable values are kept as
+    they are, without serializing them; the others are serialized, so that
+    they can't be changed by changing the objects that were stored.
+    The indexes (with the "index" option) are kept in a dict, apart from the
+    store, so that they're neither evicted nor expired.
+    '''
+
+    INDEXABLE = True
+
     def __init__(self, settings):
         self.settings = settings
+        self.indexes = {}
+
+    def _load(self, session_id):
+        stored = self.client.get(session_id)
+        if isinstance(stored, dict):
+            return dict(stored), 0
+        return self._to_dict(stored), len(stored or b'')
+
+    def set(self, session_id, session):
+        self._setup_client()
+        if isinstance(session, dict) and all(is_immutable(value) for value in session.values()):
+            stored, size = dict(session), estimate_size(session)
+        else:
+            stored = self._encode_session(session)
+            size = len(stored)
+        with self.client.lock:
+            old_value = self._indexed_value(self._load(session_id)[0]) if self.index is not None else None
+            self.client.set(session_id, stored, size, self.EXPIRE_SECONDS)
+            self._reindex(session_id, old_value, self._indexed_value(session))
+        self._written(session_id, session, size)
+
+    def _touch(self, session_id):
+        self.client.touch(session_id, self.EXPIRE_SECONDS)
+
+    def _change(self, session_id, change):
+        '''
+        Changes the session while holding the lock of the store, so that no
+        other thread changes it in the meantime.
+        '''
+
+        self._setup_client()
+        with self.client.lock:
+            session, _ = self._load(session_id)
+            result, changed = change(session)
+            if changed:
+                self.set(session_id, session)
+        return result
+
+    def push(self, session_id, values):
+        self._setup_client()
+        queue_id = self._queue_id(session_id)
+        with self.client.lock:
+            queue = list(self.client.get(queue_id) or ())
+            queue.extend(self._store_value(value) for value in values)
+            self._store_queue(queue_id, queue[-self.max_queue_length:])
+
+    def consume(self, session_id, count=None):
+        self._setup_client()
+        queue_id = self._queue_id(session_id)
+        with self.client.lock:
+            queue = self.client.get(queue_id) or ()
+            count = count or len(queue)
+            consumed = queue[:count]
+            self._store_queue(queue_id, queue[count:])
+        return [self._load_value(stored) for stored in consumed]
+
+    def update_many(self, changes):
+        self._setup_client()
+        for session_id, (values, deleted_names) in changes.items():
+            with self.client.lock:
+                ttl = self.client.ttl(session_id)
+                if ttl is not None:
+                    self.update(session_id, values, deleted_names)
+                    self.client.touch(session_id, ttl)
+
+    def delete_many(self, session_ids):
+        self._setup_client()
+        for session_id in session_ids:
+            with self.client.lock:
+                if self.index is not None:
+                    self._reindex(session_id, self._indexed_value(self._load(session_id)[0]), None)
+                self.client.delete(session_id)
+            self._written(session_id)
+
+    def sessions_of(self, value):
+        self._setup_client()
+        with self.client.lock:
+            return list(self._index_members(self._index_id(value)))
+
+    def delete_sessions_of(self, value):
+        self._setup_client()
+        with self.client.lock:
+            session_ids = list(self._index_members(self._index_id(value)))
+            for session_id in session_ids:
+                self.client.delete(session_id)
+            self.indexes.pop(self._index_id(value), None)
+        for session_id in session_ids:
+            self._written(session_id)
+        return session_ids
+
+    def _reindex(self, session_id, old_value, new_value):
+        old_id = None if old_value is None else self._index_id(old_value)
+        new_id = None if new_value is None else self._index_id(new_value)
+        if old_id == new_id:
+            return
+        if old_id is not None:
+            self.indexes.get(old_id, set()).discard(session_id)
+            self._index_members(old_id)
+        if new_id is not None:
+            self.indexes.setdefault(new_id, set()).add(session_id)
+            self._index_members(new_id)
+
+    def _index_members(self, index_id):
+        '''
+        Returns the ids of the sessions in the index, dropping the sessions
+        that expired (or were evicted) from it.
+        '''
+
+        session_ids = self.indexes.get(index_id, set())
+        session_ids.difference_update([session_id for session_id in session_ids
+                                       if self.client.ttl(session_id) is None])
+        if not session_ids:
+            self.indexes.pop(index_id, None)
+        return session_ids
+
+    def scan(self, batch_size=Driver.DEFAULT_SCAN_BATCH):
+        self._setup_client()
+        session_ids = [key for key in self.client.keys() if self._is_session_id(key)]
+        for start in range(0, len(session_ids), batch_size):
+            yield session_ids[start:start + batch_size]
+
+    def ttl_many(self, session_ids):
+        self._setup_client()
+        return dict((session_id, self.client.ttl(session_id)) for session_id in session_ids)
+
+    def _store_queue(self, queue_id, queue):
+        if not queue:
+            self.client.delete(queue_id)
+            return
+        size = sum(len(data) if encoded else sys.getsizeof(data) for encoded, data in queue)
+        self.client.set(queue_id, tuple(queue), size, self.EXPIRE_SECONDS)
+
+    def _store_value(self, value):
+        if is_immutable(value):
+            return False, value
+        return True, self._encode(value)
+
+    def _load_value(self, stored):
+        encoded, data = stored
+        if encoded:
+            return self._decode(data)
+        return data
+
+    def _create_client(self):
+        self.client = MemoryStore(
+            max_entries=self.settings.get('max_entries', MemoryStore.DEFAULT_MAX_ENTRIES),
+            max_bytes=self.settings.get('max_bytes'))
+
+    def _pool_stats(self):
+        return {'pool_size': 0, 'in_use': 0}
+
+
+class SharedMemoryDriver(Driver):
+    '''
+    Keeps the sessions in a memory-mapped file shared by all the processes of
+    the host (see pycket.shared_memory).
+    '''
+
+    FILE_NAMES = {
+        'db_sessions': 'pycket-sessions.shm',
+        'db_notifications': 'pycket-notifications.shm',
+    }
+
+    def __init__(self, settings, storage_category='db_sessions'):
+        self.settings = settings
+        self.file_name = self.FILE_NAMES[storage_category]
+
+    def _set_and_expire(self, session_id, serialized_session):
+        self.client.set(session_id, serialized_session, self.EXPIRE_SECONDS)
+
+    def _touch(self, session_id):
+        self.client.touch(session_id, self.EXPIRE_SECONDS)
+
+    def _change(self, session_id, change):
+        '''
+        Changes the session while holding the lock of its bucket, so that no
+        other thread or process changes it in the meantime.
+        '''
+
+        self._setup_client()
+        with self.client.lock(session_id):
+            session, _ = self._load(session_id)
+            result, changed = change(session)
+            if changed:
+                self.set(session_id, session)
+        return result
+
+    def _create_client(self):
+        from pycket.shared_memory import SharedMemoryStore
+        settings = copy(self.settings)
+        directory = settings.pop('directory', tempfile.gettempdir())
+        self.client = SharedMemoryStore(os.path.join(directory, self.file_name), **settings)
+
+    def _pool_stats(self):
+        return {'pool_size': 0, 'in_use': 0}
+
+
+class SQLiteDriver(Driver):
+    '''
+    Keeps the sessions in a SQLite database file (see pycket.sqlite).
+    '''
+
+    DEFAULT_PATH = 'pycket.sqlite3'
+    TABLES = {
+        'db_sessions': 'sessions',
+        'db_notifications': 'notifications',
+    }
+
+    def __init__(self, settings, storage_category='db_sessions'):
+        self.settings = settings
+        self.table = self.TABLES[storage_category]
+
+    def _load(self, session_id):
+        raw_session = self.client.get(self.table, session_id)
+
+        return self._to_dict(raw_session), len(raw_session or b'')
+
+    def _set_and_expire(self, session_id, serialized_session):
+        self.client.set(self.table, session_id, serialized_session, self.EXPIRE_SECONDS)
+
+    def _touch(self, session_id):
+        self.client.touch(self.table, session_id, self.EXPIRE_SECONDS)
+
+    def _change(self, session_id, change):
+        '''
+        Changes the session inside the transaction of a group commit, so that
+        no one else changes it in the meantime.
+        '''
+
+        def write(connection):
+            session = self._to_dict(self.client.select(connection, self.table, session_id))
+            result, changed = change(session)
+            if not changed:
+                return result, None
+            serialized_session = self._encode_session(session)
+            self.client.upsert(connection, self.table, session_id, serialized_session, self.EXPIRE_SECONDS)
+            return result, (session, len(serialized_session))
+
+        self._setup_client()
+        result, written = self.client.write(write)
+        if written is not None:
+            self._written(session_id, *written)
+        return result
+
+    def update_many(self, changes):
+        '''
+        Changes the sessions inside the transaction of a single group commit,
+        rewriting their data but not their expiration times.
+        '''
+
+        def write(connection):
+            written = []
+            for session_id, (values, deleted_names) in changes.items():
+                raw_session = self.client.select(connection, self.table, session_id)
+                if raw_session is None:
+                    continue
+                session = self._to_dict(raw_session)
+                self._apply(session, values, deleted_names)
+                serialized_session = self._encode_session(session)
+                self.client.rewrite(connection, self.table, session_id, serialized_session)
+                written.append((session_id, session, len(serialized_session)))
+            return written
+
+        self._setup_client()
+        for change in self.client.write(write):
+            self._written(*change)
+
+    def delete_many(self, session_ids):
+        self._setup_client()
+        self.client.delete_many(self.table, session_ids)
+        for session_id in session_ids:
+            self._written(session_id)
 
-    def _set_and_expire(self, session_id, pickled_session):
-        self.client.set(session_id, pickled_session, self.EXPIRE_SECONDS)
+    def scan(self, batch_size=Driver.DEFAULT_SCAN_BATCH):
+        '''
+        Goes through the ids in order, a page at a time, so that each query
+        only reads a small range of the primary key index.
+        '''
+
+        self._setup_client()
+        last_id = ''
+        while True:
+            session_ids = self.client.scan(self.table, last_id, batch_size)
+            if not session_ids:
+                return
+            yield session_ids
+            last_id = session_ids[-1]
+
+    def ttl_many(self, session_ids):
+        self._setup_client()
+        return self.client.ttl_many(self.table, session_ids)
 
     def _create_client(self):
-        import memcache
+        from pycket.sqlite import shared_store
         settings = copy(self.settings)
-        default_servers = ('localhost:11211',)
-        servers = settings.pop('servers', default_servers)
-        self.client = memcache.Client(servers, **settings)
+        path = settings.pop('path', self.DEFAULT_PATH)
+        self.client = shared_store(path, **settings)
+
+    def _pool_stats(self):
+        return {'pool_size': 0, 'in_use': 0}
+
+
+class UpdateConflictError(Exception):
+    '''
+    Raised when a session couldn't be updated because it kept being changed
+    by someone else (or the datastore kept refusing the change).
+    '''
+
+    def __init__(self, session_id, attempts):
+        super(UpdateConflictError, self).__init__(
+            'Could not update session "%s" after %d attempts' % (session_id, attempts))
+
+
+class TouchThrottle(object):
+    '''
+    Remembers when each session was last touched (or written), so that it's
+    touched at most once per "interval" seconds. Sessions not touched within
+    the interval are forgotten, to keep memory bounded.
+    '''
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.touched = OrderedDict()
+        self.lock = threading.Lock()
+
+    def should_touch(self, session_id):
+        now = time.time()
+        with self.lock:
+            self._forget_before(now - self.interval)
+            if session_id in self.touched:
+                return False
+            self.touched[session_id] = now
+            return True
+
+    def mark(self, session_id):
+        now = time.time()
+        with self.lock:
+            self.touched.pop(session_id, None)
+            self.touched[session_id] = now
+
+    def forget(self, session_id):
+        with self.lock:
+            self.touched.pop(session_id, None)
+
+    def _forget_before(self, limit):
+        while self.touched:
+            session_id, touched_at = next(iter(self.touched.items()))
+            if touched_at > limit:
+                break
+            del self.touched[session_id]
+
+
+class RecentWrites(TouchThrottle):
+    '''
+    Remembers which sessions were written in the last "interval" seconds.
+    '''
+
+    def __contains__(self, session_id):
+        with self.lock:
+            self._forget_before(time.time() - self.interval)
+            return session_id in self.touched
 
 
 class DriverFactory(object):
     STORAGE_CATEGORIES = ('db_sessions', 'db_notifications')
+    DRIVER_OPTIONS = ('serializer', 'compression', 'lazy_values', 'expire_seconds', 'sliding_expiration', 'cache',
+                      'max_notifications', 'metrics', 'index', 'offload')
 
-    def create(self, name, storage_settings, storage_category):
+    def create(self, name, storage_settings, storage_category, pycket_settings=None):
         method = getattr(self, '_create_%s' % name, None)
         if method is None:
             raise ValueError('Engine "%s" is not supported' % name)
-        return method(storage_settings, storage_category)
+        driver = method(storage_settings, storage_category)
+        driver.configure(self.driver_options(pycket_settings or {}), storage_category)
+        return driver
+
+    def driver_options(self, pycket_settings):
+        return dict((name, value) for name, value in pycket_settings.items()
+                    if name in self.DRIVER_OPTIONS)
 
     def _create_redis(self, storage_settings, storage_category):
+        return RedisDriver(self._redis_settings(storage_settings, storage_category), storage_category)
+
+    def _create_redis_hash(self, storage_settings, storage_category):
+        return RedisHashDriver(self._redis_settings(storage_settings, storage_category), storage_category)
+
+    def _redis_settings(self, storage_settings, storage_category):
         storage_settings = copy(storage_settings)
+        if storage_settings.get('key_prefix') is not None:
+            # All the categories share the database of the sessions, with their keys in separate namespaces.
+            storage_category = 'db_sessions'
         default_storage_identifier = RedisDriver.DEFAULT_STORAGE_IDENTIFIERS[storage_category]
         storage_settings['db'] = storage_settings.get(storage_category, default_storage_identifier)
         for storage_category in self.STORAGE_CATEGORIES:
             if storage_category in storage_settings.keys():
                 del storage_settings[storage_category]
 
-        return RedisDriver(storage_settings)
+        return storage_settings
 
     def _create_memcached(self, storage_settings, storage_category):
-        return MemcachedDriver(storage_settings)
+        return MemcachedDriver(storage_settings, storage_category)
+
+    def _create_memory(self, storage_settings, storage_category):
+        return MemoryDriver(storage_settings)
+
+    def _create_shared_memory(self, storage_settings, storage_category):
+        return SharedMemoryDriver(storage_settings, storage_category)
+
+    def _create_sqlite(self, storage_settings, storage_category):
+        return SQLiteDriver(storage_settings, storage_category)
+
+
+class DriverRegistry(object):
+    '''
+    Keeps a single driver for each combination of engine, storage settings and
+    storage category in the process, so that all the managers share the same
+    clients (and, therefore, the same connection pools) instead of opening new
+    connections for each request.
+    '''
+
+    def __init__(self):
+        self.factory = DriverFactory()
+        self.drivers = {}
+        self.lock = threading.Lock()
+
+    def get(self, name, storage_settings, storage_category, pycket_settings=None):
+        options = self.factory.driver_options(pycket_settings or {})
+        key = (name, storage_category, _freeze(storage_settings), _freeze(options))
+        with self.lock:
+            if key not in self.drivers:
+                self.drivers[key] = self.factory.create(name, storage_settings, storage_category, pycket_settings)
+            return self.drivers[key]
+
+    def stats(self):
+        '''
+        Returns a list of dicts, one per driver, with the "engine", "category",
+        "pool_size" and "in_use" connections.
+        '''
+
+        with self.lock:
+            items = list(self.drivers.items())
+        stats = []
+        for (name, storage_category, _, _), driver in items:
+            driver_stats = driver.pool_stats()
+            driver_stats.update(engine=name, category=storage_category)
+            stats.append(driver_stats)
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.drivers.clear()
+
+
+def _create_redis_client(settings):
+    import redis
+    if 'max_connections' in settings:
+        connection_pool = redis.ConnectionPool(**settings)
+        settings = copy(settings)
+        del settings['max_connections']
+        settings['connection_pool'] = connection_pool
+    return redis.Redis(**settings)
+
+
+def _shared_redis_client(settings):
+    key = _freeze(settings)
+    with _redis_clients_lock:
+        if key not in _redis_clients:
+            _redis_clients[key] = _create_redis_client(settings)
+        return _redis_clients[key]
+
+
+def _redis_node_settings(node):
+    if isinstance(node, dict):
+        return node
+    host, port = node.rsplit(':', 1)
+    return {'host': host, 'port': int(port)}
+
+
+def _redis_node_name(node, settings):
+    node_settings = dict(settings, **node)
+    name = '%s:%s' % (node_settings.get('host', 'localhost'), node_settings.get('port', 6379))
+    if 'db' in node:
+        name += '/%s' % node['db']
+    return name
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+registry = DriverRegistry()
+_redis_clients = {}
+_redis_clients_lock = threading.Lock()
@@ -0,0 +1,59 @@
+'''
+This module contains a consistent hashing ring, used to spread the sessions
+among many datastore servers.
+
+Each node is placed many times ("replicas", or virtual nodes) in the ring, and
+each key is stored in the first node found after the position of the key, so
+that adding or removing a node only moves the keys of that node, and the keys
+are spread evenly even with few nodes.
+'''
+
+from bisect import bisect
+from hashlib import md5
+import struct
+
+
+class HashRing(object):
+    DEFAULT_REPLICAS = 160
+
+    def __init__(self, nodes, replicas=DEFAULT_REPLICAS):
+        self.nodes = list(nodes)
+        points = sorted(
+            (self._hash('%s-%d' % (node, replica)), index)
+            for index, node in enumerate(self.nodes)
+            for replica in range(replicas)
+        )
+        self.positions = [position for position, _ in points]
+        self.indexes = [index for _, index in points]
+
+    def get_node(self, key):
+        '''
+        Returns the node where "key" is stored, or None if the ring is empty.
+        '''
+
+        for node in self.iterate_nodes(key):
+            return node
+
+    def iterate_nodes(self, key):
+        '''
+        Yields each node once, starting with the node of "key" and following
+        the ring; the nodes after the first one are the fallbacks for when
+        the previous ones are not available.
+        '''
+
+        if not self.positions:
+            return
+        start = bisect(self.positions, self._hash(key))
+        seen = set()
+        for offset in range(len(self.positions)):
+            index = self.indexes[(start + offset) % len(self.positions)]
+            if index not in seen:
+                seen.add(index)
+                yield self.nodes[index]
+                if len(seen) == len(self.nodes):
+                    return
+
+    def _hash(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return struct.unpack('>I', md5(key).digest()[:4])[0]
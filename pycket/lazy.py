@@ -0,0 +1,104 @@
+'''
+This module contains the lazy session format, used by the drivers when
+"lazy_values" is enabled. In this format each session item is serialized
+separately inside the stored record, so that reading a session only
+deserializes the items that are actually used, and writing it back reuses
+the original bytes of the items that weren't touched.
+'''
+
+import struct
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python < 3.3
+    from collections import MutableMapping
+
+
+RECORD_TAG = b'\x20'
+ITEM_HEADER = struct.Struct('>II')
+
+
+class LazySession(MutableMapping):
+    '''
+    A session dictionary whose values are only deserialized (with "decode")
+    when they're first accessed.
+    '''
+
+    def __init__(self, raw_values, decode):
+        self.raw_values = raw_values
+        self.values = {}
+        self.decode = decode
+
+    def __getitem__(self, name):
+        if name in self.raw_values:
+            self.values[name] = self.decode(self.raw_values.pop(name))
+        return self.values[name]
+
+    def __setitem__(self, name, value):
+        self.raw_values.pop(name, None)
+        self.values[name] = value
+
+    def __delitem__(self, name):
+        if name in self.raw_values:
+            del self.raw_values[name]
+        else:
+            del self.values[name]
+
+    def __iter__(self):
+        for name in list(self.raw_values):
+            yield name
+        for name in list(self.values):
+            yield name
+
+    def __len__(self):
+        return len(self.raw_values) + len(self.values)
+
+    def __contains__(self, name):
+        return name in self.raw_values or name in self.values
+
+    def copy(self):
+        session = LazySession(dict(self.raw_values), self.decode)
+        session.values = dict(self.values)
+        return session
+
+    def __repr__(self):
+        return 'LazySession(%r)' % dict(self)
+
+
+def is_record(data):
+    return data[:1] == RECORD_TAG
+
+
+def dumps(session, encode):
+    '''
+    Serializes "session" to a record, using "encode" for each value, except for
+    the values of a LazySession that were never accessed, which are kept as
+    they were read.
+    '''
+
+    raw_values = session.raw_values if isinstance(session, LazySession) else {}
+    parts = [RECORD_TAG]
+    for name in session:
+        data = raw_values.get(name)
+        if data is None:
+            data = encode(session[name])
+        raw_name = name.encode('utf-8')
+        parts.extend((ITEM_HEADER.pack(len(raw_name), len(data)), raw_name, data))
+    return b''.join(parts)
+
+
+def loads(data, decode):
+    '''
+    Reads a record into a LazySession that uses "decode" for each value.
+    '''
+
+    raw_values = {}
+    position = len(RECORD_TAG)
+    while position < len(data):
+        name_size, data_size = ITEM_HEADER.unpack_from(data, position)
+        position += ITEM_HEADER.size
+        name = data[position:position + name_size].decode('utf-8')
+        position += name_size
+        raw_values[name] = data[position:position + data_size]
+        position += data_size
+    return LazySession(raw_values, decode)
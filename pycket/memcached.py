@@ -0,0 +1,61 @@
+'''
+This module is for internal use, only. It contains the Memcached client used by
+the "memcached" engine, and is only imported when that engine is used, because
+it needs the python-memcached package.
+
+HashRingClient spreads the keys among the servers with consistent hashing (see
+pycket.hashring) instead of the modulo of the key hash, so that adding or
+removing a server only moves the sessions stored in that server. The batch
+operations (get_multi and set_multi) send a single request to each server.
+
+The clients are shared by all the drivers with the same storage settings (like
+the session and notification drivers), so they share the connections, which
+python-memcached keeps for each thread that uses the client.
+'''
+
+import threading
+
+import memcache
+
+from pycket.driver import _freeze
+from pycket.hashring import HashRing
+
+
+class HashRingClient(memcache.Client):
+    def __init__(self, servers, *args, **kwargs):
+        super(HashRingClient, self).__init__(servers, *args, **kwargs)
+        names = [_server_name(server) for server in servers]
+        self.ring = HashRing(names)
+        self.servers_by_name = dict(zip(names, self.servers))
+
+    def _get_server(self, key):
+        if isinstance(key, tuple):
+            _, key = key
+        for name in self.ring.iterate_nodes(key):
+            server = self.servers_by_name[name]
+            if server.connect():
+                return server, key
+        return None, None
+
+
+def shared_client(servers, settings):
+    '''
+    Returns the HashRingClient for "servers" and the other client "settings",
+    creating it if it doesn't exist yet in this process.
+    '''
+
+    key = _freeze((servers, settings))
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = HashRingClient(servers, **settings)
+        return _clients[key]
+
+
+def _server_name(server):
+    if isinstance(server, tuple):
+        server = server[0]
+    return server
+
+
+_clients = {}
+_clients_lock = threading.Lock()
@@ -0,0 +1,181 @@
+'''
+This module contains the in-process store used by the "memory" engine, which
+keeps the sessions in the memory of the process instead of in a datastore
+server. It's meant for single-process deployments and for tests, since the
+sessions are neither shared with other processes nor kept after a restart.
+
+Each entry expires at its own time: the expiration times are kept in a heap,
+so that expired entries are purged in order, without scanning the whole store.
+The store is also bounded by a maximum number of entries and, optionally, by
+the total size of the entries, evicting the least recently used ones first.
+'''
+
+from collections import OrderedDict
+import heapq
+import sys
+import threading
+import time
+
+
+IMMUTABLE_TYPES = (type(None), bool, int, float, complex, str, bytes, frozenset)
+try:
+    IMMUTABLE_TYPES += (long, unicode)  # noqa
+except NameError:
+    pass
+
+
+class MemoryStore(object):
+    DEFAULT_MAX_ENTRIES = 100000
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.deadlines = []
+        self.size = 0
+        self.lock = threading.RLock()
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key):
+        '''
+        Returns the value stored for "key", or None if there's no such value
+        (or if it expired).
+        '''
+
+        with self.lock:
+            self._expire()
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            self.entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value, size, expire_seconds):
+        '''
+        Stores "value", whose size is "size" bytes, to expire in
+        "expire_seconds".
+        '''
+
+        expires_at = time.time() + expire_seconds
+        with self.lock:
+            self._expire()
+            self._remove(key)
+            self.entries[key] = (value, size, expires_at)
+            self.size += size
+            self._add_deadline(expires_at, key)
+            self._evict()
+
+    def touch(self, key, expire_seconds):
+        '''
+        Makes the value stored for "key" expire in "expire_seconds" from now.
+        '''
+
+        expires_at = time.time() + expire_seconds
+        with self.lock:
+            self._expire()
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            self.entries[key] = (entry[0], entry[1], expires_at)
+            self._add_deadline(expires_at, key)
+
+    def delete(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def keys(self):
+        '''
+        Returns a list with the keys of the entries that didn't expire.
+        '''
+
+        with self.lock:
+            self._expire()
+            return list(self.entries)
+
+    def ttl(self, key):
+        '''
+        Returns how many seconds are left until the entry of "key" expires, or
+        None if there's no such entry.
+        '''
+
+        with self.lock:
+            self._expire()
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            return entry[2] - time.time()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.deadlines = []
+            self.size = 0
+
+    def stats(self):
+        '''
+        Returns the "expirations" and "evictions" counters, and the number of
+        "entries" and "bytes" currently stored.
+        '''
+
+        with self.lock:
+            return {
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+            }
+
+    def _expire(self):
+        now = time.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            expires_at, key = heapq.heappop(self.deadlines)
+            entry = self.entries.get(key)
+            # Touching (or setting again) an entry leaves its older deadlines behind.
+            if entry is not None and entry[2] == expires_at:
+                self._remove(key)
+                self.expirations += 1
+
+    def _add_deadline(self, expires_at, key):
+        heapq.heappush(self.deadlines, (expires_at, key))
+        if len(self.deadlines) > 2 * len(self.entries) + 100:
+            self.deadlines = [(entry[2], entry_key) for entry_key, entry in self.entries.items()]
+            heapq.heapify(self.deadlines)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        self.size -= entry[1]
+        return True
+
+    def _evict(self):
+        while self.entries and self._is_full():
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry[1]
+            self.evictions += 1
+
+    def _is_full(self):
+        if len(self.entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.size > self.max_bytes
+
+
+def is_immutable(value):
+    '''
+    Tells if "value" can't be changed in place, so that it can be shared
+    without copying (or serializing) it.
+    '''
+
+    if isinstance(value, tuple):
+        return all(is_immutable(item) for item in value)
+    return isinstance(value, IMMUTABLE_TYPES)
+
+
+def estimate_size(session):
+    '''
+    Estimates how many bytes "session" takes in memory, without counting the
+    objects inside containers (like the items of tuples).
+    '''
+
+    return sum(sys.getsizeof(name) + sys.getsizeof(value) for name, value in session.items())
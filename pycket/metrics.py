@@ -0,0 +1,334 @@
+'''
+This module contains the instrumentation used when the "metrics" setting is
+set: the drivers then record, in a Metrics registry, how long each operation
+takes, how many bytes the sessions take before and after being serialized, how
+many operations had to go to the datastore ("store operations", counting each
+operation once, however many requests it sent) and how many were answered by
+the session cache.
+
+Besides keeping histograms and counters (see Metrics.snapshot()), the registry
+calls its listeners with each measurement, so that they can be sent to other
+systems (like StatsD):
+
+>>> def send(metric, operation, value):
+...     statsd.timing('pycket.%s.%s' % (metric, operation), value * 1000)
+>>> default_metrics.add_listener(send)
+
+The measurements are also added up for each request, and "log_request" can be
+used as the "log_function" of the Tornado application to log them (along with
+how many times the session cookie was decoded) with each request:
+
+>>> application = tornado.web.Application(handlers, log_function=log_request, pycket={
+...     'engine': 'redis',
+...     'metrics': True,
+... })
+'''
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+from timeit import default_timer
+
+
+LATENCY_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BOUNDS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram(object):
+    '''
+    Counts the observed values in buckets with fixed upper "bounds" (plus one
+    for the values above the last bound), so that observing a value takes the
+    same memory and time no matter how many values were observed.
+    '''
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, percentile):
+        '''
+        Returns the upper bound of the bucket where the "percentile" (from 0
+        to 100) of the observed values is, or None if there are no values (or
+        if it's above the last bound).
+        '''
+
+        if not self.count:
+            return None
+        rank = self.count * percentile / 100.0
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'buckets': dict(zip(self.bounds, self.counts)),
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+        }
+
+
+class Metrics(object):
+    '''
+    Keeps the measurements of the drivers that use it, and passes them to the
+    listeners and to the metrics of the current request.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.listeners = []
+        self.latencies = {}
+        self.payloads = {}
+        self.store_operations = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add_listener(self, listener):
+        '''
+        Adds a function to be called with the name of each "metric" (one of
+        "latency", "bytes_read", "bytes_written", "raw_bytes_written",
+        "store_operation", "cache_hit" and "cache_miss"), the "operation" it was
+        measured in and its "value" (in seconds, bytes or occurrences).
+        '''
+
+        self.listeners.append(listener)
+
+    def instrument(self, operation, function):
+        '''
+        Returns "function" wrapped to be measured as "operation". Operations
+        called by other operations (like "get" by "get_value") are measured
+        only as part of the outer one.
+        '''
+
+        def instrumented(*args, **kwargs):
+            if getattr(self.local, 'operation', None) is not None:
+                return function(*args, **kwargs)
+            self.local.operation = operation
+            self.local.reaches_store = True
+            start = default_timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = default_timer() - start
+                reached_store = self.local.reaches_store
+                self.local.operation = None
+                self._record('latency', operation, seconds)
+                if reached_store:
+                    self._record('store_operation', operation, 1)
+        return instrumented
+
+    def payload(self, metric, size):
+        '''
+        Records the "size" (in bytes) of a session that was read or written,
+        as "metric" ("bytes_read", "bytes_written" or "raw_bytes_written").
+        '''
+
+        self._record(metric, self._operation(), size)
+
+    def cache(self, hit):
+        '''
+        Records whether a session was found in the session cache; operations
+        answered by the cache don't count as store operations.
+        '''
+
+        if hit:
+            self.local.reaches_store = False
+        self._record('cache_hit' if hit else 'cache_miss', self._operation(), 1)
+
+    @contextmanager
+    def recording(self, request_metrics):
+        '''
+        Adds the measurements done by this thread, while in this context, to
+        "request_metrics" (a RequestMetrics).
+        '''
+
+        previous = getattr(self.local, 'request_metrics', None)
+        self.local.request_metrics = request_metrics
+        try:
+            yield
+        finally:
+            self.local.request_metrics = previous
+
+    def cache_hit_rate(self):
+        lookups = self.cache_hits + self.cache_misses
+        if not lookups:
+            return None
+        return float(self.cache_hits) / lookups
+
+    def snapshot(self):
+        '''
+        Returns a dict with the "latencies" (in seconds) of each operation and
+        the "payloads" sizes (in bytes), as histogram snapshots, and the
+        "store_operations", "cache_hits", "cache_misses" and "cache_hit_rate".
+        The store operations are the measured operations that went to the
+        datastore, not the requests they sent to it (a get_many over many
+        nodes is one store operation, for example).
+        '''
+
+        with self.lock:
+            return {
+                'latencies': dict((operation, histogram.snapshot())
+                                  for operation, histogram in self.latencies.items()),
+                'payloads': dict((metric, histogram.snapshot()) for metric, histogram in self.payloads.items()),
+                'store_operations': self.store_operations,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'cache_hit_rate': self.cache_hit_rate(),
+            }
+
+    def _operation(self):
+        return getattr(self.local, 'operation', None)
+
+    def _record(self, metric, operation, value):
+        with self.lock:
+            if metric == 'latency':
+                self._histogram(self.latencies, operation, LATENCY_BOUNDS).observe(value)
+            elif metric == 'store_operation':
+                self.store_operations += value
+            elif metric == 'cache_hit':
+                self.cache_hits += value
+            elif metric == 'cache_miss':
+                self.cache_misses += value
+            else:
+                self._histogram(self.payloads, metric, SIZE_BOUNDS).observe(value)
+        request_metrics = getattr(self.local, 'request_metrics', None)
+        if request_metrics is not None:
+            request_metrics.record(metric, value)
+        for listener in self.listeners:
+            listener(metric, operation, value)
+
+    def _histogram(self, histograms, name, bounds):
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram(bounds)
+        return histogram
+
+
+class RequestMetrics(object):
+    '''
+    Adds up the measurements of the session operations of a single request.
+    '''
+
+    COUNTERS = {
+        'store_operation': 'store_operations',
+        'bytes_read': 'bytes_read',
+        'bytes_written': 'bytes_written',
+        'cache_hit': 'cache_hits',
+        'cache_miss': 'cache_misses',
+    }
+
+    def __init__(self):
+        self.operations = 0
+        self.seconds = 0
+        self.store_operations = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def record(self, metric, value):
+        if metric == 'latency':
+            self.operations += 1
+            self.seconds += value
+        elif metric in self.COUNTERS:
+            counter = self.COUNTERS[metric]
+            setattr(self, counter, getattr(self, counter) + value)
+
+    def as_dict(self):
+        return {
+            'operations': self.operations,
+            'milliseconds': round(self.seconds * 1000, 3),
+            'store_operations': self.store_operations,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+class RequestDriver(object):
+    '''
+    Wraps a driver (which uses metrics) so that the measurements of the
+    operations called through it are also added to "request_metrics".
+    '''
+
+    def __init__(self, driver, request_metrics):
+        self.driver = driver
+        self.request_metrics = request_metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self.driver, name)
+        if not callable(attribute):
+            return attribute
+
+        def method(*args, **kwargs):
+            with self.driver.metrics.recording(self.request_metrics):
+                return attribute(*args, **kwargs)
+        return method
+
+
+def create_metrics(settings):
+    '''
+    Returns the Metrics registry for the "metrics" setting, which is either
+    True (to use "default_metrics") or a Metrics instance.
+    '''
+
+    if settings is True:
+        return default_metrics
+    return settings
+
+
+def request_summary(handler):
+    '''
+    Returns a dict with the session metrics of the request of "handler" (and
+    how many times the session cookie was decoded, as "cookie_decodes"), or
+    None if the request didn't use the session.
+    '''
+
+    request = getattr(handler, '__pycket_request', None)
+    if request is None:
+        return None
+    summary = request.metrics.as_dict()
+    summary['cookie_decodes'] = request.cookie_decodes
+    return summary
+
+
+def format_summary(summary):
+    return ('pycket: %(operations)d ops, %(store_operations)d store ops, %(milliseconds).2fms, '
+            '%(bytes_read)dB read, %(bytes_written)dB written, %(cache_hits)d/%(cache_misses)d cache hits/misses, '
+            '%(cookie_decodes)d cookie decodes' % summary)
+
+
+def log_request(handler):
+    '''
+    Logs the request like Tornado does by default, with the session metrics
+    of the request appended. Use it as the "log_function" application setting.
+    '''
+
+    from tornado.log import access_log
+
+    if handler.get_status() < 400:
+        log_method = access_log.info
+    elif handler.get_status() < 500:
+        log_method = access_log.warning
+    else:
+        log_method = access_log.error
+    summary = request_summary(handler)
+    log_method('%d %s %.2fms%s', handler.get_status(), handler._request_summary(),
+               1000.0 * handler.request.request_time(),
+               '' if summary is None else ' (%s)' % format_summary(summary))
+
+
+default_metrics = Metrics()
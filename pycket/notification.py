@@ -3,7 +3,9 @@ This module is the same as the sessions module, except that:
 1. NotificationMixin sets a "notifications" property instead a "session" one,
 and that the NotificationManager ("notifications") gets an object only once, and
 deletes it from the database after retrieving;
-2. The objects are stored in db 1 (for default) instead of 0 to avoid conflicts
+2. Besides the named objects, notifications can be pushed to (and consumed
+from) a queue kept for each session;
+3. The objects are stored in db 1 (for default) instead of 0 to avoid conflicts
 with sessions. (You can change this setting with the "db_notifications" setting
 in the "storage" setting.)
 '''
@@ -18,13 +20,32 @@ class NotificationManager(SessionManager):
         '''
         Retrieves the object with "name", like with SessionManager.get(), but
         removes the object from the database after retrieval, so that it can be
-        retrieved only once
+        retrieved only once (this is done atomically, like with
+        SessionManager.pop()). To retrieve all the notifications at once, use
+        pop_all().
         '''
 
-        session_object = super(NotificationManager, self).get(name, default)
-        if session_object is not None:
-            self.delete(name)
-        return session_object
+        return super(NotificationManager, self).pop(name, default)
+
+    def push(self, *values):
+        '''
+        Appends the objects in "values" to the notification queue, which keeps
+        the order of the objects and, unlike the named notifications, can
+        receive new objects without reading the existing ones. If the queue
+        gets longer than the "max_notifications" setting (100, by default),
+        the oldest objects are dropped. (Redis and memory engines only)
+        '''
+
+        self.driver.push(self._get_session_id(), values)
+
+    def consume(self, count=None):
+        '''
+        Removes the "count" oldest objects from the notification queue (or all
+        of them, if "count" is not provided) and returns them in a list, in
+        the order they were pushed. (Redis and memory engines only)
+        '''
+
+        return self.driver.consume(self._get_session_id(), count)
 
 
 class NotificationMixin(object):
@@ -0,0 +1,114 @@
+'''
+This module contains the offloading of large session values, used by the
+drivers when the "offload" setting is used.
+
+Each serialized value with at least "threshold" bytes is stored only once, as a
+blob named after the SHA-256 hash of its bytes, and the session keeps a
+reference to the blob instead of the value (a header byte followed by the
+hash). Sessions that hold the same value (like the same feature flags or
+permissions) share the same blob, so the value is neither stored nor written
+again for each session: the sessions are written with the reference, and the
+blob is only uploaded if it doesn't exist yet.
+
+Blobs never change (a changed value gets another hash), so each process keeps
+the most recently used ones in memory, without any invalidation. They're
+cleaned up by expiring some time after the sessions that use them: their
+expiration is refreshed whenever a session that references them is written,
+read or touched, at most once per "refresh_interval" seconds in each process.
+'''
+
+import hashlib
+import threading
+
+from pycket.memory import MemoryStore
+
+
+REFERENCE_TAG = b'\x30'
+
+
+class Offloader(object):
+    DEFAULT_THRESHOLD = 16 * 1024
+    DEFAULT_REFRESH_INTERVAL = 60
+    DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+    CACHE_SECONDS = 60 * 60
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 cache_bytes=DEFAULT_CACHE_BYTES):
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.blobs = MemoryStore(max_bytes=cache_bytes)
+        self.lock = threading.Lock()
+        self.offloaded = 0
+        self.uploaded = 0
+        self.fetched = 0
+
+    def should_offload(self, data):
+        return len(data) >= self.threshold
+
+    def digest(self, data):
+        return hashlib.sha256(data).hexdigest()
+
+    def reference(self, digest):
+        return REFERENCE_TAG + digest.encode('ascii')
+
+    def cached(self, digest):
+        '''
+        Returns the bytes of the blob, if it's kept in the memory of the
+        process, or None.
+        '''
+
+        return self.blobs.get(digest)
+
+    def cache(self, digest, data):
+        self.blobs.set(digest, data, len(data), self.CACHE_SECONDS)
+
+    def count(self, offloaded=0, uploaded=0, fetched=0):
+        with self.lock:
+            self.offloaded += offloaded
+            self.uploaded += uploaded
+            self.fetched += fetched
+
+    def stats(self):
+        '''
+        Returns how many values were "offloaded" (replaced by references),
+        how many blobs were "uploaded" (the others already existed) and how
+        many were "fetched" from the datastore (the others were in memory).
+        '''
+
+        with self.lock:
+            return {
+                'offloaded': self.offloaded,
+                'uploaded': self.uploaded,
+                'fetched': self.fetched,
+            }
+
+
+class MissingBlobError(Exception):
+    '''
+    Raised when a session references a blob that no longer exists (like when
+    the datastore evicted it).
+    '''
+
+    def __init__(self, digest):
+        super(MissingBlobError, self).__init__('The blob "%s" of an offloaded session value is missing' % digest)
+
+
+def is_reference(data):
+    return data[:1] == REFERENCE_TAG
+
+
+def reference_digest(data):
+    return data[len(REFERENCE_TAG):].decode('ascii')
+
+
+def create_offloader(settings):
+    '''
+    Creates an offloader from the "offload" setting, which is either True (to
+    use the defaults) or a dict with "threshold" (in bytes),
+    "refresh_interval" (in seconds) and/or "cache_bytes" (how many bytes of
+    blobs each process keeps in memory).
+    '''
+
+    if settings is True:
+        settings = {}
+    return Offloader(**settings)
@@ -0,0 +1,104 @@
+'''
+This module contains the serializers used by the drivers to convert the
+sessions to bytes (and back) before storing them.
+
+Except for pickle, whose output already identifies itself, every serializer
+prefixes its output with a tag byte, so data written with different
+serializers can live side by side in the same datastore: when reading, the
+serializer is chosen by the tag, and when writing the configured one is used.
+This means that changing the serializer in a running application migrates
+the stored sessions lazily, as they get written again.
+
+Supported serializers are:
+- "pickle" (the default), with the default pickle protocol of the interpreter
+  (or the one given to PickleSerializer, like pickle.HIGHEST_PROTOCOL)
+- "json", which only supports the JSON types (tuples become lists, for example)
+- "msgpack", which needs the "msgpack-python" package
+'''
+
+import json
+import pickle
+
+
+class Serializer(object):
+    TAG = b''
+
+    def dumps(self, value):
+        return self.TAG + self._dumps(value)
+
+    def loads(self, data):
+        return self._loads(data[len(self.TAG):])
+
+
+class PickleSerializer(Serializer):
+    def __init__(self, protocol=None):
+        self.protocol = protocol
+
+    def _dumps(self, value):
+        # Without a protocol, the interpreter's default is used, which older readers of the sessions understand.
+        return pickle.dumps(value, self.protocol)
+
+    def _loads(self, data):
+        return pickle.loads(data)
+
+
+class JSONSerializer(Serializer):
+    TAG = b'\x01'
+
+    def _dumps(self, value):
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+    def _loads(self, data):
+        return json.loads(data.decode('utf-8'))
+
+
+class MsgpackSerializer(Serializer):
+    TAG = b'\x02'
+
+    def __init__(self):
+        import msgpack
+        self.msgpack = msgpack
+
+    def _dumps(self, value):
+        return self.msgpack.packb(value, use_bin_type=True)
+
+    def _loads(self, data):
+        return self.msgpack.unpackb(data, raw=False)
+
+
+SERIALIZERS = {
+    'pickle': PickleSerializer,
+    'json': JSONSerializer,
+    'msgpack': MsgpackSerializer,
+}
+
+TAGGED_SERIALIZERS = dict((serializer.TAG, serializer) for serializer in SERIALIZERS.values() if serializer.TAG)
+
+
+def create_serializer(serializer):
+    '''
+    Creates a serializer from its name, or returns "serializer" itself if it's
+    already a Serializer instance.
+    '''
+
+    if isinstance(serializer, Serializer):
+        return serializer
+    if serializer not in SERIALIZERS:
+        raise ValueError('Serializer "%s" is not supported' % serializer)
+    return SERIALIZERS[serializer]()
+
+
+_readers = {}
+
+
+def deserialize(data):
+    '''
+    Deserializes "data" with the serializer that wrote it.
+    '''
+
+    tag = data[:1]
+    if tag not in TAGGED_SERIALIZERS:
+        tag = b''
+    if tag not in _readers:
+        _readers[tag] = TAGGED_SERIALIZERS.get(tag, PickleSerializer)()
+    return _readers[tag].loads(data)
@@ -9,8 +9,13 @@ you have a "pycket" dictionary containing at least an "engine" element that
 tells which engine you want to use.
 
 Supported engines, for now, are:
-- Redis
-- Memcache
+- Redis ("redis")
+- Redis, with one hash field per session item ("redis_hash")
+- Memcache ("memcached")
+- The memory of the process ("memory"), for single-process applications and
+tests
+- Memory-mapped files shared by the processes of the host ("shared_memory")
+- SQLite ("sqlite")
 
 If you want to change the settings that are passed to the storage client, set a
 "storage" dictionary in the "pycket" settings with the intended storage settings
@@ -19,6 +24,37 @@ settings are passed to the redis.Redis client, except for the "db_sessions" and
 "db_notifications". These settings can contain numbers to change the datasets
 used for persistence, if you don't want to use the default numbers.
 
+If you want the session to be loaded only once per request, set "write_back"
+to True in the "pycket" settings. The session is then kept in memory by the
+manager, and changes are written to the datastore only once, when the handler
+calls "finish()" (and only if something changed), before the response is sent:
+the next request of the user always sees them, and if writing them fails, the
+request fails instead of the changes being silently lost.
+
+The session id is read from the secure cookie only once per request, and is
+shared by all the managers (like the session and the notifications) of the
+same handler.
+
+To keep the sessions and the notifications of Redis in the same database, set
+a "key_prefix" in the "storage" settings: their keys are then prefixed by it
+(and by "sessions:" or "notifications:"), and both share the same connection
+pool, so that they can be loaded together with "load()".
+
+If you want to find (or delete) all the sessions of a user, set "index" in the
+"pycket" settings to the name of the session item that identifies the user
+(like "user"): the sessions are then indexed by the value of that item, and
+"sessions_of()" and "delete_sessions_of()" can be used (with the "redis",
+"redis_hash" and "memory" engines).
+
+If many sessions hold the same large values, set "offload" to True (or to a
+dict of settings) in the "pycket" settings, so that each of those values is
+stored only once (with the "redis" and "redis_hash" engines). See the
+pycket.offload module for the details.
+
+If you want to measure the session operations, set "metrics" to True (or to a
+pycket.metrics.Metrics instance) in the "pycket" settings. See the
+pycket.metrics module for the details.
+
 If you want to change the cookie settings passed to the handler, set a
 "cookies" setting in the "pycket" settings with the items you want.
 This is also valid for "expires" and "expires_days", which, by default, will be
@@ -28,7 +64,8 @@ of them, your custom value will override the default behaviour.
 
 from uuid import uuid4
 
-from pycket.driver import DriverFactory
+from pycket.driver import registry
+from pycket.metrics import RequestDriver, RequestMetrics
 
 
 class SessionManager(object):
@@ -58,14 +95,21 @@ class SessionManager(object):
         '''
 
         self.handler = handler
+        self.request = create_mixin(handler, '__pycket_request', SessionRequest)
         self.settings = {}
+        self.__session = None
+        self.__changed_values = {}
+        self.__deleted_names = set()
         self.__setup_driver()
+        if self.__write_back():
+            self.__hook_finish()
 
     def __setup_driver(self):
         self.__setup_settings()
         storage_settings = self.settings.get('storage', {})
-        factory = DriverFactory()
-        self.driver = factory.create(self.settings.get('engine'), storage_settings, self.STORAGE_CATEGORY)
+        self.driver = registry.get(self.settings.get('engine'), storage_settings, self.STORAGE_CATEGORY, self.settings)
+        if self.driver.metrics is not None:
+            self.driver = RequestDriver(self.driver, self.request.metrics)
 
     def __setup_settings(self):
         pycket_settings = self.handler.settings.get('pycket')
@@ -76,15 +120,36 @@ class SessionManager(object):
             raise ConfigurationError('You must define an engine to be used with pycket')
         self.settings = pycket_settings
 
+    def __write_back(self):
+        return bool(self.settings.get('write_back'))
+
+    def __hook_finish(self):
+        '''
+        Makes the handler flush the session when it finishes, before the
+        response is sent (unlike "on_finish", which runs after that, when the
+        client may already have made its next request, and where errors can
+        only be logged). If flushing fails, the error is raised by "finish",
+        so the request fails like with any other error in the handler.
+        '''
+
+        finish = getattr(self.handler, 'finish', None)
+
+        def flush_and_finish(*args, **kwargs):
+            # Restored first, so that the error page of a failed flush can still be finished.
+            self.handler.finish = finish
+            # The blocking flush, even in asynchronous managers, since "finish" can't wait for a Future.
+            SessionManager.flush(self)
+            if finish is not None:
+                return finish(*args, **kwargs)
+        self.handler.finish = flush_and_finish
+
     def set(self, name, value):
         '''
         Sets a value for "name". It may be any pickable (see "pickle" module
         documentation) object.
         '''
 
-        def change(session):
-            session[name] = value
-        self.__change_session(change)
+        self.__change_session(values={name: value})
 
     def get(self, name, default=None):
         '''
@@ -92,30 +157,53 @@ class SessionManager(object):
         "default" is provided, return it if no object is found.
         '''
 
-        session = self.__get_session_from_db()
+        if self.__write_back():
+            return self.__get_session_from_db().get(name, default)
+        session_id = self._get_session_id()
+        self.driver.touch(session_id)
+        return self.driver.get_value(session_id, name, default)
+
+    def pop(self, name, default=None):
+        '''
+        Removes the object for "name" from the session and returns it, or
+        "default" if there's no such object, in a single atomic operation.
+        '''
 
-        return session.get(name, default)
+        if self.__write_back():
+            value = self.__get_session_from_db().get(name, default)
+            self.__change_session(deleted_names=(name,))
+            return value
+        return self.driver.pop(self._get_session_id(), name, default)
+
+    def pop_all(self):
+        '''
+        Removes all the objects from the session and returns them in a dict,
+        in a single atomic operation.
+        '''
+
+        if self.__write_back():
+            session = dict(self.__get_session_from_db())
+            self.__change_session(deleted_names=list(session))
+            return session
+        return self.driver.pop_all(self._get_session_id())
 
     def delete(self, *names):
         '''
         Deletes the object with "name" from the session, if exists.
         '''
 
-        def change(session):
-            keys = session.keys()
-            names_in_common = [name for name in names if name in keys]
-            for name in names_in_common:
-                del session[name]
-        self.__change_session(change)
+        self.__change_session(deleted_names=names)
     __delitem__ = delete
 
     def keys(self):
-        session = self.__get_session_from_db()
-        return session.keys()
+        if self.__write_back():
+            return list(self.__get_session_from_db().keys())
+        session_id = self._get_session_id()
+        self.driver.touch(session_id)
+        return self.driver.keys(session_id)
 
     def iterkeys(self):
-        session = self.__get_session_from_db()
-        return iter(session)
+        return iter(self.keys())
     __iter__ = iterkeys
 
     def __getitem__(self, key):
@@ -128,22 +216,90 @@ class SessionManager(object):
         self.set(key, value)
 
     def __contains__(self, key):
-        session = self.__get_session_from_db()
-        return key in session
+        if self.__write_back():
+            return key in self.__get_session_from_db()
+        session_id = self._get_session_id()
+        self.driver.touch(session_id)
+        return self.driver.contains(session_id, key)
 
-    def __set_session_in_db(self, session):
-        session_id = self.__get_session_id()
-        self.driver.set(session_id, session)
+    def load(self, *managers):
+        '''
+        Loads the session together with the sessions of the other "managers"
+        of the handler (like the notifications), in a single round trip when
+        their drivers share the connection (like with the "key_prefix"
+        storage setting for Redis). The loaded sessions are kept by the
+        managers until the request finishes, so this needs "write_back".
+        '''
 
-    def __get_session_from_db(self):
-        session_id = self.__get_session_id()
-        return self.driver.get(session_id)
+        if not self.__write_back():
+            raise ConfigurationError('Loading sessions together needs "write_back" in the pycket settings')
+        managers = [manager for manager in (self,) + managers if manager.__session is None]
+        if not managers:
+            return
+        session_id = self._get_session_id()
+        for manager in managers:
+            manager.driver.touch(session_id)
+        sessions = managers[0].driver.get_together(session_id, [manager.driver for manager in managers[1:]])
+        for manager, session in zip(managers, sessions):
+            manager.__session = session
+
+    def sessions_of(self, value):
+        '''
+        Returns a list with the ids of the sessions whose indexed item (see
+        the "index" setting) is "value", like all the sessions of a user.
+        '''
 
-    def __get_session_id(self):
-        session_id = self.handler.get_secure_cookie(self.SESSION_ID_NAME)
-        if session_id is None:
-            session_id = self.__create_session_id()
-        return session_id
+        self.__check_index()
+        return self.driver.sessions_of(value)
+
+    def delete_sessions_of(self, value):
+        '''
+        Deletes all the sessions whose indexed item is "value", like all the
+        sessions of a user (to log them out everywhere after their password
+        is changed), and returns a list with their ids. If the session of the
+        request is one of them, it's also discarded by this manager.
+        '''
+
+        self.__check_index()
+        session_ids = self.driver.delete_sessions_of(value)
+        if self.request.session_id is not None and _text(self.request.session_id) in map(_text, session_ids):
+            self.__session = None
+            self.__changed_values = {}
+            self.__deleted_names = set()
+        return session_ids
+
+    def __check_index(self):
+        if not self.settings.get('index'):
+            raise ConfigurationError('Finding the sessions by an item needs "index" in the pycket settings')
+
+    def flush(self):
+        '''
+        Writes the session to the datastore, if it was changed since it was
+        loaded. This is only needed when "write_back" is enabled, and it's
+        called automatically when the handler finishes.
+        '''
+
+        if self.__changed_values or self.__deleted_names:
+            session_id = self._get_session_id()
+            self.driver.save(session_id, self.__session, self.__changed_values, self.__deleted_names)
+            self.__changed_values = {}
+            self.__deleted_names = set()
+
+    def __get_session_from_db(self):
+        if self.__session is None:
+            session_id = self._get_session_id()
+            self.driver.touch(session_id)
+            self.__session = self.driver.get(session_id)
+        return self.__session
+
+    def _get_session_id(self):
+        request = self.request
+        if request.session_id is None:
+            request.session_id = self.handler.get_secure_cookie(self.SESSION_ID_NAME)
+            request.cookie_decodes += 1
+            if request.session_id is None:
+                request.session_id = self.__create_session_id()
+        return request.session_id
 
     def __create_session_id(self):
         session_id = str(uuid4())
@@ -151,11 +307,23 @@ class SessionManager(object):
                                        **self.__cookie_settings())
         return session_id
 
-    def __change_session(self, callback):
-        session = self.__get_session_from_db()
+    def __change_session(self, values=None, deleted_names=()):
+        values = values or {}
+        if not self.__write_back():
+            session_id = self._get_session_id()
+            self.driver.update(session_id, values, deleted_names)
+            return
 
-        callback(session)
-        self.__set_session_in_db(session)
+        session = self.__get_session_from_db()
+        for name in deleted_names:
+            if name in session:
+                del session[name]
+                self.__changed_values.pop(name, None)
+                self.__deleted_names.add(name)
+        for name, value in values.items():
+            session[name] = value
+            self.__changed_values[name] = value
+            self.__deleted_names.discard(name)
 
     def __cookie_settings(self):
         cookie_settings = self.settings.get('cookies', {})
@@ -164,6 +332,22 @@ class SessionManager(object):
         return cookie_settings
 
 
+class SessionRequest(object):
+    '''
+    Keeps what is shared by all the managers of a request handler: the session
+    id, which is read from the secure cookie (or created) only once per
+    request, how many times the cookie was decoded ("cookie_decodes") and the
+    session metrics of the request ("metrics"), when the "metrics" setting is
+    used.
+    '''
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.session_id = None
+        self.cookie_decodes = 0
+        self.metrics = RequestMetrics()
+
+
 class SessionMixin(object):
     '''
     This mixin must be included in the request handler inheritance list, so that
@@ -195,3 +379,9 @@ def create_mixin(context, manager_property, manager_class):
     if not hasattr(context, manager_property):
         setattr(context, manager_property, manager_class(context))
     return getattr(context, manager_property)
+
+
+def _text(session_id):
+    if isinstance(session_id, bytes):
+        return session_id.decode('utf-8')
+    return session_id
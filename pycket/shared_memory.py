@@ -0,0 +1,206 @@
+'''
+This module contains the store used by the "shared_memory" engine, which keeps
+the sessions in a memory-mapped file, so that all the processes of a host
+(like the workers started with tornado.process.fork_processes) share them
+without going over the network. It only works on Unix-like systems, because it
+needs the fcntl module.
+
+The file is a hash table with a fixed number of slots of a fixed size, grouped
+in buckets: each key is stored in one of the slots of its bucket, so that a key
+never touches the slots of other buckets. The buckets are protected by a fixed
+number of locks ("stripes"), each one made of a thread lock (for the threads of
+the process) and a lock of one byte of the file (for the other processes).
+
+Entries have an expiration time, and expired entries are dropped in place when
+their bucket is used; when all the slots of a bucket are taken, the entry that
+would expire first is replaced.
+'''
+
+from contextlib import contextmanager
+import fcntl
+from hashlib import md5
+import mmap
+import os
+import struct
+import threading
+import time
+
+
+MAGIC = b'PYCKET02'
+FILE_HEADER = struct.Struct('>8sIII')
+FILE_HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct('>B16sdI')
+EMPTY = 0
+USED = 1
+
+
+class SharedMemoryStore(object):
+    DEFAULT_SLOTS = 65536
+    DEFAULT_SLOT_SIZE = 2048
+    DEFAULT_STRIPES = 256
+    BUCKET_SLOTS = 8
+
+    def __init__(self, path, slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE, stripes=DEFAULT_STRIPES):
+        self.path = path
+        self.buckets = max(1, slots // self.BUCKET_SLOTS)
+        self.slots = self.buckets * self.BUCKET_SLOTS
+        self.slot_size = slot_size
+        self.max_value_size = slot_size - SLOT_HEADER.size
+        if self.max_value_size <= 0:
+            raise ValueError('The slot size must be larger than %d bytes' % SLOT_HEADER.size)
+        self.stripes = min(stripes, self.buckets)
+        self.thread_locks = [threading.RLock() for _ in range(self.stripes)]
+        self.depths = [0] * self.stripes
+        self.size = FILE_HEADER_SIZE + self.slots * self.slot_size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._initialize()
+        self.memory = mmap.mmap(self.fd, self.size)
+
+    def _initialize(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            header = os.read(self.fd, FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size:
+                os.ftruncate(self.fd, self.size)
+                os.lseek(self.fd, 0, os.SEEK_SET)
+                os.write(self.fd, FILE_HEADER.pack(MAGIC, self.slots, self.slot_size, self.stripes))
+            elif FILE_HEADER.unpack(header) != (MAGIC, self.slots, self.slot_size, self.stripes):
+                # Processes with other stripes would lock other bytes for the same bucket.
+                raise ValueError('The file "%s" was created with other slot or stripe settings' % self.path)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+
+    def lock(self, key):
+        '''
+        Locks the bucket of "key" against the other threads and processes. It
+        can be taken again by the thread that holds it, so that many
+        operations can be done atomically.
+        '''
+
+        return self._lock(self._digest(key))
+
+    @contextmanager
+    def _lock(self, digest):
+        stripe = self._bucket(digest) % self.stripes
+        with self.thread_locks[stripe]:
+            if not self.depths[stripe]:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, stripe)
+            self.depths[stripe] += 1
+            try:
+                yield
+            finally:
+                self.depths[stripe] -= 1
+                if not self.depths[stripe]:
+                    fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, stripe)
+
+    def get(self, key):
+        '''
+        Returns the bytes stored for "key", or None if there's no such value
+        (or if it expired).
+        '''
+
+        digest = self._digest(key)
+        with self._lock(digest):
+            offset = self._find(digest)
+            if offset is None:
+                return None
+            length = SLOT_HEADER.unpack_from(self.memory, offset)[3]
+            start = offset + SLOT_HEADER.size
+            return self.memory[start:start + length]
+
+    def set(self, key, value, expire_seconds):
+        '''
+        Stores the "value" bytes, to expire in "expire_seconds".
+        '''
+
+        if len(value) > self.max_value_size:
+            raise ValueError('Values can have at most %d bytes with the current slot size (got %d bytes)' % (
+                self.max_value_size, len(value)))
+        digest = self._digest(key)
+        with self._lock(digest):
+            offset = self._find(digest)
+            if offset is None:
+                offset = self._free_slot(self._bucket(digest))
+            start = offset + SLOT_HEADER.size
+            self.memory[start:start + len(value)] = value
+            SLOT_HEADER.pack_into(self.memory, offset, USED, digest, time.time() + expire_seconds, len(value))
+
+    def touch(self, key, expire_seconds):
+        '''
+        Makes the value stored for "key" expire in "expire_seconds" from now.
+        '''
+
+        digest = self._digest(key)
+        with self._lock(digest):
+            offset = self._find(digest)
+            if offset is not None:
+                _, _, _, length = SLOT_HEADER.unpack_from(self.memory, offset)
+                SLOT_HEADER.pack_into(self.memory, offset, USED, digest, time.time() + expire_seconds, length)
+
+    def delete(self, key):
+        digest = self._digest(key)
+        with self._lock(digest):
+            offset = self._find(digest)
+            if offset is not None:
+                self._clear(offset)
+
+    def stats(self):
+        '''
+        Returns the number of "slots", of slots with live "entries" and of
+        "bytes" in these entries.
+        '''
+
+        now = time.time()
+        entries = size = 0
+        for slot in range(self.slots):
+            state, _, expires_at, length = SLOT_HEADER.unpack_from(self.memory, self._offset(slot))
+            if state == USED and expires_at > now:
+                entries += 1
+                size += length
+        return {'slots': self.slots, 'entries': entries, 'bytes': size}
+
+    def close(self):
+        self.memory.close()
+        os.close(self.fd)
+
+    def _find(self, digest):
+        now = time.time()
+        for slot in self._bucket_slots(self._bucket(digest)):
+            offset = self._offset(slot)
+            state, slot_digest, expires_at, _ = SLOT_HEADER.unpack_from(self.memory, offset)
+            if state != USED:
+                continue
+            if expires_at <= now:
+                self._clear(offset)
+            elif slot_digest == digest:
+                return offset
+        return None
+
+    def _free_slot(self, bucket):
+        soonest = None
+        for slot in self._bucket_slots(bucket):
+            offset = self._offset(slot)
+            state, _, expires_at, _ = SLOT_HEADER.unpack_from(self.memory, offset)
+            if state != USED:
+                return offset
+            if soonest is None or expires_at < soonest[0]:
+                soonest = (expires_at, offset)
+        return soonest[1]
+
+    def _clear(self, offset):
+        SLOT_HEADER.pack_into(self.memory, offset, EMPTY, b'', 0, 0)
+
+    def _bucket_slots(self, bucket):
+        start = bucket * self.BUCKET_SLOTS
+        return range(start, start + self.BUCKET_SLOTS)
+
+    def _offset(self, slot):
+        return FILE_HEADER_SIZE + slot * self.slot_size
+
+    def _bucket(self, digest):
+        return struct.unpack('>Q', digest[:8])[0] % self.buckets
+
+    def _digest(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return md5(key).digest()
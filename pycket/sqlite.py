@@ -0,0 +1,324 @@
+'''
+This module contains the store used by the "sqlite" engine, which keeps the
+sessions in a SQLite database file, so that they survive restarts without a
+datastore server.
+
+The database is used in WAL mode, so that reading doesn't wait for writing.
+Each thread reads with its own connection, but all the writes of the process
+go through a single writer thread, which commits the writes queued by
+concurrent requests together, in a single transaction ("group commit"), and
+only then lets them return. Changes that read and write a session are run
+inside that transaction, so they're atomic (even among processes, since the
+transaction locks the database for writing when it begins). When a commit
+fails (even to open the database), its writes raise the error, and the writer
+thread goes on with the next ones.
+
+Rows have an indexed expiration time: expired rows are never returned, and
+are deleted by the writer thread, a small batch at a time, between the group
+commits, so that deleting them never holds the requests for long.
+'''
+
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+TABLES = ('sessions', 'notifications')
+
+
+class SQLiteStore(object):
+    MAX_BATCH = 256
+    SWEEP_BATCH = 100
+    DEFAULT_SWEEP_INTERVAL = 5
+    BUSY_TIMEOUT = 10
+    WRITER_CHECK_INTERVAL = 1
+
+    def __init__(self, path, sweep_interval=DEFAULT_SWEEP_INTERVAL):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self.pid = os.getpid()
+        self.readers = threading.local()
+        self.operations = queue.Queue()
+        self.commits = 0
+        self.writes = 0
+        self.swept = 0
+        self._create_tables()
+        self.writer = threading.Thread(target=self._write_forever)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def get(self, table, key):
+        '''
+        Returns the bytes stored for "key" in "table", or None if there's no
+        such value (or if it expired).
+        '''
+
+        return self.select(self._reader(), table, key)
+
+    def scan(self, table, after, limit):
+        '''
+        Returns the keys (that didn't expire) of up to "limit" rows of "table",
+        in order, starting after the "after" key.
+        '''
+
+        rows = self._reader().execute('SELECT id FROM %s WHERE id > ? AND expires_at > ? ORDER BY id LIMIT ?' % table,
+                                      (_text(after), time.time(), limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def ttl_many(self, table, keys):
+        '''
+        Returns a dict with how many seconds are left until the row of each
+        key of "keys" expires (or None, if there's no such row).
+        '''
+
+        now = time.time()
+        ttls = dict((key, None) for key in keys)
+        for start in range(0, len(keys), self.MAX_BATCH):
+            batch = [_text(key) for key in keys[start:start + self.MAX_BATCH]]
+            rows = self._reader().execute('SELECT id, expires_at FROM %s WHERE id IN (%s) AND expires_at > ?' % (
+                table, ', '.join('?' * len(batch))), batch + [now])
+            for key, expires_at in rows:
+                ttls[key] = expires_at - now
+        return ttls
+
+    def set(self, table, key, value, expire_seconds):
+        '''
+        Stores the "value" bytes, to expire in "expire_seconds", and returns
+        when they're committed.
+        '''
+
+        self.write(lambda connection: self.upsert(connection, table, key, value, expire_seconds))
+
+    def touch(self, table, key, expire_seconds):
+        def touch(connection):
+            connection.execute('UPDATE %s SET expires_at = ? WHERE id = ? AND expires_at > ?' % table,
+                               (time.time() + expire_seconds, _text(key), time.time()))
+        self.write(touch)
+
+    def delete(self, table, key):
+        self.write(lambda connection: connection.execute('DELETE FROM %s WHERE id = ?' % table, (_text(key),)))
+
+    def delete_many(self, table, keys):
+        self.write(lambda connection: connection.executemany('DELETE FROM %s WHERE id = ?' % table,
+                                                             [(_text(key),) for key in keys]))
+
+    def write(self, function):
+        '''
+        Calls "function" with the connection of the writer thread, inside the
+        transaction of the next group commit, and returns its result after the
+        transaction is committed.
+        '''
+
+        self._check_writer()
+        operation = Operation(function)
+        self.operations.put(operation)
+        # Nothing would finish the operation without the writer thread, so it's checked while waiting.
+        while not operation.done.wait(self.WRITER_CHECK_INTERVAL):
+            if not operation.done.is_set():
+                self._check_writer()
+        if operation.error is not None:
+            raise operation.error
+        return operation.result
+
+    def select(self, connection, table, key):
+        row = connection.execute('SELECT data FROM %s WHERE id = ? AND expires_at > ?' % table,
+                                 (_text(key), time.time())).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0])
+
+    def upsert(self, connection, table, key, value, expire_seconds):
+        connection.execute('INSERT OR REPLACE INTO %s (id, data, expires_at) VALUES (?, ?, ?)' % table,
+                           (_text(key), sqlite3.Binary(value), time.time() + expire_seconds))
+
+    def rewrite(self, connection, table, key, value):
+        '''
+        Replaces the bytes stored for "key", keeping their expiration time.
+        '''
+
+        connection.execute('UPDATE %s SET data = ? WHERE id = ?' % table, (sqlite3.Binary(value), _text(key)))
+
+    def sweep(self, connection):
+        '''
+        Deletes a batch of expired rows from each table, and returns how many
+        rows were deleted.
+        '''
+
+        deleted = 0
+        for table in TABLES:
+            cursor = connection.execute(
+                'DELETE FROM %s WHERE id IN (SELECT id FROM %s WHERE expires_at <= ? LIMIT ?)' % (table, table),
+                (time.time(), self.SWEEP_BATCH))
+            deleted += cursor.rowcount
+        self.swept += deleted
+        return deleted
+
+    def stats(self):
+        '''
+        Returns how many "writes" were done, in how many "commits", and how
+        many expired rows were "swept".
+        '''
+
+        return {'writes': self.writes, 'commits': self.commits, 'swept': self.swept}
+
+    def close(self):
+        self.operations.put(None)
+        self.writer.join()
+
+    def _write_forever(self):
+        connection = None
+        next_sweep = time.time() + self.sweep_interval
+        while True:
+            batch = self._next_batch(max(0, next_sweep - time.time()))
+            if batch is None:
+                break
+            try:
+                # Connecting again after failing to, so that the writes work once the database can be opened.
+                if connection is None:
+                    connection = self._connect()
+                if batch:
+                    self._commit(connection, batch)
+                if time.time() >= next_sweep:
+                    swept = self._sweep_now(connection)
+                    # While there are more expired rows, keep deleting them between the writes.
+                    next_sweep = time.time() + (0 if swept >= self.SWEEP_BATCH else self.sweep_interval)
+            except Exception as error:
+                # The thread must outlive any error, or the writes queued after it would never return.
+                _fail(batch, error)
+                next_sweep = time.time() + self.sweep_interval
+        if connection is not None:
+            connection.close()
+
+    def _next_batch(self, timeout):
+        '''
+        Returns the operations queued until "timeout" expires (an empty list if
+        there are none), or None when the store is closed.
+        '''
+
+        try:
+            operation = self.operations.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        if operation is None:
+            return None
+        return self._batch(operation)
+
+    def _batch(self, operation):
+        batch = [operation]
+        while len(batch) < self.MAX_BATCH:
+            try:
+                operation = self.operations.get_nowait()
+            except queue.Empty:
+                break
+            if operation is None:
+                self.operations.put(None)
+                break
+            batch.append(operation)
+        return batch
+
+    def _commit(self, connection, batch):
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            for operation in batch:
+                try:
+                    operation.result = operation.function(connection)
+                except Exception as error:
+                    operation.error = error
+            connection.execute('COMMIT')
+            self.commits += 1
+            self.writes += len(batch)
+        except Exception as error:
+            _rollback(connection)
+            for operation in batch:
+                operation.error = error
+        finally:
+            for operation in batch:
+                operation.done.set()
+
+    def _sweep_now(self, connection):
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            swept = self.sweep(connection)
+            connection.execute('COMMIT')
+            return swept
+        except sqlite3.OperationalError:
+            _rollback(connection)
+            return 0
+
+    def _check_writer(self):
+        if not self.writer.is_alive():
+            raise RuntimeError('The writer thread of "%s" is not running (the store was closed, or created before forking)' % self.path)
+
+    def _create_tables(self):
+        connection = self._connect()
+        connection.execute('PRAGMA journal_mode=WAL')
+        for table in TABLES:
+            connection.execute('CREATE TABLE IF NOT EXISTS %s '
+                               '(id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)' % table)
+            connection.execute('CREATE INDEX IF NOT EXISTS %s_expires_at ON %s (expires_at)' % (table, table))
+        connection.close()
+
+    def _reader(self):
+        connection = getattr(self.readers, 'connection', None)
+        if connection is None:
+            connection = self.readers.connection = self._connect()
+        return connection
+
+    def _connect(self):
+        # Without an isolation level, the transactions are only the ones started explicitly.
+        connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, isolation_level=None,
+                                     check_same_thread=False)
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+
+class Operation(object):
+    def __init__(self, function):
+        self.function = function
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def shared_store(path, **settings):
+    '''
+    Returns the SQLiteStore for "path", creating it if it doesn't exist yet in
+    this process (stores created before forking are not reused, since their
+    writer thread doesn't exist in the forked process).
+    '''
+
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None or store.pid != os.getpid():
+            store = _stores[path] = SQLiteStore(path, **settings)
+        return store
+
+
+def _fail(operations, error):
+    for operation in operations:
+        if not operation.done.is_set():
+            operation.error = error
+            operation.done.set()
+
+
+def _rollback(connection):
+    try:
+        connection.execute('ROLLBACK')
+    except sqlite3.OperationalError:
+        pass
+
+
+def _text(key):
+    if isinstance(key, bytes):
+        return key.decode('utf-8')
+    return key
+
+
+_stores = {}
+_stores_lock = threading.Lock()
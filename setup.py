@@ -23,6 +23,8 @@ setup(name='pycket',
       ],
       entry_points="""
       # -*- Entry points: -*-
+      [console_scripts]
+      pycket-admin = pycket.admin:main
       """,
       test_suite="nose.collector",
       tests_require="nose",
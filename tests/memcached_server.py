@@ -0,0 +1,127 @@
+'''
+A minimal in-process stand-in for a Memcached server, speaking the text
+protocol commands used by python-memcached, so that the Memcached engine can be
+tested with many servers without running them.
+'''
+
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+class MemcachedServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), MemcachedHandler)
+        self.items = {}
+        self.next_cas = 1
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def address(self):
+        return '%s:%d' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, args=(0.01,))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def store(self, key, flags, expire, data):
+        expires_at = time.time() + expire if expire else None
+        self.items[key] = (flags, expires_at, data, self.next_cas)
+        self.next_cas += 1
+
+    def find(self, key):
+        item = self.items.get(key)
+        if item is not None and item[1] is not None and item[1] < time.time():
+            del self.items[key]
+            item = None
+        return item
+
+
+class MemcachedHandler(socketserver.StreamRequestHandler):
+    STORAGE_COMMANDS = (b'set', b'add', b'cas')
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.split()
+            if not parts:
+                continue
+            command = parts[0]
+            with self.server.lock:
+                self.server.requests += 1
+                if command in self.STORAGE_COMMANDS:
+                    data = self.rfile.read(int(parts[4]) + 2)[:-2]
+                    response = self.storage(command, parts, data)
+                else:
+                    response = getattr(self, 'do_%s' % command.decode('ascii'))(parts[1:])
+            self.wfile.write(response)
+
+    def storage(self, command, parts, data):
+        key, flags, expire = parts[1], parts[2], int(parts[3])
+        item = self.server.find(key)
+        if command == b'add' and item is not None:
+            return b'NOT_STORED\r\n'
+        if command == b'cas':
+            if item is None:
+                return b'NOT_FOUND\r\n'
+            if item[3] != int(parts[5]):
+                return b'EXISTS\r\n'
+        self.server.store(key, flags, expire, data)
+        return b'STORED\r\n'
+
+    def do_get(self, keys, with_cas=False):
+        response = b''
+        for key in keys:
+            item = self.server.find(key)
+            if item is None:
+                continue
+            flags, _, data, cas = item
+            header = b' '.join([b'VALUE', key, flags, str(len(data)).encode('ascii')])
+            if with_cas:
+                header += b' ' + str(cas).encode('ascii')
+            response += header + b'\r\n' + data + b'\r\n'
+        return response + b'END\r\n'
+
+    def do_gets(self, keys):
+        return self.do_get(keys, with_cas=True)
+
+    def do_touch(self, arguments):
+        key, expire = arguments[0], int(arguments[1])
+        item = self.server.find(key)
+        if item is None:
+            return b'NOT_FOUND\r\n'
+        flags, _, data, cas = item
+        self.server.items[key] = (flags, time.time() + expire if expire else None, data, cas)
+        return b'TOUCHED\r\n'
+
+    def do_delete(self, arguments):
+        if self.server.items.pop(arguments[0], None) is None:
+            return b'NOT_FOUND\r\n'
+        return b'DELETED\r\n'
+
+    def do_flush_all(self, arguments):
+        self.server.items.clear()
+        return b'OK\r\n'
+
+    def do_stats(self, arguments):
+        return b'STAT curr_items ' + str(len(self.server.items)).encode('ascii') + b'\r\nEND\r\n'
+
+    def do_version(self, arguments):
+        return b'VERSION 1.4.20\r\n'
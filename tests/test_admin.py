@@ -0,0 +1,318 @@
+import pickle
+import sys
+import time
+from unittest import TestCase
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from nose.tools import istest, raises
+import redis
+
+from pycket import admin
+from pycket.admin import main, Progress, ProgressReporter, SessionAdmin
+from pycket.driver import MemoryDriver, RedisDriver, RedisHashDriver, SQLiteDriver
+from tests.test_driver import RedisTestCase
+from tests.test_sqlite import SQLiteTestCase
+
+
+class SessionAdminTestMixin(object):
+    def populate(self, driver, count=25):
+        for index in range(count):
+            session = {'index': index}
+            if index % 5 == 0:
+                session['obsolete'] = True
+            driver.set('session-%d' % index, session)
+
+    def remaining_ids(self, driver):
+        return sorted(session_id for session_ids in driver.scan() for session_id in session_ids)
+
+    @istest
+    def counts_sessions(self):
+        driver = self.create_driver()
+        self.populate(driver)
+
+        self.assertEqual(SessionAdmin(driver, batch_size=4).count(), 25)
+
+    @istest
+    def purges_sessions_with_an_item(self):
+        driver = self.create_driver()
+        self.populate(driver)
+
+        progress = SessionAdmin(driver, batch_size=4, workers=2).purge('obsolete')
+
+        self.assertEqual((progress.processed, progress.matched, progress.changed), (25, 5, 5))
+        self.assertEqual(len(self.remaining_ids(driver)), 20)
+        self.assertEqual(driver.get('session-0'), {})
+        self.assertEqual(driver.get('session-1'), {'index': 1})
+
+    @istest
+    def removes_an_item_from_sessions(self):
+        driver = self.create_driver()
+        self.populate(driver)
+
+        progress = SessionAdmin(driver, batch_size=4).remove_item('obsolete')
+
+        self.assertEqual(progress.changed, 5)
+        self.assertEqual(len(self.remaining_ids(driver)), 25)
+        self.assertEqual(driver.get('session-5'), {'index': 5})
+
+    @istest
+    def keeps_the_expiration_of_changed_sessions(self):
+        driver = self.create_driver()
+        driver.EXPIRE_SECONDS = 100
+        self.populate(driver, count=5)
+        driver.EXPIRE_SECONDS = 1000
+
+        SessionAdmin(driver).remove_item('obsolete')
+
+        ttl = driver.ttl_many(['session-0'])['session-0']
+        self.assertTrue(0 < ttl <= 100)
+        self.assertEqual(driver.get('session-0'), {'index': 0})
+
+    @istest
+    def doesnt_bring_back_deleted_sessions(self):
+        driver = self.create_driver()
+
+        driver.update_many({'gone': ({}, ('obsolete',)), 'also-gone': ({'foo': 'bar'}, ())})
+
+        self.assertEqual(self.remaining_ids(driver), [])
+
+    @istest
+    def changes_nothing_in_dry_runs(self):
+        driver = self.create_driver()
+        self.populate(driver)
+
+        progress = SessionAdmin(driver, dry_run=True).purge('obsolete')
+
+        self.assertEqual((progress.matched, progress.changed), (5, 0))
+        self.assertEqual(len(self.remaining_ids(driver)), 25)
+
+    @istest
+    def expires_old_sessions(self):
+        driver = self.create_driver()
+        driver.EXPIRE_SECONDS = 100
+        driver.set('new', {'foo': 'bar'})
+        driver.EXPIRE_SECONDS = 50
+        driver.set('old', {'foo': 'bar'})
+        driver.EXPIRE_SECONDS = 100
+
+        progress = SessionAdmin(driver).expire_older_than(30)
+
+        self.assertEqual(progress.changed, 1)
+        self.assertEqual(self.remaining_ids(driver), ['new'])
+
+    @istest
+    def reports_progress_after_each_batch(self):
+        driver = self.create_driver()
+        self.populate(driver, count=10)
+        reports = []
+
+        SessionAdmin(driver, batch_size=5, report=lambda progress: reports.append(progress.processed)).count()
+
+        self.assertEqual(reports[-1], 10)
+        self.assertTrue(len(reports) >= 2)
+
+
+class MemorySessionAdminTest(SessionAdminTestMixin, TestCase):
+    def create_driver(self):
+        return MemoryDriver({})
+
+    @istest
+    def skips_notification_queues(self):
+        driver = self.create_driver()
+        driver.set('session-id', {'foo': 'bar'})
+        driver.push('session-id', ['queued'])
+
+        self.assertEqual(SessionAdmin(driver).count(), 1)
+
+    @istest
+    def limits_the_rate(self):
+        driver = self.create_driver()
+        self.populate(driver, count=10)
+
+        started = time.time()
+        SessionAdmin(driver, batch_size=5, max_rate=100).count()
+
+        self.assertGreaterEqual(time.time() - started, 0.05)
+
+    @istest
+    def sleeps_until_the_listed_sessions_are_within_the_rate(self):
+        session_admin = SessionAdmin(self.create_driver(), max_rate=100)
+        progress = Progress()
+        delays = []
+        original = admin.time.sleep
+        admin.time.sleep = delays.append
+        try:
+            session_admin._throttle(50, progress)
+            session_admin._throttle(0, progress)
+        finally:
+            admin.time.sleep = original
+
+        self.assertEqual(len(delays), 1)
+        self.assertTrue(0.4 < delays[0] <= 0.5)
+
+    @istest
+    @raises(ZeroDivisionError)
+    def stops_at_the_first_failed_batch(self):
+        driver = self.create_driver()
+        self.populate(driver, count=20)
+
+        SessionAdmin(driver, batch_size=1, workers=1).delete_where(lambda session_id, session: 1 / 0)
+
+
+class SQLiteSessionAdminTest(SessionAdminTestMixin, SQLiteTestCase):
+    def create_driver(self):
+        driver = SQLiteDriver({'path': self.path})
+        driver.client = self.create_store()
+        return driver
+
+
+class RedisSessionAdminTest(SessionAdminTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisDriver(dict(db=0))
+
+    @istest
+    def skips_notification_queues(self):
+        driver = RedisDriver(dict(db=0))
+        driver.set('session-id', {'foo': 'bar'})
+        driver.push('session-id', ['queued'])
+
+        self.assertEqual(SessionAdmin(driver).count(), 1)
+
+
+class PrefixedRedisSessionAdminTest(SessionAdminTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisDriver(dict(db=0, key_prefix='app:'))
+
+    @istest
+    def only_lists_keys_with_the_prefix(self):
+        driver = self.create_driver()
+        driver.set('session-id', {'foo': 'bar'})
+        self.client.set('other-key', 'value')
+
+        self.assertEqual(self.remaining_ids(driver), ['session-id'])
+
+
+class RedisHashSessionAdminTest(SessionAdminTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisHashDriver(dict(db=0))
+
+
+class ShardedRedisSessionAdminTest(SessionAdminTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisDriver(dict(db=0, nodes=[{'db': 2}, {'db': 3}]))
+
+
+class ProgressTest(TestCase):
+    @istest
+    def describes_progress(self):
+        progress = Progress()
+        progress.processed = 10
+        progress.matched = progress.changed = 2
+
+        self.assertIn('10 processed, 2 matched, 2 changed', str(progress))
+
+    @istest
+    def has_no_rate_before_any_time_elapsed(self):
+        progress = Progress()
+        progress.elapsed = lambda: 0
+
+        self.assertEqual(progress.rate(), 0.0)
+
+
+class ProgressReporterTest(TestCase):
+    @istest
+    def reports_at_most_once_per_interval(self):
+        stream = StringIO()
+        reporter = ProgressReporter(stream, interval=60)
+
+        reporter(Progress())
+        reporter(Progress())
+
+        self.assertEqual(len(stream.getvalue().splitlines()), 1)
+        self.assertIn('0 processed', stream.getvalue())
+
+
+class AdminCommandTest(RedisTestCase):
+    def run_main(self, arguments):
+        original = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            main(arguments)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = original
+
+    @istest
+    def counts_sessions(self):
+        self.client.set('session-1', pickle.dumps({'foo': 'bar'}))
+
+        self.assertEqual(self.run_main(['--quiet', 'count']), '1\n')
+
+    @istest
+    def removes_an_item_from_sessions(self):
+        self.client.set('session-1', pickle.dumps({'obsolete': True, 'foo': 'bar'}))
+
+        output = self.run_main(['--quiet', 'remove-item', 'obsolete'])
+
+        self.assertEqual(pickle.loads(self.client.get('session-1')), {'foo': 'bar'})
+        self.assertIn('1 changed', output)
+
+    @istest
+    def expires_old_sessions(self):
+        for session_id, ttl in (('old', 100), ('new', 1000)):
+            self.client.set(session_id, pickle.dumps({'foo': 'bar'}))
+            self.client.expire(session_id, ttl)
+
+        self.run_main(['--quiet', '--settings', '{"expire_seconds": 1000}', 'expire', '30'])
+
+        self.assertEqual(self.client.keys(), [b'new'])
+
+    @istest
+    def refuses_to_expire_sessions_without_the_expiration_of_the_application(self):
+        self.client.set('session-1', pickle.dumps({'foo': 'bar'}))
+        self.client.expire('session-1', 100)
+        original = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self.assertRaises(SystemExit, self.run_main, ['--quiet', 'expire', '30'])
+            self.assertIn('expire_seconds', sys.stderr.getvalue())
+        finally:
+            sys.stderr = original
+
+        self.assertEqual(self.client.keys(), [b'session-1'])
+
+    @istest
+    @raises(SystemExit)
+    def exits_with_an_error_for_engines_that_cannot_list_sessions(self):
+        original = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self.run_main(['--quiet', '--engine', 'memcached', 'count'])
+        except SystemExit as error:
+            self.assertEqual(error.code, 2)
+            self.assertIn('Listing sessions is not supported', sys.stderr.getvalue())
+            raise
+        finally:
+            sys.stderr = original
+
+    @istest
+    def purges_sessions(self):
+        self.client.set('session-1', pickle.dumps({'obsolete': True}))
+        self.client.set('session-2', pickle.dumps({'foo': 'bar'}))
+
+        main(['--quiet', '--storage', '{"db_sessions": 0}', 'purge', 'obsolete'])
+
+        self.assertEqual(self.client.keys(), [b'session-2'])
+
+    @istest
+    def administers_notifications(self):
+        notifications = redis.Redis(db=1)
+        notifications.set('session-1', pickle.dumps({'obsolete': True}))
+
+        main(['--quiet', '--notifications', 'remove-item', 'obsolete'])
+
+        self.assertEqual(pickle.loads(notifications.get('session-1')), {})
@@ -0,0 +1,261 @@
+import pickle
+import threading
+
+from nose.tools import istest, raises
+import redis
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncTestCase, gen_test
+
+from pycket.asynchronous import (
+    AsyncNotificationManager, AsyncNotificationMixin, AsyncSessionManager,
+    AsyncSessionMixin)
+from pycket.driver import RedisDriver, registry
+
+
+class AsyncRedisTestCase(AsyncTestCase):
+    client = None
+
+    def setUp(self):
+        super(AsyncRedisTestCase, self).setUp()
+        if self.client is None:
+            self.client = redis.Redis(db=RedisDriver.DEFAULT_STORAGE_IDENTIFIERS['db_sessions'])
+        self.client.flushall()
+        registry.clear()
+
+
+class AsyncMixinTest(AsyncRedisTestCase):
+    @istest
+    def starts_handler_with_async_managers(self):
+        class StubHandler(AsyncSessionMixin, AsyncNotificationMixin):
+            settings = {
+                'pycket': {
+                    'engine': 'redis',
+                }
+            }
+
+        handler = StubHandler()
+
+        self.assertIsInstance(handler.session, AsyncSessionManager)
+        self.assertIsInstance(handler.notifications, AsyncNotificationManager)
+
+
+class AsyncSessionManagerTest(AsyncRedisTestCase):
+    @istest
+    @gen_test
+    def sets_and_gets_objects(self):
+        handler = StubHandler()
+        manager = AsyncSessionManager(handler)
+
+        yield manager.set('foo', 'bar')
+        value = yield manager.get('foo')
+
+        self.assertEqual(value, 'bar')
+        self.assertEqual(pickle.loads(self.client.get(handler.session_id)), {'foo': 'bar'})
+
+    @istest
+    @gen_test
+    def deletes_objects(self):
+        manager = AsyncSessionManager(StubHandler())
+
+        yield manager.set('foo', 'bar')
+        yield manager.delete('foo')
+        value = yield manager.get('foo', 'default')
+
+        self.assertEqual(value, 'default')
+
+    @istest
+    @gen_test
+    def lists_and_checks_keys(self):
+        manager = AsyncSessionManager(StubHandler())
+
+        yield manager.set('foo', 'bar')
+        keys = yield manager.keys()
+        contains = yield manager.contains('foo')
+
+        self.assertEqual(keys, ['foo'])
+        self.assertTrue(contains)
+
+    @istest
+    @gen_test
+    def uses_dict_keys(self):
+        manager = AsyncSessionManager(StubHandler())
+
+        yield manager.__setitem__('foo', 'bar')
+        value = yield manager['foo']
+
+        self.assertEqual(value, 'bar')
+
+    @istest
+    @gen_test
+    def raises_key_error_if_object_doesnt_exist(self):
+        manager = AsyncSessionManager(StubHandler())
+
+        with self.assertRaises(KeyError):
+            yield manager['foo']
+
+    @istest
+    @raises(TypeError)
+    def cannot_check_keys_with_in_operator(self):
+        manager = AsyncSessionManager(StubHandler())
+
+        'foo' in manager
+
+    @istest
+    @gen_test
+    def doesnt_block_the_ioloop_while_reading(self):
+        manager = AsyncSessionManager(StubHandler())
+        loop_ran = threading.Event()
+        original_get = manager.driver.get
+
+        def get(session_id):
+            loop_ran.wait(5)
+            return original_get(session_id)
+        manager.driver.get = get
+        IOLoop.current().add_callback(loop_ran.set)
+
+        yield manager.get('foo')
+
+        self.assertTrue(loop_ran.is_set())
+
+    @istest
+    @gen_test
+    def uses_the_handler_only_in_the_ioloop_thread(self):
+        handler = NewSessionHandler()
+        manager = AsyncSessionManager(handler)
+
+        yield manager.set('foo', 'bar')
+        value = yield manager.get('foo')
+
+        self.assertEqual(value, 'bar')
+        self.assertEqual(handler.threads, [threading.current_thread()] * 2)
+
+    @istest
+    @gen_test
+    def pops_objects(self):
+        manager = AsyncSessionManager(StubHandler())
+
+        yield manager.set('foo', 'bar')
+        value = yield manager.pop('foo')
+        missing = yield manager.pop('foo', 'default')
+
+        self.assertEqual((value, missing), ('bar', 'default'))
+
+    @istest
+    @gen_test
+    def iterates_keys(self):
+        manager = AsyncSessionManager(StubHandler())
+
+        yield manager.set('foo', 'bar')
+        keys = yield manager.iterkeys()
+
+        self.assertEqual(list(keys), ['foo'])
+
+    @istest
+    @raises(TypeError)
+    def cannot_iterate_keys_without_yielding(self):
+        manager = AsyncSessionManager(StubHandler())
+
+        iter(manager)
+
+    @istest
+    @gen_test
+    def loads_and_flushes_sessions_with_write_back(self):
+        handler = StubHandler({
+            'pycket': {
+                'engine': 'redis',
+                'write_back': True,
+            }
+        })
+        manager = AsyncSessionManager(handler)
+        notifications = AsyncNotificationManager(handler)
+
+        yield manager.load(notifications)
+        yield manager.set('foo', 'bar')
+        self.assertIsNone(self.client.get(handler.session_id))
+        yield manager.flush()
+
+        self.assertEqual(pickle.loads(self.client.get(handler.session_id)), {'foo': 'bar'})
+
+    @istest
+    @gen_test
+    def finds_and_deletes_the_sessions_of_a_user(self):
+        manager = AsyncSessionManager(StubHandler({
+            'pycket': {
+                'engine': 'redis',
+                'index': 'user',
+            }
+        }))
+
+        yield manager.set('user', 'john')
+        session_ids = yield manager.sessions_of('john')
+        deleted = yield manager.delete_sessions_of('john')
+
+        self.assertEqual(session_ids, ['session-id'])
+        self.assertEqual(deleted, ['session-id'])
+        self.assertIsNone(self.client.get('session-id'))
+
+
+class AsyncNotificationManagerTest(AsyncRedisTestCase):
+    @istest
+    @gen_test
+    def gets_a_notification_only_once(self):
+        manager = AsyncNotificationManager(StubHandler())
+
+        yield manager.set('foo', 'bar')
+        first = yield manager.get('foo')
+        second = yield manager.get('foo')
+
+        self.assertEqual(first, 'bar')
+        self.assertIsNone(second)
+
+    @istest
+    @gen_test
+    def pops_all_notifications(self):
+        manager = AsyncNotificationManager(StubHandler())
+
+        yield manager.set('foo', 'bar')
+        notifications = yield manager.pop_all()
+
+        self.assertEqual(notifications, {'foo': 'bar'})
+
+    @istest
+    @gen_test
+    def consumes_pushed_notifications(self):
+        manager = AsyncNotificationManager(StubHandler())
+
+        yield manager.push('foo', 'bar')
+        notifications = yield manager.consume()
+
+        self.assertEqual(notifications, ['foo', 'bar'])
+
+
+class StubHandler(object):
+    session_id = 'session-id'
+
+    def __init__(self, settings=None):
+        default_settings = {
+            'pycket': {
+                'engine': 'redis',
+            }
+        }
+        self.settings = settings if settings is not None else default_settings
+
+    def get_secure_cookie(self, name):
+        return self.session_id
+
+
+class NewSessionHandler(StubHandler):
+    '''
+    A handler without a session cookie, that remembers the threads it was
+    used in.
+    '''
+
+    def __init__(self, settings=None):
+        super(NewSessionHandler, self).__init__(settings)
+        self.threads = []
+
+    def get_secure_cookie(self, name):
+        self.threads.append(threading.current_thread())
+
+    def set_secure_cookie(self, name, value, **settings):
+        self.threads.append(threading.current_thread())
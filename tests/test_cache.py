@@ -0,0 +1,155 @@
+import pickle
+import time
+from unittest import TestCase
+
+from nose.tools import istest
+
+from pycket.cache import create_cache, SessionCache
+from pycket.lazy import LazySession
+
+
+class SessionCacheTest(TestCase):
+    @istest
+    def returns_none_for_missing_sessions(self):
+        cache = SessionCache()
+
+        self.assertIsNone(cache.get('session-id'))
+
+    @istest
+    def returns_copies_of_cached_sessions(self):
+        cache = SessionCache()
+        session = {'foo': 'bar'}
+
+        cache.set('session-id', session, 10)
+        session['foo'] = 'changed'
+        cached_session = cache.get('session-id')
+        cached_session['foo'] = 'changed again'
+
+        self.assertEqual(cache.get('session-id'), {'foo': 'bar'})
+
+    @istest
+    def doesnt_share_mutable_values_between_copies(self):
+        cache = SessionCache()
+        session = {'cart': ['book'], 'user': 'john'}
+
+        cache.set('session-id', session, 10)
+        session['cart'].append('pen')
+        cache.get('session-id')['cart'].append('lamp')
+
+        self.assertEqual(cache.get('session-id'), {'cart': ['book'], 'user': 'john'})
+
+    @istest
+    def keeps_the_values_of_lazy_sessions_serialized(self):
+        cache = SessionCache()
+        session = LazySession({'cart': pickle.dumps(['book'])}, pickle.loads)
+        session['flags'] = {'beta': True}
+
+        cache.set('session-id', session, 10)
+        session['flags']['beta'] = False
+        cached_session = cache.get('session-id')
+
+        self.assertEqual(cached_session.raw_values, {'cart': pickle.dumps(['book'])})
+        self.assertEqual(cached_session, {'cart': ['book'], 'flags': {'beta': True}})
+
+    @istest
+    def treats_bytes_and_text_ids_as_the_same_session(self):
+        cache = SessionCache()
+
+        cache.set(b'session-id', {'foo': 'bar'}, 10)
+        self.assertEqual(cache.get('session-id'), {'foo': 'bar'})
+        cache.invalidate('session-id')
+
+        self.assertIsNone(cache.get(b'session-id'))
+
+    @istest
+    def expires_sessions_after_ttl(self):
+        cache = SessionCache(ttl=-1)
+
+        cache.set('session-id', {'foo': 'bar'}, 10)
+
+        self.assertIsNone(cache.get('session-id'))
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    @istest
+    def evicts_least_recently_used_sessions_above_max_entries(self):
+        cache = SessionCache(max_entries=2)
+
+        cache.set('first', {}, 1)
+        cache.set('second', {}, 1)
+        cache.get('first')
+        cache.set('third', {}, 1)
+
+        self.assertIsNone(cache.get('second'))
+        self.assertIsNotNone(cache.get('first'))
+        self.assertIsNotNone(cache.get('third'))
+
+    @istest
+    def evicts_sessions_above_max_bytes(self):
+        cache = SessionCache(max_bytes=100)
+
+        cache.set('first', {}, 60)
+        cache.set('second', {}, 60)
+
+        self.assertIsNone(cache.get('first'))
+        self.assertEqual(cache.stats()['bytes'], 60)
+
+    @istest
+    def invalidates_sessions(self):
+        cache = SessionCache()
+        cache.set('session-id', {'foo': 'bar'}, 10)
+
+        cache.invalidate('session-id')
+        cache.invalidate('other-session-id')
+
+        self.assertIsNone(cache.get('session-id'))
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    @istest
+    def counts_hits_misses_and_evictions(self):
+        cache = SessionCache(max_entries=1)
+
+        cache.set('first', {}, 10)
+        cache.get('first')
+        cache.set('second', {}, 10)
+        cache.get('first')
+
+        self.assertEqual(cache.stats(), {
+            'hits': 1,
+            'misses': 1,
+            'evictions': 1,
+            'invalidations': 0,
+            'entries': 1,
+            'bytes': 10,
+        })
+
+    @istest
+    def clears_all_sessions(self):
+        cache = SessionCache()
+        cache.set('session-id', {}, 10)
+
+        cache.clear()
+
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+
+class CreateCacheTest(TestCase):
+    @istest
+    def creates_cache_with_defaults(self):
+        cache = create_cache(True)
+
+        self.assertEqual(cache.max_entries, SessionCache.DEFAULT_MAX_ENTRIES)
+        self.assertEqual(cache.ttl, SessionCache.DEFAULT_TTL)
+
+    @istest
+    def creates_cache_with_settings(self):
+        cache = create_cache({'max_entries': 10, 'max_bytes': 1024, 'ttl': 5})
+
+        self.assertEqual((cache.max_entries, cache.max_bytes, cache.ttl), (10, 1024, 5))
+
+
+def wait_for(condition, timeout=2):
+    limit = time.time() + timeout
+    while not condition() and time.time() < limit:
+        time.sleep(0.01)
+    return condition()
@@ -0,0 +1,89 @@
+import zlib
+from unittest import TestCase
+
+from nose.tools import istest, raises
+
+from pycket.compression import (
+    create_compressor, decompress, LZMACompressor, ZlibCompressor)
+
+
+LARGE_DATA = b'session data ' * 1000
+
+
+class ZlibCompressorTest(TestCase):
+    @istest
+    def compresses_data_above_threshold_with_header(self):
+        compressor = ZlibCompressor(threshold=100)
+
+        data = compressor.compress(LARGE_DATA)
+
+        self.assertEqual(data[:1], ZlibCompressor.TAG)
+        self.assertEqual(zlib.decompress(data[1:]), LARGE_DATA)
+
+    @istest
+    def keeps_data_below_threshold(self):
+        compressor = ZlibCompressor(threshold=100)
+
+        self.assertEqual(compressor.compress(b'small'), b'small')
+
+    @istest
+    def keeps_data_that_doesnt_get_smaller(self):
+        compressor = ZlibCompressor(threshold=0)
+
+        self.assertEqual(compressor.compress(b'abc'), b'abc')
+
+    @istest
+    def counts_compression_ratio(self):
+        compressor = ZlibCompressor(threshold=100)
+
+        compressed = compressor.compress(LARGE_DATA)
+        compressor.compress(b'small')
+
+        stats = compressor.stats()
+        self.assertEqual(stats['compressed'], 1)
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(stats['bytes_in'], len(LARGE_DATA))
+        self.assertEqual(stats['bytes_out'], len(compressed))
+        self.assertAlmostEqual(stats['ratio'], float(len(compressed)) / len(LARGE_DATA))
+
+    @istest
+    def starts_with_neutral_ratio(self):
+        self.assertEqual(ZlibCompressor().stats()['ratio'], 1.0)
+
+
+class LZMACompressorTest(TestCase):
+    @istest
+    def compresses_and_decompresses(self):
+        compressor = LZMACompressor(threshold=100)
+
+        data = compressor.compress(LARGE_DATA)
+
+        self.assertEqual(data[:1], LZMACompressor.TAG)
+        self.assertEqual(compressor.decompress(data), LARGE_DATA)
+
+
+class CompressionFunctionsTest(TestCase):
+    @istest
+    def creates_compressor_by_name(self):
+        self.assertIsInstance(create_compressor('zlib'), ZlibCompressor)
+
+    @istest
+    def creates_compressor_with_settings(self):
+        compressor = create_compressor({'algorithm': 'zlib', 'threshold': 10, 'level': 9})
+
+        self.assertEqual(compressor.threshold, 10)
+        self.assertEqual(compressor.level, 9)
+
+    @istest
+    @raises(ValueError)
+    def cannot_create_unknown_compressor(self):
+        create_compressor('zip-drive')
+
+    @istest
+    def decompresses_with_the_compressor_used(self):
+        for compressor in (ZlibCompressor(threshold=0), LZMACompressor(threshold=0)):
+            self.assertEqual(decompress(compressor.compress(LARGE_DATA)), LARGE_DATA)
+
+    @istest
+    def returns_uncompressed_data_untouched(self):
+        self.assertEqual(decompress(b'\x80plain'), b'\x80plain')
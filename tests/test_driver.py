@@ -1,10 +1,26 @@
+import os
 import pickle
+import threading
+import time
 from unittest import TestCase
 
 from nose.tools import istest, raises
 import redis
 
-from pycket.driver import DriverFactory, MemcachedDriver, RedisDriver
+from pycket.driver import (
+    DriverFactory, DriverRegistry, MemcachedDriver, MemoryDriver, RecentWrites,
+    RedisDriver, RedisHashDriver, SharedMemoryDriver, SQLiteDriver, TouchThrottle,
+    UpdateConflictError)
+from pycket import lazy
+from pycket.compression import ZlibCompressor
+from pycket.hashring import HashRing
+from pycket.lazy import LazySession
+from pycket.serializer import JSONSerializer
+from pycket.sqlite import shared_store
+from tests.memcached_server import MemcachedServer
+from tests.test_cache import wait_for
+from tests.test_shared_memory import SharedMemoryTestCase
+from tests.test_sqlite import SQLiteTestCase
 
 
 class RedisTestCase(TestCase):
@@ -60,78 +76,1140 @@ class RedisDriverTest(RedisTestCase):
 
         driver.set('session-id', foo)
 
+    @istest
+    def uses_configured_serializer(self):
+        driver = RedisDriver(dict(db=0))
+        driver.configure({'serializer': 'json'})
+
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(self.client.get('session-id'), JSONSerializer().dumps({'foo': 'bar'}))
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+
+    @istest
+    def reads_sessions_written_with_other_serializers(self):
+        driver = RedisDriver(dict(db=0))
+        driver.configure({'serializer': 'json'})
+
+        self.client.set('session-id', pickle.dumps({'foo': 'bar'}))
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+
+    @istest
+    def compresses_large_sessions(self):
+        driver = RedisDriver(dict(db=0))
+        driver.configure({'compression': {'algorithm': 'zlib', 'threshold': 100}})
+        session = {'foo': 'bar' * 1000}
+
+        driver.set('session-id', session)
+
+        self.assertEqual(self.client.get('session-id')[:1], ZlibCompressor.TAG)
+        self.assertEqual(driver.get('session-id'), session)
+        self.assertEqual(driver.compressor.stats()['compressed'], 1)
+
+    @istest
+    def reads_compressed_sessions_without_compression_enabled(self):
+        driver = RedisDriver(dict(db=0))
+
+        self.client.set('session-id', ZlibCompressor(threshold=0).compress(pickle.dumps({'foo': 'bar' * 100})))
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar' * 100})
+
+    @istest
+    def stores_lazy_sessions_as_records(self):
+        driver = RedisDriver(dict(db=0))
+        driver.configure({'lazy_values': True})
+
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+        session = driver.get('session-id')
+
+        self.assertTrue(lazy.is_record(self.client.get('session-id')))
+        self.assertIsInstance(session, LazySession)
+        self.assertEqual(session, {'foo': 'bar', 'baz': 'qux'})
+
+    @istest
+    def reads_lazy_sessions_without_lazy_values_enabled(self):
+        lazy_driver = RedisDriver(dict(db=0))
+        lazy_driver.configure({'lazy_values': True})
+        lazy_driver.set('session-id', {'foo': 'bar'})
+        driver = RedisDriver(dict(db=0))
+
+        driver.set('session-id', driver.get('session-id'))
+
+        self.assertEqual(pickle.loads(self.client.get('session-id')), {'foo': 'bar'})
+
+    @istest
+    def refreshes_expiration_when_touching_with_sliding_expiration(self):
+        driver = RedisDriver(dict(db=0))
+        driver.configure({'sliding_expiration': 60})
+        self.client.set('session-id', pickle.dumps({'foo': 'bar'}))
+        self.client.expire('session-id', 10)
+
+        driver.touch('session-id')
+
+        self.assertGreater(self.client.ttl('session-id'), 10)
+        self.assertEqual(pickle.loads(self.client.get('session-id')), {'foo': 'bar'})
+
+    @istest
+    def doesnt_touch_without_sliding_expiration(self):
+        driver = RedisDriver(dict(db=0))
+        self.client.set('session-id', pickle.dumps({'foo': 'bar'}))
+        self.client.expire('session-id', 10)
+
+        driver.touch('session-id')
+
+        self.assertLessEqual(self.client.ttl('session-id'), 10)
+
+    @istest
+    def touches_session_at_most_once_per_interval(self):
+        driver = RedisDriver(dict(db=0))
+        driver.configure({'sliding_expiration': 60})
+        expirations = []
+
+        class StubClient(object):
+            def expire(self, session_id, expiration):
+                expirations.append(session_id)
+
+        driver.client = StubClient()
+
+        driver.touch('session-id')
+        driver.touch('session-id')
+        driver.touch('other-session-id')
+
+        self.assertEqual(expirations, ['session-id', 'other-session-id'])
+
+    @istest
+    def doesnt_touch_session_recently_written(self):
+        driver = RedisDriver(dict(db=0))
+        driver.configure({'sliding_expiration': 60})
+        driver.set('session-id', {'foo': 'bar'})
+        self.client.expire('session-id', 10)
+
+        driver.touch('session-id')
+
+        self.assertLessEqual(self.client.ttl('session-id'), 10)
+
+    @istest
+    def uses_expiration_for_its_category(self):
+        driver = RedisDriver(dict(db=0))
+        driver.configure({'expire_seconds': {'db_sessions': 100, 'db_notifications': 10}}, 'db_notifications')
+
+        self.assertEqual(driver.EXPIRE_SECONDS, 10)
+
+    @istest
+    def uses_expiration_for_all_categories(self):
+        driver = RedisDriver(dict(db=0))
+        driver.configure({'expire_seconds': 100}, 'db_notifications')
+
+        self.assertEqual(driver.EXPIRE_SECONDS, 100)
+
+    @istest
+    def updates_session_values(self):
+        driver = RedisDriver(dict(db=0))
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+
+        driver.update('session-id', {'foo': 'changed'}, deleted_names=['baz'])
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'changed'})
+        self.assertGreater(self.client.ttl('session-id'), 0)
+
+    @istest
+    def merges_changes_made_concurrently(self):
+        driver = RedisDriver(dict(db=0))
+        client = self.client
+        attempts = []
+        original_apply = driver._apply
+
+        def apply(session, values, deleted_names):
+            if not attempts:
+                client.set('session-id', pickle.dumps({'other': 'change'}))
+            attempts.append(True)
+            original_apply(session, values, deleted_names)
+        driver._apply = apply
+
+        driver.update('session-id', {'foo': 'bar'})
+
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(pickle.loads(self.client.get('session-id')), {'other': 'change', 'foo': 'bar'})
+
+    @istest
+    @raises(UpdateConflictError)
+    def gives_up_updating_if_session_keeps_changing(self):
+        driver = RedisDriver(dict(db=0))
+        client = self.client
+        original_apply = driver._apply
+
+        def apply(session, values, deleted_names):
+            client.set('session-id', pickle.dumps({'other': 'change'}))
+            original_apply(session, values, deleted_names)
+        driver._apply = apply
+
+        driver.update('session-id', {'foo': 'bar'})
+
+    @istest
+    def pops_a_value_from_session(self):
+        driver = RedisDriver(dict(db=0))
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+
+        self.assertEqual(driver.pop('session-id', 'foo'), 'bar')
+        self.assertEqual(driver.pop('session-id', 'foo', 'default'), 'default')
+        self.assertEqual(pickle.loads(self.client.get('session-id')), {'baz': 'qux'})
+
+    @istest
+    def doesnt_write_session_when_popping_missing_value(self):
+        driver = RedisDriver(dict(db=0))
+
+        self.assertIsNone(driver.pop('session-id', 'foo'))
+        self.assertIsNone(self.client.get('session-id'))
+
+    @istest
+    def pops_all_values_from_session(self):
+        driver = RedisDriver(dict(db=0))
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+
+        self.assertEqual(driver.pop_all('session-id'), {'foo': 'bar', 'baz': 'qux'})
+        self.assertEqual(driver.pop_all('session-id'), {})
+        self.assertIsNone(self.client.get('session-id'))
+
     @istest
     def starts_with_1_day_to_expire_in_database(self):
         driver = RedisDriver(dict(db=0))
 
-        one_day = 24 * 60 * 60
+        one_day = 24 * 60 * 60
+
+        self.assertEqual(driver.EXPIRE_SECONDS, one_day)
+
+    @istest
+    def starts_with_max_connections(self):
+        driver = RedisDriver(dict(db=0, max_connections=123))
+        driver.get('some session')
+
+        self.assertEqual(driver.client.connection_pool.max_connections, 123)
+
+    @istest
+    def consumes_pushed_values_in_order(self):
+        driver = RedisDriver(dict(db=0))
+
+        driver.push('session-id', ['foo', 'bar'])
+        driver.push('session-id', ['baz'])
+
+        self.assertEqual(driver.consume('session-id', 2), ['foo', 'bar'])
+        self.assertEqual(driver.consume('session-id'), ['baz'])
+        self.assertEqual(driver.consume('session-id'), [])
+        self.assertFalse(self.client.exists('session-id:queue'))
+
+    @istest
+    def pushes_no_values(self):
+        driver = RedisDriver(dict(db=0))
+
+        driver.push('session-id', [])
+
+        self.assertFalse(self.client.exists('session-id:queue'))
+        self.assertEqual(driver.consume('session-id'), [])
+
+    @istest
+    def keeps_only_the_newest_values_in_the_queue(self):
+        driver = RedisDriver(dict(db=0))
+        driver.configure({'max_notifications': 2})
+
+        driver.push('session-id', ['foo', 'bar', 'baz'])
+        driver.push('session-id', ['qux'])
+
+        self.assertEqual(driver.consume('session-id'), ['baz', 'qux'])
+
+    @istest
+    def sets_expiration_on_the_queue(self):
+        driver = RedisDriver(dict(db=0))
+
+        driver.push('session-id', ['foo'])
+
+        self.assertGreater(self.client.ttl('session-id:queue'), 0)
+
+    def change_during_bulk_updates(self, driver, times):
+        original = driver._queue_bulk_update
+        changed = []
+
+        def queue_bulk_update(pipeline, session_id, results, values, deleted_names):
+            if len(changed) < times:
+                # Someone else changes the session between the WATCH and the EXEC.
+                self.client.set('session-2', pickle.dumps({'foo': 'changed'}))
+                changed.append(session_id)
+            return original(pipeline, session_id, results, values, deleted_names)
+        driver._queue_bulk_update = queue_bulk_update
+
+    @istest
+    def updates_sessions_one_by_one_if_changed_during_a_bulk_update(self):
+        driver = RedisDriver(dict(db=0))
+        driver.set('session-1', {'foo': 'bar'})
+        driver.set('session-2', {'foo': 'bar'})
+        self.change_during_bulk_updates(driver, times=1)
+
+        driver.update_many({'session-1': ({'baz': 'qux'}, ()), 'session-2': ({'baz': 'qux'}, ())})
+
+        self.assertEqual(driver.get('session-1'), {'foo': 'bar', 'baz': 'qux'})
+        self.assertEqual(driver.get('session-2'), {'foo': 'changed', 'baz': 'qux'})
+
+    @istest
+    @raises(UpdateConflictError)
+    def gives_up_bulk_updates_of_sessions_that_keep_changing(self):
+        driver = RedisDriver(dict(db=0))
+        driver.set('session-2', {'foo': 'bar'})
+        self.change_during_bulk_updates(driver, times=RedisDriver.MAX_UPDATE_ATTEMPTS + 1)
+
+        driver.update_many({'session-2': ({'baz': 'qux'}, ())})
+
+
+class CachedRedisDriverTest(RedisTestCase):
+    def create_driver(self):
+        driver = RedisDriver(dict(db=0))
+        driver.configure({'cache': True})
+        return driver
+
+    @istest
+    def reads_session_from_datastore_only_once(self):
+        driver = self.create_driver()
+        self.client.set('session-id', pickle.dumps({'foo': 'bar'}))
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+        self.client.set('session-id', pickle.dumps({'foo': 'changed elsewhere'}))
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+
+        self.assertEqual(driver.cache.stats()['hits'], 1)
+        self.assertEqual(driver.cache.stats()['misses'], 1)
+
+    @istest
+    def caches_written_sessions(self):
+        driver = self.create_driver()
+
+        driver.set('session-id', {'foo': 'bar'})
+        self.client.set('session-id', pickle.dumps({'foo': 'changed elsewhere'}))
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+
+    @istest
+    def updates_session_from_datastore(self):
+        driver = self.create_driver()
+        driver.get('session-id')
+        self.client.set('session-id', pickle.dumps({'foo': 'changed elsewhere'}))
+
+        driver.update('session-id', {'bar': 'baz'})
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'changed elsewhere', 'bar': 'baz'})
+
+    @istest
+    def invalidates_session_written_by_other_processes(self):
+        driver = self.create_driver()
+        other_driver = self.create_driver()
+        driver.get('session-id')
+
+        other_driver.set('session-id', {'foo': 'bar'})
+
+        self.assertTrue(wait_for(lambda: driver.cache.stats()['invalidations'] == 1))
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+
+    @istest
+    def invalidates_session_with_bytes_id_written_by_other_processes(self):
+        driver = self.create_driver()
+        other_driver = self.create_driver()
+        driver.get(b'session-id')
+
+        other_driver.set(b'session-id', {'foo': 'bar'})
+
+        self.assertTrue(wait_for(lambda: driver.cache.stats()['invalidations'] == 1))
+        self.assertEqual(driver.get(b'session-id'), {'foo': 'bar'})
+
+    @istest
+    def publishes_session_ids_as_text(self):
+        driver = self.create_driver()
+        driver._setup_client()
+        published = []
+        driver.client.publish = lambda channel, message: published.append(message)
+
+        driver.set(b'session-id', {'foo': 'bar'})
+
+        self.assertEqual(published, ['%s session-id' % driver.origin])
+
+    @istest
+    def ignores_its_own_invalidations(self):
+        driver = self.create_driver()
+        driver.set('session-id', {'foo': 'bar'})
+
+        driver._invalidated(('%s session-id' % driver.origin).encode('utf-8'))
+
+        self.assertEqual(driver.cache.stats()['entries'], 1)
+
+    @istest
+    def clears_the_cache_and_subscribes_again_after_losing_the_connection(self):
+        driver = self.create_driver()
+        driver.RESUBSCRIBE_INTERVAL = 0
+        self.client.set('session-id', pickle.dumps({'foo': 'bar'}))
+        driver.get('session-id')
+        received = []
+        driver._invalidated = received.append
+        driver._subscribe = lambda: FakePubSub([
+            {'type': 'subscribe', 'data': 1}, {'type': 'message', 'data': 'other session-id'}, StopListening()])
+
+        try:
+            driver._receive_invalidations(FakePubSub([redis.ConnectionError()]))
+        except StopListening:
+            pass
+
+        self.assertEqual(driver.cache.stats()['entries'], 0)
+        self.assertEqual(received, ['other session-id'])
+
+
+class RedisHashDriverTest(RedisTestCase):
+    @istest
+    def inserts_each_session_item_as_a_hash_field(self):
+        driver = RedisHashDriver(dict(db=0))
+
+        driver.set('session-id', {'foo': 'bar', 'baz': [1, 2]})
+
+        self.assertEqual(pickle.loads(self.client.hget('session-id', 'foo')), 'bar')
+        self.assertEqual(pickle.loads(self.client.hget('session-id', 'baz')), [1, 2])
+
+    @istest
+    def retrieves_the_whole_session(self):
+        driver = RedisHashDriver(dict(db=0))
+
+        self.client.hset('session-id', 'foo', pickle.dumps('bar'))
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+
+    @istest
+    def replaces_the_whole_session(self):
+        driver = RedisHashDriver(dict(db=0))
+
+        driver.set('session-id', {'foo': 'bar'})
+        driver.set('session-id', {'baz': 'qux'})
+
+        self.assertEqual(driver.get('session-id'), {'baz': 'qux'})
+
+    @istest
+    def retrieves_a_single_value(self):
+        driver = RedisHashDriver(dict(db=0))
+
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+
+        self.assertEqual(driver.get_value('session-id', 'foo'), 'bar')
+        self.assertEqual(driver.get_value('session-id', 'other', 'default'), 'default')
+
+    @istest
+    def updates_and_deletes_only_the_given_fields(self):
+        driver = RedisHashDriver(dict(db=0))
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+
+        driver.update('session-id', {'foo': 'changed'}, deleted_names=['baz'])
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'changed'})
+        self.assertGreater(self.client.ttl('session-id'), 0)
+
+    @istest
+    def lists_and_checks_keys(self):
+        driver = RedisHashDriver(dict(db=0))
+
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(driver.keys('session-id'), ['foo'])
+        self.assertTrue(driver.contains('session-id', 'foo'))
+        self.assertFalse(driver.contains('session-id', 'bar'))
+
+    @istest
+    def retrieves_lazy_sessions(self):
+        driver = RedisHashDriver(dict(db=0))
+        driver.configure({'lazy_values': True})
+
+        driver.set('session-id', {'foo': 'bar'})
+        session = driver.get('session-id')
+
+        self.assertIsInstance(session, LazySession)
+        self.assertEqual(session, {'foo': 'bar'})
+
+    @istest
+    def pops_a_field_atomically(self):
+        driver = RedisHashDriver(dict(db=0))
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+
+        self.assertEqual(driver.pop('session-id', 'foo'), 'bar')
+        self.assertEqual(driver.pop('session-id', 'foo', 'default'), 'default')
+        self.assertEqual(driver.get('session-id'), {'baz': 'qux'})
+
+    @istest
+    def pops_all_fields_atomically(self):
+        driver = RedisHashDriver(dict(db=0))
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+
+        self.assertEqual(driver.pop_all('session-id'), {'foo': 'bar', 'baz': 'qux'})
+        self.assertFalse(self.client.exists('session-id'))
+
+    @istest
+    def saves_only_changed_fields(self):
+        driver = RedisHashDriver(dict(db=0))
+        self.client.hset('session-id', 'untouched', pickle.dumps('old'))
+
+        driver.save('session-id', {'foo': 'bar'}, {'foo': 'bar'}, set())
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar', 'untouched': 'old'})
+
+
+class ShardedRedisDriverTest(RedisTestCase):
+    NODES = [{'db': 2}, {'db': 3}, {'db': 4}]
+
+    def node_keys(self):
+        return [sorted(redis.Redis(**node).keys()) for node in self.NODES]
+
+    @istest
+    def spreads_sessions_among_nodes(self):
+        driver = RedisDriver(dict(db=0, nodes=self.NODES))
+
+        for index in range(30):
+            driver.set('session-%d' % index, {'index': index})
+
+        ring = HashRing(['localhost:6379/2', 'localhost:6379/3', 'localhost:6379/4'])
+        for node, keys in zip(self.NODES, self.node_keys()):
+            self.assertTrue(keys)
+            for key in keys:
+                self.assertEqual(ring.get_node(key), 'localhost:6379/%d' % node['db'])
+        self.assertEqual(driver.get('session-7'), {'index': 7})
+
+    @istest
+    def uses_one_connection_pool_per_node(self):
+        driver = RedisDriver(dict(db=0, nodes=self.NODES, max_connections=5))
+        driver.get('session-id')
+
+        pools = set(id(client.connection_pool) for client in driver.clients.values())
+
+        self.assertEqual(len(pools), 3)
+        self.assertEqual(len(driver.clients), 3)
+
+    @istest
+    def accepts_nodes_as_addresses(self):
+        driver = RedisDriver(dict(db=0, nodes=['localhost:6379']))
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(list(driver.clients), ['localhost:6379'])
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+
+    @istest
+    def changes_sessions_in_their_nodes(self):
+        driver = RedisDriver(dict(db=0, nodes=self.NODES))
+        driver.set('session-id', {'foo': 'bar'})
+
+        driver.update('session-id', {'baz': 'qux'})
+        driver.push('session-id', ['notification'])
+
+        self.assertEqual(driver.pop('session-id', 'foo'), 'bar')
+        self.assertEqual(driver.pop_all('session-id'), {'baz': 'qux'})
+        self.assertEqual(driver.consume('session-id'), ['notification'])
+
+    @istest
+    def keeps_the_queue_in_the_node_of_the_session(self):
+        driver = RedisDriver(dict(db=0, nodes=self.NODES))
+
+        driver.set('session-id', {'foo': 'bar'})
+        driver.push('session-id', ['notification'])
+
+        self.assertIn(sorted([b'session-id', b'session-id:queue']), self.node_keys())
+
+    @istest
+    def changes_hash_sessions_in_their_nodes(self):
+        driver = RedisHashDriver(dict(db=0, nodes=self.NODES))
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+
+        driver.update('session-id', {'new': 'value'}, ['baz'])
+
+        self.assertEqual(driver.get_value('session-id', 'new'), 'value')
+        self.assertEqual(sorted(driver.keys('session-id')), ['foo', 'new'])
+        self.assertTrue(driver.contains('session-id', 'foo'))
+        self.assertEqual(driver.pop('session-id', 'foo'), 'bar')
+        self.assertEqual(driver.pop_all('session-id'), {'new': 'value'})
+
+
+class ReplicaRedisDriverTest(RedisTestCase):
+    def setUp(self):
+        super(ReplicaRedisDriverTest, self).setUp()
+        self.replica = redis.Redis(db=5)
+
+    @istest
+    def reads_sessions_from_replicas(self):
+        driver = RedisDriver(dict(db=0, replicas=[{'db': 5}]))
+        self.client.set('session-id', pickle.dumps({'foo': 'primary'}))
+        self.replica.set('session-id', pickle.dumps({'foo': 'replica'}))
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'replica'})
+
+    @istest
+    def writes_sessions_to_the_primary(self):
+        driver = RedisDriver(dict(db=0, replicas=[{'db': 5}]))
+
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(pickle.loads(self.client.get('session-id')), {'foo': 'bar'})
+        self.assertIsNone(self.replica.get('session-id'))
+
+    @istest
+    def reads_recently_written_sessions_from_the_primary(self):
+        driver = RedisDriver(dict(db=0, replicas=[{'db': 5}]))
+        self.replica.set('session-id', pickle.dumps({'foo': 'stale'}))
+
+        driver.update('session-id', {'foo': 'fresh'})
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'fresh'})
+        self.assertEqual(driver.get('other-session-id'), {})
+
+    @istest
+    def reads_written_sessions_from_replicas_after_the_lag(self):
+        driver = RedisDriver(dict(db=0, replicas=[{'db': 5}], replica_lag=0))
+        self.replica.set('session-id', pickle.dumps({'foo': 'replicated'}))
+
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'replicated'})
+
+    @istest
+    def reads_hash_fields_from_replicas(self):
+        driver = RedisHashDriver(dict(db=0, replicas=['localhost:6379']))
+        driver.get('client-is-lazy-loaded')
+        replica = driver.replicas[None][0]
+
+        self.assertIsNot(replica, driver.client)
+        self.assertIs(driver._reader_for('session-id'), replica)
+        driver.set('session-id', {'foo': 'bar'})
+        self.assertIs(driver._reader_for('session-id'), driver.client)
+
+    @istest
+    def uses_the_replicas_of_each_node(self):
+        driver = RedisDriver(dict(db=0, nodes=[{'db': 2, 'replicas': [{'db': 6}]}, {'db': 3}]))
+        driver.get('client-is-lazy-loaded')
+
+        self.assertEqual(len(driver.replicas['localhost:6379/2']), 1)
+        self.assertEqual(driver.replicas['localhost:6379/3'], [])
+
+    @istest
+    def discovers_primary_and_replicas_with_sentinel(self):
+        import redis.sentinel
+        test_case = self
+
+        class StubSentinel(object):
+            def __init__(self, sentinels, **settings):
+                test_case.assertEqual(sentinels, [('sentinel', 26379)])
+                test_case.assertEqual(settings, {'socket_timeout': 1})
+
+            def master_for(self, service, **settings):
+                test_case.assertEqual((service, settings), ('sessions', {'db': 0}))
+                return 'primary'
+
+            def slave_for(self, service, **settings):
+                return 'replica'
+
+        original = redis.sentinel.Sentinel
+        redis.sentinel.Sentinel = StubSentinel
+        try:
+            driver = RedisDriver(dict(db=0, sentinel={
+                'sentinels': [('sentinel', 26379)], 'service': 'sessions', 'socket_timeout': 1}))
+            driver._create_client()
+        finally:
+            redis.sentinel.Sentinel = original
+
+        self.assertEqual(driver.client, 'primary')
+        self.assertEqual(driver.replicas[None], ['replica'])
+
+
+class PrefixedRedisDriverTest(RedisTestCase):
+    def create(self, engine='redis', storage_category='db_sessions', options=None, **settings):
+        return DriverFactory().create(engine, dict(settings, key_prefix='app:'), storage_category, options)
+
+    def fail_to_load(self, *drivers):
+        def load(session_id):
+            raise AssertionError('The session should be loaded in the pipeline')
+        for driver in drivers:
+            driver._load = load
+
+    @istest
+    def keeps_sessions_and_notifications_in_the_same_database(self):
+        sessions = self.create()
+        notifications = self.create(storage_category='db_notifications')
+
+        sessions.set('session-id', {'foo': 'bar'})
+        notifications.set('session-id', {'message': 'hi'})
+        notifications.push('session-id', ['queued'])
+
+        self.assertEqual(sorted(self.client.keys()), [
+            b'app:notifications:session-id', b'app:notifications:session-id:queue', b'app:sessions:session-id'])
+        self.assertEqual(sessions.get('session-id'), {'foo': 'bar'})
+        self.assertEqual(notifications.pop('session-id', 'message'), 'hi')
+        self.assertEqual(notifications.consume('session-id'), ['queued'])
+
+    @istest
+    def prefixes_hash_keys(self):
+        driver = self.create('redis_hash')
+
+        driver.set('session-id', {'foo': 'bar'})
+        driver.update('session-id', {'baz': 'qux'})
+
+        self.assertEqual(self.client.keys(), [b'app:sessions:session-id'])
+        self.assertEqual(driver.get_value('session-id', 'baz'), 'qux')
+        self.assertEqual(driver.pop_all('session-id'), {'foo': 'bar', 'baz': 'qux'})
+
+    @istest
+    def shares_the_client_between_categories(self):
+        sessions = self.create(max_connections=5)
+        notifications = self.create(storage_category='db_notifications', max_connections=5)
+        sessions.get('client-is-lazy-loaded')
+        notifications.get('client-is-lazy-loaded')
+
+        self.assertIs(sessions.client, notifications.client)
+
+    @istest
+    def gets_sessions_together_in_a_single_pipeline(self):
+        sessions = self.create()
+        notifications = self.create(storage_category='db_notifications')
+        sessions.set('session-id', {'foo': 'bar'})
+        notifications.set('session-id', {'message': 'hi'})
+        self.fail_to_load(sessions, notifications)
+
+        result = sessions.get_together('session-id', [notifications])
+
+        self.assertEqual(result, [{'foo': 'bar'}, {'message': 'hi'}])
+
+    @istest
+    def gets_hash_sessions_together(self):
+        sessions = self.create('redis_hash')
+        notifications = self.create('redis_hash', storage_category='db_notifications')
+        sessions.set('session-id', {'foo': 'bar'})
+        self.fail_to_load(sessions, notifications)
+
+        result = sessions.get_together('session-id', [notifications])
+
+        self.assertEqual(result, [{'foo': 'bar'}, {}])
+
+    @istest
+    def doesnt_fetch_cached_sessions(self):
+        sessions = self.create(options={'cache': True})
+        notifications = self.create(storage_category='db_notifications')
+        sessions.set('session-id', {'foo': 'bar'})
+        self.client.delete('app:sessions:session-id')
+
+        result = sessions.get_together('session-id', [notifications])
+
+        self.assertEqual(result, [{'foo': 'bar'}, {}])
+
+    @istest
+    def gets_sessions_one_by_one_from_different_databases(self):
+        factory = DriverFactory()
+        sessions = factory.create('redis', {}, 'db_sessions')
+        notifications = factory.create('redis', {}, 'db_notifications')
+        sessions.set('session-id', {'foo': 'bar'})
+
+        result = sessions.get_together('session-id', [notifications])
+
+        self.assertEqual(result, [{'foo': 'bar'}, {}])
+
+
+class IndexedDriverTestMixin(object):
+    def create(self, **options):
+        driver = self.create_driver()
+        driver.configure(dict(options, index='user'), 'db_sessions')
+        return driver
+
+    @istest
+    def lists_the_sessions_of_a_value(self):
+        driver = self.create()
+
+        driver.set('session-1', {'user': 'john', 'foo': 'bar'})
+        driver.update('session-2', {'user': 'john'})
+        driver.set('session-3', {'user': 'jane'})
+        driver.set('session-4', {'foo': 'bar'})
+
+        self.assertEqual(sorted(driver.sessions_of('john')), ['session-1', 'session-2'])
+        self.assertEqual(driver.sessions_of('jane'), ['session-3'])
+        self.assertEqual(driver.sessions_of('nobody'), [])
+
+    @istest
+    def moves_sessions_between_indexes_when_the_value_changes(self):
+        driver = self.create()
+        driver.set('session-id', {'user': 'john'})
+
+        driver.update('session-id', {'user': 'jane'})
+
+        self.assertEqual(driver.sessions_of('john'), [])
+        self.assertEqual(driver.sessions_of('jane'), ['session-id'])
+
+    @istest
+    def removes_sessions_from_the_index_when_the_value_is_removed(self):
+        driver = self.create()
+        for session_id in ('session-1', 'session-2', 'session-3'):
+            driver.set(session_id, {'user': 'john', 'foo': 'bar'})
+
+        driver.update('session-1', {}, deleted_names=('user',))
+        self.assertEqual(driver.pop('session-2', 'user'), 'john')
+        self.assertEqual(driver.pop_all('session-3'), {'user': 'john', 'foo': 'bar'})
+
+        self.assertEqual(driver.sessions_of('john'), [])
+        self.assertEqual(driver.get('session-1'), {'foo': 'bar'})
+
+    @istest
+    def keeps_the_index_when_other_values_change(self):
+        driver = self.create()
+        driver.set('session-id', {'user': 'john'})
+
+        driver.update('session-id', {'foo': 'bar'})
+        driver.save('session-id', {}, {'baz': 'qux'}, ())
+
+        self.assertEqual(driver.sessions_of('john'), ['session-id'])
+
+    @istest
+    def indexes_changes_of_many_sessions(self):
+        driver = self.create()
+        driver.set('session-1', {'user': 'john'})
+        driver.set('session-2', {'foo': 'bar'})
+
+        driver.update_many({'session-1': ({'user': 'jane'}, ()), 'session-2': ({'user': 'jane'}, ())})
+
+        self.assertEqual(sorted(driver.sessions_of('jane')), ['session-1', 'session-2'])
+        self.assertEqual(driver.sessions_of('john'), [])
+
+    @istest
+    def drops_deleted_sessions_from_the_index(self):
+        driver = self.create()
+        driver.set('session-1', {'user': 'john'})
+        driver.set('session-2', {'user': 'john'})
+
+        driver.delete_many(['session-1'])
+
+        self.assertEqual(driver.sessions_of('john'), ['session-2'])
+
+    @istest
+    def deletes_the_sessions_of_a_value(self):
+        driver = self.create()
+        driver.set('session-1', {'user': 'john'})
+        driver.set('session-2', {'user': 'john'})
+        driver.set('session-3', {'user': 'jane'})
+
+        deleted = driver.delete_sessions_of('john')
+
+        self.assertEqual(sorted(deleted), ['session-1', 'session-2'])
+        self.assertEqual(driver.get('session-1'), {})
+        self.assertEqual(driver.get('session-3'), {'user': 'jane'})
+        self.assertEqual(driver.sessions_of('john'), [])
+        self.assertEqual(driver.delete_sessions_of('john'), [])
+
+    @istest
+    def indexes_values_by_their_text(self):
+        driver = self.create()
+
+        driver.set('session-id', {'user': 1234})
+
+        self.assertEqual(driver.sessions_of('1234'), ['session-id'])
+
+    @istest
+    def doesnt_list_indexes_as_sessions(self):
+        driver = self.create()
+
+        driver.set('session-id', {'user': 'john'})
+
+        self.assertEqual([session_id for session_ids in driver.scan() for session_id in session_ids],
+                         ['session-id'])
+
+    @istest
+    def invalidates_cached_sessions_of_a_value(self):
+        driver = self.create(cache=True)
+        driver.set('session-id', {'user': 'john'})
+
+        driver.delete_sessions_of('john')
+
+        self.assertEqual(driver.get('session-id'), {})
+
+    @istest
+    @raises(ValueError)
+    def needs_the_index_option(self):
+        self.create_driver().sessions_of('john')
+
+
+class ExpiringIndexTestMixin(object):
+    @istest
+    def expires_the_index_after_its_sessions(self):
+        driver = self.create()
+
+        driver.set('session-id', {'user': 'john'})
+
+        self.assertGreater(self.client.ttl('user:john:index'), driver.EXPIRE_SECONDS)
+        self.assertLessEqual(self.client.ttl('user:john:index'), driver.EXPIRE_SECONDS + driver.DEFAULT_TOUCH_INTERVAL)
+
+    @istest
+    def extends_the_expiration_of_the_index_when_writing_sessions(self):
+        driver = self.create()
+        driver.set('session-id', {'user': 'john'})
+        self.client.expire('user:john:index', 10)
+        driver.index_refreshes.forget('session-id')
+
+        driver.update('session-id', {'foo': 'bar'})
+
+        self.assertGreater(self.client.ttl('user:john:index'), driver.EXPIRE_SECONDS)
+
+    @istest
+    def extends_the_expiration_of_the_index_when_touching_sessions(self):
+        driver = self.create(sliding_expiration=10)
+        driver.set('session-id', {'user': 'john'})
+        self.client.expire('user:john:index', 10)
+        driver.touches.forget('session-id')
+        driver.index_refreshes.forget('session-id')
+
+        driver.touch('session-id')
+
+        self.assertGreater(self.client.ttl('user:john:index'), driver.EXPIRE_SECONDS)
+        self.assertLessEqual(self.client.ttl('user:john:index'), driver.EXPIRE_SECONDS + 10)
+
+    @istest
+    def refreshes_the_index_once_per_interval(self):
+        driver = self.create(sliding_expiration=10)
+        driver.set('session-id', {'user': 'john'})
+        self.client.expire('user:john:index', 10)
+        driver.touches.forget('session-id')
+
+        driver.touch('session-id')
+
+        self.assertEqual(self.client.ttl('user:john:index'), 10)
+
+
+class IndexedRedisDriverTest(IndexedDriverTestMixin, ExpiringIndexTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisDriver(dict(db=0))
+
+    @istest
+    def updates_the_index_in_the_session_transaction(self):
+        driver = self.create()
+
+        driver.set('session-id', {'user': 'john'})
+
+        self.assertEqual(self.client.smembers('user:john:index'), set([b'session-id']))
+
+    @istest
+    def drops_expired_sessions_when_adding_to_the_index(self):
+        driver = self.create()
+        driver.set('session-1', {'user': 'john'})
+        self.client.delete('session-1')
+
+        driver.set('session-2', {'user': 'john'})
+
+        self.assertEqual(self.client.smembers('user:john:index'), set([b'session-2']))
+
+    @istest
+    def doesnt_index_notifications(self):
+        driver = RedisDriver(dict(db=0), 'db_notifications')
+        driver.configure({'index': 'user'}, 'db_notifications')
+
+        driver.set('session-id', {'user': 'john'})
+
+        self.assertEqual(self.client.keys(), [b'session-id'])
+
+
+class PrefixedIndexedRedisDriverTest(IndexedDriverTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisDriver(dict(db=0, key_prefix='app:'))
+
+    @istest
+    def prefixes_the_index_keys(self):
+        driver = self.create()
+
+        driver.set('session-id', {'user': 'john'})
+
+        self.assertEqual(sorted(self.client.keys()), [b'app:sessions:session-id', b'app:sessions:user:john:index'])
+
+
+class IndexedRedisHashDriverTest(IndexedDriverTestMixin, ExpiringIndexTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisHashDriver(dict(db=0))
+
+
+class ShardedIndexedRedisDriverTest(IndexedDriverTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisDriver(dict(db=0, nodes=[{'db': 2}, {'db': 3}]))
+
+
+class IndexedMemoryDriverTest(IndexedDriverTestMixin, TestCase):
+    def create_driver(self):
+        return MemoryDriver({})
+
+
+class UnindexableDriverTest(SQLiteTestCase):
+    @istest
+    @raises(NotImplementedError)
+    def cannot_index_sessions_without_support_from_the_engine(self):
+        DriverFactory().create('sqlite', {'path': self.path}, 'db_sessions', {'index': 'user'})
+
+
+class MemcachedTestCase(TestCase):
+    client = None
+
+    def setUp(self):
+        if self.client is None:
+            import memcache
+            self.client = memcache.Client(servers=('localhost:11211',))
+        self.client.flush_all()
+
+
+class MemcachedDriverTest(MemcachedTestCase):
+    @istest
+    def inserts_pickable_object_into_session(self):
+        driver = MemcachedDriver({
+            'servers': ('localhost:11211',)
+        })
+
+        foo = dict(foo='bar')
+
+        driver.set('session-id', foo)
+
+        result = self.client.get('session-id')
+
+        self.assertEqual(pickle.loads(result), foo)
+
+    @istest
+    def retrieves_a_pickled_object_from_session(self):
+        driver = MemcachedDriver({
+            'servers': ('localhost:11211',)
+        })
+
+        foo = dict(foo='bar')
+
+        self.client.set('session-id', pickle.dumps(foo))
+
+        result = driver.get('session-id')
+
+        self.assertEqual(result, foo)
+
+    @istest
+    def makes_session_expire_in_one_day_in_the_client(self):
+        driver = MemcachedDriver({
+            'servers': ('localhost:11211',)
+        })
+
+        foo = dict(foo='bar')
+
+        test_case = self
+
+        class StubClient(object):
+            def set(self, session_id, pickled_session, expiration):
+                test_case.assertEqual(expiration, MemcachedDriver.EXPIRE_SECONDS)
+
+        driver.client = StubClient()
+
+        driver.set('session-id', foo)
+
+    @istest
+    def touches_session_with_sliding_expiration(self):
+        driver = MemcachedDriver({
+            'servers': ('localhost:11211',)
+        })
+        driver.configure({'sliding_expiration': True})
+
+        test_case = self
+
+        class StubClient(object):
+            def touch(self, session_id, expiration):
+                test_case.assertEqual(session_id, 'session-id')
+                test_case.assertEqual(expiration, MemcachedDriver.EXPIRE_SECONDS)
+                self.touched = True
+
+        driver.client = StubClient()
 
-        self.assertEqual(driver.EXPIRE_SECONDS, one_day)
+        driver.touch('session-id')
 
-    @istest
-    def starts_with_max_connections(self):
-        driver = RedisDriver(dict(db=0, max_connections=123))
-        driver.get('some session')
+        self.assertTrue(driver.client.touched)
 
-        self.assertEqual(driver.client.connection_pool.max_connections, 123)
+    @istest
+    def updates_session_with_check_and_set(self):
+        driver = MemcachedDriver({
+            'servers': ('localhost:11211',)
+        })
 
+        class StubClient(object):
+            cas_ids = {}
+            stored = pickle.dumps({'foo': 'bar'})
+            conflicts = 1
+
+            def gets(self, session_id):
+                self.cas_ids[session_id] = 1
+                return self.stored
+
+            def cas(self, session_id, serialized_session, expiration):
+                if self.conflicts:
+                    self.conflicts -= 1
+                    self.stored = pickle.dumps({'foo': 'bar', 'other': 'change'})
+                    return False
+                self.stored = serialized_session
+                return True
 
-class MemcachedTestCase(TestCase):
-    client = None
+        driver.client = StubClient()
 
-    def setUp(self):
-        if self.client is None:
-            import memcache
-            self.client = memcache.Client(servers=('localhost:11211',))
-        self.client.flush_all()
+        driver.update('session-id', {'baz': 'qux'})
 
+        self.assertEqual(pickle.loads(driver.client.stored), {'foo': 'bar', 'other': 'change', 'baz': 'qux'})
+        self.assertEqual(driver.client.cas_ids, {})
 
-class MemcachedDriverTest(MemcachedTestCase):
     @istest
-    def inserts_pickable_object_into_session(self):
+    def pops_value_with_check_and_set(self):
         driver = MemcachedDriver({
             'servers': ('localhost:11211',)
         })
 
-        foo = dict(foo='bar')
+        class StubClient(object):
+            cas_ids = {}
+            stored = pickle.dumps({'foo': 'bar', 'baz': 'qux'})
 
-        driver.set('session-id', foo)
+            def gets(self, session_id):
+                return self.stored
 
-        result = self.client.get('session-id')
+            def cas(self, session_id, serialized_session, expiration):
+                self.stored = serialized_session
+                return True
 
-        self.assertEqual(pickle.loads(result), foo)
+        driver.client = StubClient()
+
+        self.assertEqual(driver.pop('session-id', 'foo'), 'bar')
+        self.assertEqual(pickle.loads(driver.client.stored), {'baz': 'qux'})
 
     @istest
-    def retrieves_a_pickled_object_from_session(self):
+    def adds_session_if_it_doesnt_exist(self):
         driver = MemcachedDriver({
             'servers': ('localhost:11211',)
         })
 
-        foo = dict(foo='bar')
+        class StubClient(object):
+            cas_ids = {}
 
-        self.client.set('session-id', pickle.dumps(foo))
+            def gets(self, session_id):
+                return None
 
-        result = driver.get('session-id')
+            def add(self, session_id, serialized_session, expiration):
+                self.added = pickle.loads(serialized_session)
+                return True
 
-        self.assertEqual(result, foo)
+        driver.client = StubClient()
+
+        driver.update('session-id', {'foo': 'bar'})
+
+        self.assertEqual(driver.client.added, {'foo': 'bar'})
 
     @istest
-    def makes_session_expire_in_one_day_in_the_client(self):
+    @raises(UpdateConflictError)
+    def gives_up_updating_a_session_that_keeps_changing(self):
         driver = MemcachedDriver({
             'servers': ('localhost:11211',)
         })
 
-        foo = dict(foo='bar')
+        class StubClient(object):
+            cas_ids = {}
 
-        test_case = self
+            def gets(self, session_id):
+                return pickle.dumps({'foo': 'bar'})
 
-        class StubClient(object):
-            def set(self, session_id, pickled_session, expiration):
-                test_case.assertEqual(expiration, MemcachedDriver.EXPIRE_SECONDS)
+            def cas(self, session_id, serialized_session, expiration):
+                return False
 
         driver.client = StubClient()
 
-        driver.set('session-id', foo)
+        driver.update('session-id', {'baz': 'qux'})
 
     @istest
     @raises(OverflowError)
@@ -152,6 +1230,399 @@ class MemcachedDriverTest(MemcachedTestCase):
 
         self.assertEqual(driver.EXPIRE_SECONDS, one_day)
 
+    @istest
+    @raises(NotImplementedError)
+    def doesnt_support_queues(self):
+        driver = MemcachedDriver({
+            'servers': ('localhost:11211',)
+        })
+
+        driver.push('session-id', ['foo'])
+
+
+class MultiServerMemcachedDriverTest(TestCase):
+    def setUp(self):
+        self.servers = [MemcachedServer().start() for _ in range(2)]
+        self.settings = {'servers': tuple(server.address for server in self.servers)}
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def stored_keys(self):
+        return [sorted(server.items) for server in self.servers]
+
+    @istest
+    def spreads_sessions_among_servers_with_the_hash_ring(self):
+        driver = MemcachedDriver(self.settings)
+
+        for index in range(20):
+            driver.set('session-%d' % index, {'index': index})
+
+        ring = HashRing(self.settings['servers'])
+        for server, keys in zip(self.servers, self.stored_keys()):
+            self.assertTrue(keys)
+            for key in keys:
+                self.assertEqual(ring.get_node(key), server.address)
+        self.assertEqual(driver.get('session-3'), {'index': 3})
+
+    @istest
+    def gets_many_sessions_with_one_request_per_server(self):
+        driver = MemcachedDriver(self.settings)
+        driver.set_many(dict(('session-%d' % index, {'index': index}) for index in range(20)))
+        requests = [server.requests for server in self.servers]
+
+        sessions = driver.get_many(['session-%d' % index for index in range(20)] + ['missing'])
+
+        self.assertEqual(sessions['session-7'], {'index': 7})
+        self.assertEqual(sessions['missing'], {})
+        self.assertEqual(len(sessions), 21)
+        self.assertEqual([server.requests for server in self.servers], [count + 1 for count in requests])
+
+    @istest
+    def updates_sessions_with_check_and_set(self):
+        driver = MemcachedDriver(self.settings)
+        driver.set('session-id', {'foo': 'bar'})
+
+        driver.update('session-id', {'baz': 'qux'}, ['foo'])
+
+        self.assertEqual(driver.get('session-id'), {'baz': 'qux'})
+        self.assertEqual(driver.client.cas_ids, {})
+
+    @istest
+    def doesnt_write_sessions_that_dont_change(self):
+        driver = MemcachedDriver(self.settings)
+        driver.set('session-id', {'foo': 'bar'})
+        requests = sum(server.requests for server in self.servers)
+
+        self.assertEqual(driver.pop('session-id', 'missing', 'default'), 'default')
+
+        self.assertEqual(sum(server.requests for server in self.servers), requests + 1)
+        self.assertEqual(driver.client.cas_ids, {})
+
+    @istest
+    def gets_many_cached_sessions_without_requests(self):
+        driver = MemcachedDriver(self.settings)
+        driver.configure({'cache': True})
+        driver.set('session-id', {'foo': 'bar'})
+        requests = sum(server.requests for server in self.servers)
+
+        sessions = driver.get_many(['session-id', 'missing'])
+
+        self.assertEqual(sessions, {'session-id': {'foo': 'bar'}, 'missing': {}})
+        self.assertEqual(sum(server.requests for server in self.servers), requests + 1)
+        self.assertEqual(driver.get_many(['missing']), {'missing': {}})
+
+    @istest
+    def stores_the_sessions_of_a_stopped_server_in_the_next_one_of_the_ring(self):
+        driver = MemcachedDriver(self.settings)
+        self.servers[0].stop()
+
+        for index in range(20):
+            driver.set('session-%d' % index, {'index': index})
+
+        self.assertEqual(len(self.servers[1].items), 20)
+        self.assertEqual(driver.get('session-3'), {'index': 3})
+
+    @istest
+    def doesnt_store_sessions_without_servers(self):
+        driver = MemcachedDriver(self.settings)
+        for server in self.servers:
+            server.stop()
+
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(driver.get('session-id'), {})
+
+    @istest
+    def accepts_weighted_servers(self):
+        driver = MemcachedDriver({'servers': tuple((server.address, 1) for server in self.servers)})
+
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+        self.assertEqual(sorted(driver.client.servers_by_name), sorted(self.settings['servers']))
+
+    @istest
+    def places_keys_with_a_hash_by_the_key(self):
+        driver = MemcachedDriver(self.settings)
+        driver.get('session-id')
+
+        server, key = driver.client._get_server((1234, 'session-id'))
+
+        self.assertEqual(key, 'session-id')
+        self.assertIs(server, driver.client.servers_by_name[HashRing(self.settings['servers']).get_node('session-id')])
+
+    @istest
+    def accepts_bytes_session_ids(self):
+        driver = MemcachedDriver(self.settings)
+
+        driver.set(b'session-id', {'foo': 'bar'})
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+
+    @istest
+    def counts_the_connected_servers(self):
+        driver = MemcachedDriver(self.settings)
+
+        driver.get('session-id')
+
+        self.assertEqual(driver.pool_stats(), {'pool_size': 2, 'in_use': 1})
+
+    @istest
+    def keeps_notifications_apart_from_sessions(self):
+        sessions = MemcachedDriver(self.settings, 'db_sessions')
+        notifications = MemcachedDriver(self.settings, 'db_notifications')
+
+        sessions.set('session-id', {'foo': 'session'})
+        notifications.set('session-id', {'foo': 'notification'})
+
+        self.assertEqual(notifications.pop_all('session-id'), {'foo': 'notification'})
+        self.assertEqual(sessions.get('session-id'), {'foo': 'session'})
+
+    @istest
+    def shares_the_client_between_drivers_with_the_same_settings(self):
+        sessions = MemcachedDriver(self.settings, 'db_sessions')
+        notifications = MemcachedDriver(self.settings, 'db_notifications')
+
+        sessions.get('session-id')
+        notifications.get('session-id')
+
+        self.assertIs(sessions.client, notifications.client)
+
+
+class MemoryDriverTest(TestCase):
+    @istest
+    def sets_and_gets_sessions(self):
+        driver = MemoryDriver({})
+
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+        self.assertEqual(driver.get('other-session-id'), {})
+
+    @istest
+    def stores_immutable_values_without_serializing_them(self):
+        driver = MemoryDriver({})
+
+        driver.set('session-id', {'foo': 'bar', 'numbers': (1, 2)})
+
+        self.assertEqual(driver.client.get('session-id'), {'foo': 'bar', 'numbers': (1, 2)})
+
+    @istest
+    def serializes_sessions_with_mutable_values(self):
+        driver = MemoryDriver({})
+        session = {'foo': ['bar']}
+
+        driver.set('session-id', session)
+        session['foo'].append('changed')
+        driver.get('session-id')['foo'].append('changed again')
+
+        self.assertIsInstance(driver.client.get('session-id'), bytes)
+        self.assertEqual(driver.get('session-id'), {'foo': ['bar']})
+
+    @istest
+    def doesnt_share_the_stored_session(self):
+        driver = MemoryDriver({})
+        driver.set('session-id', {'foo': 'bar'})
+
+        driver.get('session-id')['foo'] = 'changed'
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+
+    @istest
+    def expires_sessions(self):
+        driver = MemoryDriver({})
+        driver.configure({'expire_seconds': -1})
+
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(driver.get('session-id'), {})
+
+    @istest
+    def bounds_the_stored_sessions(self):
+        driver = MemoryDriver({'max_entries': 1})
+
+        driver.set('first', {'foo': 'bar'})
+        driver.set('second', {'foo': 'bar'})
+
+        self.assertEqual(driver.get('first'), {})
+        self.assertEqual(driver.get('second'), {'foo': 'bar'})
+
+    @istest
+    def updates_and_pops_values(self):
+        driver = MemoryDriver({})
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+
+        driver.update('session-id', {'new': 'value'}, ['baz'])
+
+        self.assertEqual(driver.pop('session-id', 'foo'), 'bar')
+        self.assertEqual(driver.pop_all('session-id'), {'new': 'value'})
+        self.assertEqual(driver.get('session-id'), {})
+
+    @istest
+    def consumes_pushed_values_in_order(self):
+        driver = MemoryDriver({})
+        driver.configure({'max_notifications': 3})
+
+        driver.push('session-id', ['foo', ['bar']])
+        driver.push('session-id', ['baz', 'qux'])
+
+        self.assertEqual(driver.consume('session-id', 2), [['bar'], 'baz'])
+        self.assertEqual(driver.consume('session-id'), ['qux'])
+        self.assertEqual(driver.consume('session-id'), [])
+
+
+class SharedMemoryDriverTest(SharedMemoryTestCase):
+    def create_driver(self, storage_category='db_sessions'):
+        return SharedMemoryDriver({'directory': self.directory, 'slots': 64}, storage_category)
+
+    @istest
+    def sets_and_gets_sessions(self):
+        driver = self.create_driver()
+
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+        self.assertEqual(pickle.loads(driver.client.get('session-id')), {'foo': 'bar'})
+
+    @istest
+    def updates_and_pops_values(self):
+        driver = self.create_driver()
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+
+        driver.update('session-id', {'new': 'value'}, ['baz'])
+
+        self.assertEqual(driver.pop('session-id', 'foo'), 'bar')
+        self.assertEqual(driver.pop_all('session-id'), {'new': 'value'})
+
+    @istest
+    def keeps_notifications_in_another_file(self):
+        sessions = self.create_driver('db_sessions')
+        notifications = self.create_driver('db_notifications')
+
+        sessions.set('session-id', {'foo': 'session'})
+        notifications.set('session-id', {'foo': 'notification'})
+
+        self.assertEqual(sessions.get('session-id'), {'foo': 'session'})
+        self.assertEqual(sorted(os.listdir(self.directory)), ['pycket-notifications.shm', 'pycket-sessions.shm'])
+
+    @istest
+    def creates_the_store_from_the_factory_settings(self):
+        driver = DriverFactory().create('shared_memory', {'directory': self.directory, 'slots': 64}, 'db_sessions',
+                                        {'sliding_expiration': True})
+        driver.set('session-id', {'foo': 'bar'})
+        driver.client.set('other-session-id', pickle.dumps({'foo': 'bar'}), 0.05)
+
+        driver.touch('other-session-id')
+        time.sleep(0.1)
+
+        self.assertEqual(driver.client.slots, 64)
+        self.assertEqual(driver.get('other-session-id'), {'foo': 'bar'})
+        self.assertEqual(driver.pool_stats(), {'pool_size': 0, 'in_use': 0})
+
+
+class SQLiteDriverTest(SQLiteTestCase):
+    def create_driver(self, storage_category='db_sessions'):
+        driver = SQLiteDriver({'path': self.path}, storage_category)
+        driver.client = self.create_store()
+        return driver
+
+    @istest
+    def sets_and_gets_sessions(self):
+        driver = self.create_driver()
+
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(driver.get('session-id'), {'foo': 'bar'})
+        self.assertEqual(pickle.loads(driver.client.get('sessions', 'session-id')), {'foo': 'bar'})
+
+    @istest
+    def updates_and_pops_values(self):
+        driver = self.create_driver()
+        driver.set('session-id', {'foo': 'bar', 'baz': 'qux'})
+
+        driver.update('session-id', {'new': 'value'}, ['baz'])
+
+        self.assertEqual(driver.pop('session-id', 'foo'), 'bar')
+        self.assertEqual(driver.pop('session-id', 'foo', 'default'), 'default')
+        self.assertEqual(driver.pop_all('session-id'), {'new': 'value'})
+
+    @istest
+    def merges_concurrent_updates(self):
+        driver = self.create_driver()
+        threads = [threading.Thread(target=driver.update, args=('session-id', {'item-%d' % index: index}))
+                   for index in range(10)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(driver.get('session-id')), 10)
+
+    @istest
+    def keeps_notifications_in_another_table(self):
+        sessions = self.create_driver('db_sessions')
+        notifications = SQLiteDriver({'path': self.path}, 'db_notifications')
+        notifications.client = sessions.client
+
+        sessions.set('session-id', {'foo': 'session'})
+        notifications.set('session-id', {'foo': 'notification'})
+
+        self.assertEqual(sessions.get('session-id'), {'foo': 'session'})
+        self.assertEqual(notifications.get('session-id'), {'foo': 'notification'})
+
+    @istest
+    def creates_the_store_from_the_factory_settings(self):
+        driver = DriverFactory().create('sqlite', {'path': self.path}, 'db_sessions', {'sliding_expiration': True})
+        driver.set('session-id', {'foo': 'bar'})
+        self.stores.append(driver.client)
+        driver.client.set('sessions', 'other-session-id', pickle.dumps({'foo': 'bar'}), 10)
+
+        driver.touch('other-session-id')
+
+        self.assertIs(driver.client, shared_store(self.path))
+        self.assertGreater(driver.ttl_many(['other-session-id'])['other-session-id'], 10)
+        self.assertEqual(driver.pool_stats(), {'pool_size': 0, 'in_use': 0})
+
+
+class TouchThrottleTest(TestCase):
+    @istest
+    def forgets_sessions_after_the_interval(self):
+        throttle = TouchThrottle(0)
+
+        self.assertTrue(throttle.should_touch('session-id'))
+        self.assertTrue(throttle.should_touch('session-id'))
+        self.assertEqual(list(throttle.touched.keys()), ['session-id'])
+
+    @istest
+    def doesnt_touch_marked_sessions(self):
+        throttle = TouchThrottle(60)
+
+        throttle.mark('session-id')
+
+        self.assertFalse(throttle.should_touch('session-id'))
+
+
+class RecentWritesTest(TestCase):
+    @istest
+    def remembers_sessions_written_in_the_interval(self):
+        recent_writes = RecentWrites(60)
+
+        recent_writes.mark('session-id')
+
+        self.assertIn('session-id', recent_writes)
+        self.assertNotIn('other-session-id', recent_writes)
+
+    @istest
+    def forgets_sessions_after_the_interval(self):
+        recent_writes = RecentWrites(0)
+
+        recent_writes.mark('session-id')
+
+        self.assertNotIn('session-id', recent_writes)
+
 
 class DriverFactoryTest(TestCase):
     @istest
@@ -166,6 +1637,16 @@ class DriverFactoryTest(TestCase):
 
         self.assertEqual(instance.client.connection_pool._available_connections[0].db, 0)
 
+    @istest
+    def uses_the_session_database_for_all_categories_with_key_prefix(self):
+        factory = DriverFactory()
+
+        instance = factory.create('redis', storage_settings={'key_prefix': 'app:', 'db_sessions': 2},
+                                  storage_category='db_notifications')
+
+        self.assertEqual(instance.settings['db'], 2)
+        self.assertEqual(instance.key_prefix, 'app:notifications:')
+
     @istest
     def creates_instance_for_memcached_session(self):
         factory = DriverFactory()
@@ -178,9 +1659,124 @@ class DriverFactoryTest(TestCase):
 
         self.assertIsNotNone(instance.client.get_stats())
 
+    @istest
+    def creates_instance_for_memory_session(self):
+        factory = DriverFactory()
+
+        instance = factory.create('memory', storage_settings={'max_entries': 10}, storage_category='db_sessions')
+
+        self.assertIsInstance(instance, MemoryDriver)
+
+        instance.get('client-is-lazy-loaded')
+
+        self.assertEqual(instance.client.max_entries, 10)
+
+    @istest
+    def creates_instance_for_redis_hash_session(self):
+        factory = DriverFactory()
+
+        instance = factory.create('redis_hash', storage_settings={'db_sessions': 10}, storage_category='db_sessions')
+
+        self.assertIsInstance(instance, RedisHashDriver)
+        self.assertEqual(instance.settings, {'db': 10})
+
+    @istest
+    def configures_driver_with_pycket_settings(self):
+        factory = DriverFactory()
+
+        instance = factory.create('redis', {}, 'db_sessions', {'engine': 'redis', 'serializer': 'json'})
+
+        self.assertIsInstance(instance.serializer, JSONSerializer)
+
     @istest
     @raises(ValueError)
     def cannot_create_a_driver_for_not_supported_engine(self):
         factory = DriverFactory()
 
         factory.create('cassete-tape', storage_settings={}, storage_category='db_sessions')
+
+
+class DriverRegistryTest(RedisTestCase):
+    @istest
+    def reuses_driver_for_same_settings(self):
+        registry = DriverRegistry()
+
+        driver = registry.get('redis', {'max_connections': 10}, 'db_sessions')
+        same_driver = registry.get('redis', {'max_connections': 10}, 'db_sessions')
+
+        self.assertIs(driver, same_driver)
+
+    @istest
+    def creates_different_drivers_for_different_categories(self):
+        registry = DriverRegistry()
+
+        session_driver = registry.get('redis', {}, 'db_sessions')
+        notification_driver = registry.get('redis', {}, 'db_notifications')
+
+        self.assertIsNot(session_driver, notification_driver)
+
+    @istest
+    def creates_different_drivers_for_different_settings(self):
+        registry = DriverRegistry()
+
+        driver = registry.get('redis', {'db_sessions': 10}, 'db_sessions')
+        other_driver = registry.get('redis', {'db_sessions': 11}, 'db_sessions')
+
+        self.assertIsNot(driver, other_driver)
+
+    @istest
+    def reports_pool_size_and_connections_in_use(self):
+        registry = DriverRegistry()
+        driver = registry.get('redis', {'max_connections': 10}, 'db_sessions')
+
+        self.assertEqual(registry.stats(), [{
+            'engine': 'redis',
+            'category': 'db_sessions',
+            'pool_size': 0,
+            'in_use': 0,
+        }])
+
+        driver.set('session-id', {'foo': 'bar'})
+
+        self.assertEqual(registry.stats()[0]['pool_size'], 1)
+        self.assertEqual(registry.stats()[0]['in_use'], 0)
+
+    @istest
+    def creates_different_drivers_for_different_driver_options(self):
+        registry = DriverRegistry()
+
+        driver = registry.get('redis', {}, 'db_sessions', {'serializer': 'json'})
+        other_driver = registry.get('redis', {}, 'db_sessions', {'serializer': 'pickle'})
+        same_driver = registry.get('redis', {}, 'db_sessions', {'serializer': 'json', 'cookies': {}})
+
+        self.assertIsNot(driver, other_driver)
+        self.assertIs(driver, same_driver)
+
+    @istest
+    def creates_new_drivers_after_clearing(self):
+        registry = DriverRegistry()
+        driver = registry.get('redis', {}, 'db_sessions')
+
+        registry.clear()
+
+        self.assertIsNot(registry.get('redis', {}, 'db_sessions'), driver)
+
+
+class StopListening(Exception):
+    pass
+
+
+class FakePubSub(object):
+    '''
+    Stands in for a redis-py PubSub, listening to "events": the messages are
+    returned, and the exceptions raised.
+    '''
+
+    def __init__(self, events):
+        self.events = events
+
+    def listen(self):
+        for event in self.events:
+            if isinstance(event, Exception):
+                raise event
+            yield event
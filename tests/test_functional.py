@@ -5,25 +5,31 @@ import redis
 from tornado.testing import AsyncHTTPTestCase
 from tornado.web import Application, RequestHandler
 
-from pycket.driver import RedisDriver
+from pycket.driver import RedisDriver, registry
 from pycket.notification import NotificationMixin
 from pycket.session import SessionMixin
 
 
-class FunctionalTest(AsyncHTTPTestCase):
+class FunctionalTestCase(AsyncHTTPTestCase):
     session_dataset = None
     notification_dataset = None
 
     def setUp(self):
-        super(FunctionalTest, self).setUp()
+        super(FunctionalTestCase, self).setUp()
         self.session_dataset.flushall()
         self.notification_dataset.flushall()
+        registry.clear()
 
-    def get_app(self):
+    def connect_datasets(self):
         if self.session_dataset is None or self.notification_dataset is None:
             self.session_dataset = redis.Redis(db=RedisDriver.DEFAULT_STORAGE_IDENTIFIERS['db_sessions'])
             self.notification_dataset = redis.Redis(db=RedisDriver.DEFAULT_STORAGE_IDENTIFIERS['db_notifications'])
 
+
+class FunctionalTest(FunctionalTestCase):
+    def get_app(self):
+        self.connect_datasets()
+
         class SimpleHandler(RequestHandler, SessionMixin, NotificationMixin):
             def get(self):
                 self.session.set('foo', 'bar')
@@ -58,3 +64,45 @@ class FunctionalTest(AsyncHTTPTestCase):
         notification_data = pickle.loads(self.notification_dataset['some-generated-cookie'])
         self.assertEqual(session_data, {'foo': 'bar'})
         self.assertEqual(notification_data, {})
+
+
+class WriteBackFunctionalTest(FunctionalTestCase):
+    def get_app(self):
+        self.connect_datasets()
+
+        class WriteBackHandler(RequestHandler, SessionMixin, NotificationMixin):
+            def get(self):
+                self.session.set('foo', 'bar')
+                self.notifications.set('foo', 'bar2')
+                self.write('done')
+
+            def post(self):
+                self.session.set('foo', lambda: 'not picklable')
+
+            def get_secure_cookie(self, *args, **kwargs):
+                return 'some-generated-cookie'
+
+        return Application([
+            (r'/', WriteBackHandler),
+        ], **{
+            'cookie_secret': 'Python rocks!',
+            'pycket': {
+                'engine': 'redis',
+                'write_back': True,
+            }
+        })
+
+    @istest
+    def writes_the_sessions_before_responding(self):
+        response = self.fetch('/')
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(pickle.loads(self.session_dataset['some-generated-cookie']), {'foo': 'bar'})
+        self.assertEqual(pickle.loads(self.notification_dataset['some-generated-cookie']), {'foo': 'bar2'})
+
+    @istest
+    def fails_the_request_if_writing_the_session_fails(self):
+        response = self.fetch('/', method='POST', body='')
+
+        self.assertEqual(response.code, 500)
+        self.assertEqual(self.session_dataset.keys(), [])
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from nose.tools import istest
+
+from pycket.hashring import HashRing
+
+
+class HashRingTest(TestCase):
+    @istest
+    def always_gets_the_same_node_for_a_key(self):
+        ring = HashRing(['a:11211', 'b:11211', 'c:11211'])
+
+        self.assertEqual(ring.get_node('session-id'), HashRing(['a:11211', 'b:11211', 'c:11211']).get_node('session-id'))
+        self.assertEqual(ring.get_node('session-id'), ring.get_node(b'session-id'))
+
+    @istest
+    def spreads_keys_among_nodes(self):
+        ring = HashRing(['a:11211', 'b:11211', 'c:11211'])
+
+        counts = {}
+        for index in range(3000):
+            node = ring.get_node('session-%d' % index)
+            counts[node] = counts.get(node, 0) + 1
+
+        self.assertEqual(sorted(counts), ['a:11211', 'b:11211', 'c:11211'])
+        for count in counts.values():
+            self.assertGreater(count, 600)
+
+    @istest
+    def moves_only_the_keys_of_a_removed_node(self):
+        ring = HashRing(['a:11211', 'b:11211', 'c:11211'])
+        smaller_ring = HashRing(['a:11211', 'b:11211'])
+
+        for index in range(1000):
+            key = 'session-%d' % index
+            node = ring.get_node(key)
+            if node != 'c:11211':
+                self.assertEqual(smaller_ring.get_node(key), node)
+
+    @istest
+    def iterates_each_node_once_starting_with_the_key_node(self):
+        ring = HashRing(['a:11211', 'b:11211', 'c:11211'])
+
+        nodes = list(ring.iterate_nodes('session-id'))
+
+        self.assertEqual(nodes[0], ring.get_node('session-id'))
+        self.assertEqual(sorted(nodes), ['a:11211', 'b:11211', 'c:11211'])
+
+    @istest
+    def has_no_node_when_empty(self):
+        self.assertIsNone(HashRing([]).get_node('session-id'))
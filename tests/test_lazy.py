@@ -0,0 +1,96 @@
+import pickle
+from unittest import TestCase
+
+from nose.tools import istest, raises
+
+from pycket import lazy
+from pycket.lazy import LazySession
+
+
+class CountingDecoder(object):
+    def __init__(self):
+        self.decoded = []
+
+    def __call__(self, data):
+        value = pickle.loads(data)
+        self.decoded.append(value)
+        return value
+
+
+class LazySessionTest(TestCase):
+    def create_session(self, **values):
+        self.decode = CountingDecoder()
+        raw_values = dict((name, pickle.dumps(value)) for name, value in values.items())
+        return LazySession(raw_values, self.decode)
+
+    @istest
+    def decodes_values_only_when_accessed(self):
+        session = self.create_session(foo='bar', baz='qux')
+
+        self.assertEqual(session['foo'], 'bar')
+        self.assertEqual(session.get('foo'), 'bar')
+        self.assertEqual(self.decode.decoded, ['bar'])
+
+    @istest
+    def lists_names_without_decoding(self):
+        session = self.create_session(foo='bar', baz='qux')
+
+        self.assertEqual(sorted(session), ['baz', 'foo'])
+        self.assertEqual(len(session), 2)
+        self.assertIn('foo', session)
+        self.assertEqual(self.decode.decoded, [])
+
+    @istest
+    def sets_and_deletes_values(self):
+        session = self.create_session(foo='bar', baz='qux')
+
+        session['foo'] = 'changed'
+        del session['baz']
+
+        self.assertEqual(dict(session), {'foo': 'changed'})
+        self.assertEqual(self.decode.decoded, [])
+
+    @istest
+    @raises(KeyError)
+    def raises_key_error_for_missing_values(self):
+        session = self.create_session()
+
+        session['foo']
+
+    @istest
+    def compares_with_dicts(self):
+        session = self.create_session(foo='bar')
+
+        self.assertEqual(session, {'foo': 'bar'})
+
+
+class RecordTest(TestCase):
+    @istest
+    def writes_and_reads_records(self):
+        data = lazy.dumps({'foo': 'bar', 'baz': [1, 2]}, pickle.dumps)
+
+        self.assertTrue(lazy.is_record(data))
+        self.assertEqual(lazy.loads(data, pickle.loads), {'foo': 'bar', 'baz': [1, 2]})
+
+    @istest
+    def keeps_original_bytes_of_untouched_values(self):
+        encoded = []
+
+        def encode(value):
+            encoded.append(value)
+            return pickle.dumps(value)
+        session = lazy.loads(lazy.dumps({'foo': 'bar', 'baz': 'qux'}, pickle.dumps), pickle.loads)
+        session['foo'] = 'changed'
+
+        data = lazy.dumps(session, encode)
+
+        self.assertEqual(encoded, ['changed'])
+        self.assertEqual(lazy.loads(data, pickle.loads), {'foo': 'changed', 'baz': 'qux'})
+
+    @istest
+    def writes_and_reads_empty_records(self):
+        self.assertEqual(lazy.loads(lazy.dumps({}, pickle.dumps), pickle.loads), {})
+
+    @istest
+    def doesnt_confuse_pickles_with_records(self):
+        self.assertFalse(lazy.is_record(pickle.dumps({'foo': 'bar'})))
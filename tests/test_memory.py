@@ -0,0 +1,115 @@
+from unittest import TestCase
+
+from nose.tools import istest
+
+from pycket.memory import is_immutable, MemoryStore
+
+
+class MemoryStoreTest(TestCase):
+    @istest
+    def returns_none_for_missing_keys(self):
+        store = MemoryStore()
+
+        self.assertIsNone(store.get('session-id'))
+
+    @istest
+    def stores_values(self):
+        store = MemoryStore()
+
+        store.set('session-id', {'foo': 'bar'}, 10, 60)
+
+        self.assertEqual(store.get('session-id'), {'foo': 'bar'})
+
+    @istest
+    def expires_each_entry_at_its_own_time(self):
+        store = MemoryStore()
+
+        store.set('expired', 'foo', 10, -1)
+        store.set('alive', 'bar', 10, 60)
+
+        self.assertIsNone(store.get('expired'))
+        self.assertEqual(store.get('alive'), 'bar')
+        self.assertEqual(store.stats(), {'expirations': 1, 'evictions': 0, 'entries': 1, 'bytes': 10})
+
+    @istest
+    def extends_the_expiration_when_touched(self):
+        store = MemoryStore()
+
+        store.set('session-id', 'foo', 10, -1)
+        store.touch('session-id', 60)
+
+        self.assertIsNone(store.get('session-id'))
+
+        store.set('session-id', 'foo', 10, 60)
+        store.touch('session-id', -1)
+
+        self.assertIsNone(store.get('session-id'))
+
+    @istest
+    def ignores_older_deadlines_of_entries_set_again(self):
+        store = MemoryStore()
+
+        store.set('session-id', 'foo', 10, 0)
+        store.set('session-id', 'bar', 10, 60)
+
+        self.assertEqual(store.get('session-id'), 'bar')
+
+    @istest
+    def evicts_least_recently_used_entries_above_max_entries(self):
+        store = MemoryStore(max_entries=2)
+
+        store.set('first', 'foo', 1, 60)
+        store.set('second', 'foo', 1, 60)
+        store.get('first')
+        store.set('third', 'foo', 1, 60)
+
+        self.assertIsNone(store.get('second'))
+        self.assertIsNotNone(store.get('first'))
+        self.assertIsNotNone(store.get('third'))
+
+    @istest
+    def evicts_entries_above_max_bytes(self):
+        store = MemoryStore(max_bytes=100)
+
+        store.set('first', 'foo', 60, 60)
+        store.set('second', 'foo', 60, 60)
+
+        self.assertIsNone(store.get('first'))
+        self.assertEqual(store.stats()['evictions'], 1)
+        self.assertEqual(store.stats()['bytes'], 60)
+
+    @istest
+    def keeps_the_deadlines_bounded(self):
+        store = MemoryStore()
+
+        store.set('session-id', 'foo', 10, 60)
+        for _ in range(1000):
+            store.touch('session-id', 60)
+
+        self.assertLess(len(store.deadlines), 200)
+
+    @istest
+    def deletes_entries(self):
+        store = MemoryStore()
+        store.set('session-id', 'foo', 10, 60)
+
+        store.delete('session-id')
+
+        self.assertIsNone(store.get('session-id'))
+        self.assertEqual(store.stats()['bytes'], 0)
+
+
+class ImmutabilityTest(TestCase):
+    @istest
+    def knows_immutable_values(self):
+        self.assertTrue(is_immutable('foo'))
+        self.assertTrue(is_immutable(1))
+        self.assertTrue(is_immutable(None))
+        self.assertTrue(is_immutable(('foo', (1, 2.0))))
+        self.assertTrue(is_immutable(frozenset([1])))
+
+    @istest
+    def knows_mutable_values(self):
+        self.assertFalse(is_immutable([]))
+        self.assertFalse(is_immutable({}))
+        self.assertFalse(is_immutable(('foo', [])))
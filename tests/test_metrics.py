@@ -0,0 +1,242 @@
+import logging
+from unittest import TestCase
+
+from nose.tools import istest
+
+from pycket import metrics
+from pycket.driver import MemoryDriver
+from pycket.metrics import (
+    Histogram, Metrics, RequestDriver, RequestMetrics, create_metrics, default_metrics, format_summary,
+    log_request, request_summary)
+from pycket.session import SessionMixin
+
+
+class HistogramTest(TestCase):
+    @istest
+    def counts_values_in_buckets(self):
+        histogram = Histogram((10, 100))
+
+        for value in (5, 10, 50, 500):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.total, 565)
+
+    @istest
+    def estimates_percentiles_with_bucket_bounds(self):
+        histogram = Histogram((10, 100))
+
+        for value in (1, 2, 3, 50):
+            histogram.observe(value)
+
+        self.assertEqual(histogram.percentile(50), 10)
+        self.assertEqual(histogram.percentile(99), 100)
+
+    @istest
+    def has_no_percentiles_without_values(self):
+        self.assertIsNone(Histogram((10, 100)).percentile(50))
+
+
+class MetricsTest(TestCase):
+    def driver(self, **options):
+        driver = MemoryDriver({})
+        driver.configure(dict(options, metrics=Metrics()))
+        return driver
+
+    @istest
+    def measures_operations(self):
+        driver = self.driver()
+
+        driver.set('session-id', {'foo': 'bar'})
+        driver.get('session-id')
+
+        snapshot = driver.metrics.snapshot()
+        self.assertEqual(snapshot['latencies']['set']['count'], 1)
+        self.assertEqual(snapshot['latencies']['get']['count'], 1)
+        self.assertEqual(snapshot['store_operations'], 2)
+
+    @istest
+    def measures_only_outer_operations(self):
+        driver = self.driver()
+
+        driver.get_value('session-id', 'foo')
+
+        snapshot = driver.metrics.snapshot()
+        self.assertEqual(list(snapshot['latencies'].keys()), ['get_value'])
+        self.assertEqual(snapshot['store_operations'], 1)
+
+    @istest
+    def measures_payload_sizes(self):
+        driver = self.driver(serializer='json')
+
+        driver.set('session-id', {'foo': ['bar']})
+        driver.get('session-id')
+
+        payloads = driver.metrics.snapshot()['payloads']
+        self.assertEqual(payloads['bytes_written']['count'], 1)
+        self.assertEqual(payloads['bytes_written']['total'], payloads['bytes_read']['total'])
+        self.assertEqual(payloads['raw_bytes_written']['count'], 1)
+
+    @istest
+    def doesnt_count_cache_hits_as_store_operations(self):
+        driver = self.driver(cache=True)
+
+        driver.get('session-id')
+        driver.set('session-id', {'foo': 'bar'})
+        driver.get('session-id')
+        driver.get('other-session-id')
+
+        snapshot = driver.metrics.snapshot()
+        self.assertEqual(snapshot['cache_hits'], 1)
+        self.assertEqual(snapshot['cache_misses'], 2)
+        self.assertEqual(snapshot['store_operations'], 3)
+        self.assertAlmostEqual(driver.metrics.cache_hit_rate(), 1 / 3.0)
+
+    @istest
+    def measures_touches_only_when_not_throttled(self):
+        driver = self.driver(sliding_expiration=True)
+
+        driver.touch('session-id')
+        driver.touch('session-id')
+
+        self.assertEqual(driver.metrics.snapshot()['latencies']['touch']['count'], 1)
+
+    @istest
+    def calls_listeners_with_each_measurement(self):
+        driver = self.driver()
+        measurements = []
+        driver.metrics.add_listener(lambda metric, operation, value: measurements.append((metric, operation)))
+
+        driver.get('session-id')
+
+        self.assertEqual(measurements, [('bytes_read', 'get'), ('latency', 'get'), ('store_operation', 'get')])
+
+    @istest
+    def adds_measurements_to_request_metrics(self):
+        driver = self.driver()
+        request_metrics = RequestMetrics()
+
+        RequestDriver(driver, request_metrics).set('session-id', {'foo': 'bar'})
+        RequestDriver(driver, request_metrics).get('session-id')
+        driver.get('session-id')
+
+        summary = request_metrics.as_dict()
+        self.assertEqual(summary['operations'], 2)
+        self.assertEqual(summary['store_operations'], 2)
+        self.assertGreater(summary['bytes_written'], 0)
+
+    @istest
+    def uses_default_metrics_when_enabled(self):
+        self.assertIs(create_metrics(True), default_metrics)
+
+
+class RequestSummaryTest(TestCase):
+    @istest
+    def summarizes_session_metrics_of_request(self):
+        class StubHandler(SessionMixin):
+            settings = {
+                'pycket': {
+                    'engine': 'memory',
+                    'metrics': Metrics(),
+                }
+            }
+
+            def get_secure_cookie(self, name):
+                return 'session-id'
+
+        handler = StubHandler()
+        handler.session.set('foo', 'bar')
+        handler.session.get('foo')
+
+        summary = request_summary(handler)
+        self.assertEqual(summary['operations'], 2)
+        self.assertEqual(summary['store_operations'], 2)
+        self.assertEqual(summary['cookie_decodes'], 1)
+        self.assertIn('2 store ops', format_summary(summary))
+
+    @istest
+    def has_no_summary_without_session(self):
+        self.assertIsNone(request_summary(object()))
+
+
+class LogRequestTest(TestCase):
+    def setUp(self):
+        self.records = []
+        self.logger = logging.getLogger('tornado.access')
+        self.log_handler = logging.Handler()
+        self.log_handler.emit = self.records.append
+        self.logger.addHandler(self.log_handler)
+        self.original_level = self.logger.level
+        self.logger.setLevel(logging.INFO)
+        self.original_timer = metrics.default_timer
+        ticks = []
+
+        def timer():
+            # Each call is 2ms after the previous one, so each operation takes 2ms.
+            ticks.append(None)
+            return len(ticks) * 0.002
+        metrics.default_timer = timer
+
+    def tearDown(self):
+        metrics.default_timer = self.original_timer
+        self.logger.removeHandler(self.log_handler)
+        self.logger.setLevel(self.original_level)
+
+    def create_handler(self, status=200):
+        class StubRequest(object):
+            def request_time(self):
+                return 0.0125
+
+        class StubHandler(SessionMixin):
+            settings = {
+                'pycket': {
+                    'engine': 'memory',
+                    'metrics': Metrics(),
+                }
+            }
+            request = StubRequest()
+
+            def get_secure_cookie(self, name):
+                return 'session-id'
+
+            def get_status(self):
+                return status
+
+            def _request_summary(self):
+                return 'GET / (127.0.0.1)'
+
+        return StubHandler()
+
+    @istest
+    def logs_the_session_metrics_of_the_request(self):
+        handler = self.create_handler()
+        handler.session.set('foo', 'bar')
+        handler.session.get('foo')
+        handler.session.get('foo')
+
+        log_request(handler)
+
+        self.assertEqual(len(self.records), 1)
+        self.assertEqual(self.records[0].levelno, logging.INFO)
+        summary = request_summary(handler)
+        self.assertEqual((summary['operations'], summary['store_operations'], summary['milliseconds']), (3, 3, 6.0))
+        self.assertGreater(summary['bytes_written'], 0)
+        self.assertEqual(self.records[0].getMessage(), (
+            '200 GET / (127.0.0.1) 12.50ms (pycket: 3 ops, 3 store ops, 6.00ms, 0B read, %dB written, '
+            '0/0 cache hits/misses, 1 cookie decodes)' % summary['bytes_written']))
+
+    @istest
+    def logs_requests_without_session_like_tornado(self):
+        handler = self.create_handler(status=404)
+
+        log_request(handler)
+
+        self.assertEqual(self.records[0].levelno, logging.WARNING)
+        self.assertEqual(self.records[0].getMessage(), '404 GET / (127.0.0.1) 12.50ms')
+
+    @istest
+    def logs_server_errors_as_errors(self):
+        log_request(self.create_handler(status=500))
+
+        self.assertEqual(self.records[0].levelno, logging.ERROR)
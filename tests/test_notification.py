@@ -4,7 +4,7 @@ from unittest import TestCase
 from nose.tools import istest
 import redis
 
-from pycket.driver import RedisDriver
+from pycket.driver import RedisDriver, registry
 from pycket.session import SessionMixin
 from pycket.notification import NotificationManager, NotificationMixin
 
@@ -16,6 +16,7 @@ class RedisTestCase(TestCase):
         if self.client is None:
             self.client = redis.Redis(db=RedisDriver.DEFAULT_STORAGE_IDENTIFIERS['db_notifications'])
         self.client.flushall()
+        registry.clear()
 
 
 class NotificationMixinTest(TestCase):
@@ -65,6 +66,76 @@ class NotificationManagerTest(RedisTestCase):
 
         self.assertEqual(list(notifications.keys()), [])
 
+    @istest
+    def gets_a_notification_in_a_single_operation(self):
+        handler = StubHandler()
+        manager = NotificationManager(handler)
+        manager.set('foo', 'bar')
+        pops = []
+        original_pop = manager.driver.pop
+
+        def pop(session_id, name, default=None):
+            pops.append(name)
+            return original_pop(session_id, name, default)
+        manager.driver.pop = pop
+        manager.driver.get = None
+
+        self.assertEqual(manager.get('foo'), 'bar')
+        self.assertEqual(pops, ['foo'])
+
+    @istest
+    def gets_all_notifications_at_once(self):
+        handler = StubHandler()
+        manager = NotificationManager(handler)
+
+        manager.set('foo', 'bar')
+        manager.set('baz', 'qux')
+
+        self.assertEqual(manager.pop_all(), {'foo': 'bar', 'baz': 'qux'})
+        self.assertEqual(manager.pop_all(), {})
+
+    @istest
+    def consumes_pushed_notifications_in_order(self):
+        handler = StubHandler()
+        manager = NotificationManager(handler)
+
+        manager.push('foo', 'bar')
+        manager.push('baz')
+
+        self.assertEqual(manager.consume(1), ['foo'])
+        self.assertEqual(manager.consume(), ['bar', 'baz'])
+        self.assertEqual(manager.consume(), [])
+
+    @istest
+    def caps_the_notification_queue_length(self):
+        handler = StubHandler({
+            'pycket': {
+                'engine': 'redis',
+                'max_notifications': 2,
+            }
+        })
+        manager = NotificationManager(handler)
+
+        manager.push('foo', 'bar', 'baz')
+
+        self.assertEqual(manager.consume(), ['bar', 'baz'])
+
+    @istest
+    def gets_notifications_from_hashes(self):
+        handler = StubHandler({
+            'pycket': {
+                'engine': 'redis_hash',
+            }
+        })
+        manager = NotificationManager(handler)
+
+        manager.set('foo', 'bar')
+        manager.set('baz', 'qux')
+
+        self.assertEqual(manager.get('foo'), 'bar')
+        self.assertIsNone(manager.get('foo'))
+        self.assertEqual(manager.pop_all(), {'baz': 'qux'})
+
     @istest
     def gets_default_value_if_provided_and_not_in_client(self):
         handler = StubHandler()
@@ -0,0 +1,280 @@
+from unittest import TestCase
+
+from nose.tools import istest, raises
+
+from pycket.driver import DriverFactory, RedisDriver, RedisHashDriver
+from pycket.offload import (
+    create_offloader, is_reference, MissingBlobError, Offloader, reference_digest, REFERENCE_TAG)
+from tests.test_driver import RedisTestCase
+from tests.test_sqlite import SQLiteTestCase
+
+
+FLAGS = dict(('flag-%d' % index, index % 2 == 0) for index in range(200))
+ROLES = ['role-%d' % index for index in range(100)]
+
+
+class OffloaderTest(TestCase):
+    @istest
+    def offloads_data_above_threshold(self):
+        offloader = Offloader(threshold=100)
+
+        self.assertTrue(offloader.should_offload(b'x' * 100))
+        self.assertFalse(offloader.should_offload(b'x' * 99))
+
+    @istest
+    def references_blobs_by_their_hash(self):
+        offloader = Offloader()
+
+        reference = offloader.reference(offloader.digest(b'data'))
+
+        self.assertTrue(is_reference(reference))
+        self.assertEqual(reference[:1], REFERENCE_TAG)
+        self.assertEqual(reference_digest(reference), offloader.digest(b'data'))
+        self.assertEqual(len(reference_digest(reference)), 64)
+
+    @istest
+    def caches_blobs(self):
+        offloader = Offloader()
+
+        offloader.cache('digest', b'data')
+
+        self.assertEqual(offloader.cached('digest'), b'data')
+        self.assertIsNone(offloader.cached('other-digest'))
+
+    @istest
+    def creates_offloader_from_settings(self):
+        self.assertEqual(create_offloader(True).threshold, Offloader.DEFAULT_THRESHOLD)
+        self.assertEqual(create_offloader({'threshold': 100}).threshold, 100)
+
+
+class OffloadingDriverTestMixin(object):
+    def create(self, **options):
+        driver = self.create_driver()
+        driver.configure(dict({'offload': {'threshold': 100}}, **options), 'db_sessions')
+        return driver
+
+    def blob_keys(self):
+        return [key for key in self.client.keys() if key.endswith(b':blob')]
+
+    @istest
+    def stores_large_values_once(self):
+        driver = self.create()
+
+        driver.set('session-1', {'flags': FLAGS, 'user': 'john'})
+        driver.set('session-2', {'flags': FLAGS, 'user': 'jane'})
+
+        self.assertEqual(len(self.blob_keys()), 1)
+        self.assertEqual(driver.get('session-1'), {'flags': FLAGS, 'user': 'john'})
+        self.assertEqual(driver.get('session-2')['flags'], FLAGS)
+        self.assertEqual(driver.offloader.stats()['offloaded'], 2)
+        self.assertEqual(driver.offloader.stats()['uploaded'], 1)
+
+    @istest
+    def writes_references_instead_of_values(self):
+        offloaded_size = len(self.create()._encode_session({'flags': FLAGS}))
+
+        self.assertLess(offloaded_size, len(self.create_driver()._encode_session({'flags': FLAGS})) // 10)
+
+    @istest
+    def reads_blobs_written_by_other_processes(self):
+        self.create().set('session-id', {'flags': FLAGS})
+        driver = self.create()
+
+        self.assertEqual(driver.get('session-id'), {'flags': FLAGS})
+        self.assertEqual(driver.offloader.stats()['fetched'], 1)
+
+        driver.get('session-id')
+        self.assertEqual(driver.offloader.stats()['fetched'], 1)
+
+    @istest
+    def doesnt_upload_blobs_that_exist(self):
+        self.create().set('session-1', {'flags': FLAGS})
+        driver = self.create()
+
+        driver.set('session-2', {'flags': FLAGS})
+
+        self.assertEqual(driver.offloader.stats()['uploaded'], 0)
+
+    @istest
+    def keeps_small_values_in_the_session(self):
+        driver = self.create()
+
+        driver.set('session-id', {'user': 'john'})
+
+        self.assertEqual(self.blob_keys(), [])
+        self.assertEqual(driver.get('session-id'), {'user': 'john'})
+
+    @istest
+    def changes_sessions_with_offloaded_values(self):
+        driver = self.create()
+        driver.set('session-id', {'flags': FLAGS, 'user': 'john'})
+
+        driver.update('session-id', {'user': 'jane'})
+
+        self.assertEqual(driver.get('session-id'), {'flags': FLAGS, 'user': 'jane'})
+        self.assertEqual(driver.pop('session-id', 'flags'), FLAGS)
+
+    @istest
+    def expires_blobs_after_the_sessions(self):
+        driver = self.create()
+
+        driver.set('session-id', {'flags': FLAGS})
+
+        blob_ttl = self.client.ttl(self.blob_keys()[0])
+        self.assertGreater(blob_ttl, driver.EXPIRE_SECONDS)
+
+    @istest
+    def refreshes_blobs_when_reading_sessions(self):
+        self.create().set('session-id', {'flags': FLAGS})
+        self.client.expire(self.blob_keys()[0], 10)
+
+        self.create().get('session-id')
+
+        self.assertGreater(self.client.ttl(self.blob_keys()[0]), 10)
+
+    @istest
+    def keeps_blobs_of_values_not_read_alive_with_the_session(self):
+        self.create().set('session-id', {'flags': FLAGS, 'roles': ROLES})
+        for blob_key in self.blob_keys():
+            self.client.expire(blob_key, 10)
+        driver = self.create(sliding_expiration=True)
+
+        driver.touch('session-id')
+        driver.get_value('session-id', 'flags')
+        # The blobs that weren't refreshed would expire while the session lives on.
+        for blob_key in self.blob_keys():
+            if self.client.ttl(blob_key) <= 10:
+                self.client.delete(blob_key)
+
+        self.assertEqual(len(self.blob_keys()), 2)
+        self.assertEqual(self.create().get('session-id'), {'flags': FLAGS, 'roles': ROLES})
+
+    @istest
+    def refreshes_blobs_of_values_not_changed(self):
+        self.create().set('session-id', {'flags': FLAGS, 'user': 'john'})
+        self.client.expire(self.blob_keys()[0], 10)
+
+        self.create().update('session-id', {'user': 'jane'})
+
+        self.assertGreater(self.client.ttl(self.blob_keys()[0]), 10)
+
+    @istest
+    def refreshes_the_blobs_of_each_session_once_per_interval(self):
+        driver = self.create()
+        driver.set('session-id', {'flags': FLAGS})
+        loads = []
+        driver._load_raw_values = lambda session_id: loads.append(session_id) or []
+
+        driver._refresh_session_blobs('session-id')
+        driver._refresh_session_blobs('session-id')
+
+        self.assertEqual(loads, ['session-id'])
+
+    @istest
+    def touches_sessions_without_blobs(self):
+        driver = self.create(sliding_expiration=True)
+        driver.set('session-id', {'user': 'john'})
+
+        driver.touch('session-id')
+        driver.touch('missing-session-id')
+
+        self.assertEqual(self.blob_keys(), [])
+
+    @istest
+    def uploads_missing_blobs_again(self):
+        driver = self.create()
+        driver.set('session-1', {'flags': FLAGS})
+        self.client.delete(*self.blob_keys())
+
+        driver.blob_refreshes.forget(driver.offloader.digest(driver.serializer.dumps(FLAGS)))
+        driver.set('session-2', {'flags': FLAGS})
+
+        self.assertEqual(len(self.blob_keys()), 1)
+
+    @istest
+    def uploads_blobs_again_after_failing_to_upload_them(self):
+        driver = self.create()
+        store_blob = driver._store_blob
+
+        def fail(blob_id, data):
+            raise IOError('Connection lost')
+        driver._store_blob = fail
+        try:
+            driver.set('session-1', {'flags': FLAGS})
+        except IOError:
+            pass
+        else:
+            self.fail('The upload should fail')
+        driver._store_blob = store_blob
+
+        driver.set('session-2', {'flags': FLAGS})
+
+        self.assertEqual(len(self.blob_keys()), 1)
+        self.assertEqual(driver.get('session-2'), {'flags': FLAGS})
+        self.assertEqual(driver.offloader.stats()['uploaded'], 1)
+
+    @istest
+    @raises(MissingBlobError)
+    def fails_to_read_missing_blobs(self):
+        self.create().set('session-id', {'flags': FLAGS})
+        self.client.delete(*self.blob_keys())
+
+        self.create().get_value('session-id', 'flags')
+
+    @istest
+    def doesnt_list_blobs_as_sessions(self):
+        driver = self.create()
+
+        driver.set('session-id', {'flags': FLAGS})
+
+        self.assertEqual([session_id for session_ids in driver.scan() for session_id in session_ids],
+                         ['session-id'])
+
+
+class OffloadingRedisDriverTest(OffloadingDriverTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisDriver(dict(db=0))
+
+    @istest
+    def offloads_queued_values(self):
+        driver = self.create()
+
+        driver.push('session-id', [FLAGS])
+
+        self.assertEqual(len(self.blob_keys()), 1)
+        self.assertEqual(driver.consume('session-id'), [FLAGS])
+
+
+class OffloadingPrefixedRedisDriverTest(OffloadingDriverTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisDriver(dict(db=0, key_prefix='app:'))
+
+
+class OffloadingRedisHashDriverTest(OffloadingDriverTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisHashDriver(dict(db=0))
+
+
+class OffloadingLazyRedisDriverTest(OffloadingDriverTestMixin, RedisTestCase):
+    def create_driver(self):
+        return RedisDriver(dict(db=0))
+
+    def create(self, **options):
+        return super(OffloadingLazyRedisDriverTest, self).create(lazy_values=True, **options)
+
+    @istest
+    def doesnt_fetch_blobs_of_values_not_used(self):
+        self.create().set('session-id', {'flags': FLAGS, 'user': 'john'})
+        driver = self.create()
+
+        driver.get('session-id')['user']
+        driver.update('session-id', {'user': 'jane'})
+
+        self.assertEqual(driver.offloader.stats()['fetched'], 0)
+
+
+class UnoffloadableDriverTest(SQLiteTestCase):
+    @istest
+    @raises(NotImplementedError)
+    def cannot_offload_without_support_from_the_engine(self):
+        DriverFactory().create('sqlite', {'path': self.path}, 'db_sessions', {'offload': True})
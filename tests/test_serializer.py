@@ -0,0 +1,90 @@
+import pickle
+from unittest import TestCase
+
+from nose.tools import istest, raises
+
+from pycket.serializer import (
+    create_serializer, deserialize, JSONSerializer, MsgpackSerializer,
+    PickleSerializer)
+
+
+class PickleSerializerTest(TestCase):
+    @istest
+    def writes_untagged_pickles(self):
+        data = PickleSerializer().dumps({'foo': 'bar'})
+
+        self.assertEqual(pickle.loads(data), {'foo': 'bar'})
+
+    @istest
+    def uses_the_default_protocol_of_the_interpreter(self):
+        self.assertEqual(PickleSerializer().dumps({'foo': 'bar'}), pickle.dumps({'foo': 'bar'}))
+
+    @istest
+    def uses_the_highest_protocol_if_chosen(self):
+        data = PickleSerializer(protocol=pickle.HIGHEST_PROTOCOL).dumps({'foo': 'bar'})
+
+        self.assertEqual(data, pickle.dumps({'foo': 'bar'}, pickle.HIGHEST_PROTOCOL))
+
+    @istest
+    def uses_the_chosen_protocol(self):
+        data = PickleSerializer(protocol=2).dumps({'foo': 'bar'})
+
+        self.assertEqual(data[:2], b'\x80\x02')
+
+    @istest
+    def reads_its_own_output(self):
+        serializer = PickleSerializer()
+
+        self.assertEqual(serializer.loads(serializer.dumps({'foo': 'bar'})), {'foo': 'bar'})
+
+
+class JSONSerializerTest(TestCase):
+    @istest
+    def writes_tagged_json(self):
+        data = JSONSerializer().dumps({'foo': 'bar'})
+
+        self.assertEqual(data, b'\x01{"foo":"bar"}')
+
+    @istest
+    def reads_its_own_output(self):
+        serializer = JSONSerializer()
+
+        self.assertEqual(serializer.loads(serializer.dumps({'foo': [1, 2]})), {'foo': [1, 2]})
+
+
+class MsgpackSerializerTest(TestCase):
+    @istest
+    def writes_tagged_msgpack(self):
+        data = MsgpackSerializer().dumps({'foo': 'bar'})
+
+        self.assertEqual(data[:1], MsgpackSerializer.TAG)
+
+    @istest
+    def reads_its_own_output(self):
+        serializer = MsgpackSerializer()
+
+        self.assertEqual(serializer.loads(serializer.dumps({'foo': [1, 2]})), {'foo': [1, 2]})
+
+
+class SerializerFunctionsTest(TestCase):
+    @istest
+    def creates_serializers_by_name(self):
+        self.assertIsInstance(create_serializer('pickle'), PickleSerializer)
+        self.assertIsInstance(create_serializer('json'), JSONSerializer)
+        self.assertIsInstance(create_serializer('msgpack'), MsgpackSerializer)
+
+    @istest
+    def keeps_serializer_instances(self):
+        serializer = PickleSerializer(protocol=2)
+
+        self.assertIs(create_serializer(serializer), serializer)
+
+    @istest
+    @raises(ValueError)
+    def cannot_create_unknown_serializer(self):
+        create_serializer('morse-code')
+
+    @istest
+    def deserializes_with_the_serializer_that_wrote_the_data(self):
+        for serializer in (PickleSerializer(), PickleSerializer(protocol=0), JSONSerializer(), MsgpackSerializer()):
+            self.assertEqual(deserialize(serializer.dumps({'foo': 'bar'})), {'foo': 'bar'})
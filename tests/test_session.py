@@ -5,7 +5,8 @@ from unittest import skipIf, TestCase
 from nose.tools import istest, raises
 import redis
 
-from pycket.driver import MemcachedDriver, RedisDriver
+from pycket.driver import MemcachedDriver, MemoryDriver, RedisDriver, RedisHashDriver, registry
+from pycket.notification import NotificationMixin
 from pycket.session import ConfigurationError, SessionManager, SessionMixin
 
 
@@ -66,6 +67,35 @@ class SessionMixinTest(TestCase):
 
         self.assertIsInstance(StubHandler().session.driver, MemcachedDriver)
 
+    @istest
+    def creates_session_for_memory(self):
+        class StubHandler(SessionMixin):
+            settings = {
+                'pycket': {
+                    'engine': 'memory',
+                }
+            }
+
+            def get_secure_cookie(self, name):
+                return 'session-id'
+
+        handler = StubHandler()
+        handler.session.set('foo', 'bar')
+
+        self.assertIsInstance(handler.session.driver, MemoryDriver)
+        self.assertEqual(StubHandler().session.get('foo'), 'bar')
+
+    @istest
+    def creates_session_for_redis_hash(self):
+        class StubHandler(SessionMixin):
+            settings = {
+                'pycket': {
+                    'engine': 'redis_hash',
+                }
+            }
+
+        self.assertIsInstance(StubHandler().session.driver, RedisHashDriver)
+
 
 class RedisTestCase(TestCase):
     client = None
@@ -74,6 +104,7 @@ class RedisTestCase(TestCase):
         if self.client is None:
             self.client = redis.Redis(db=RedisDriver.DEFAULT_STORAGE_IDENTIFIERS['db_sessions'])
         self.client.flushall()
+        registry.clear()
 
 
 class SessionManagerTest(RedisTestCase):
@@ -125,6 +156,30 @@ class SessionManagerTest(RedisTestCase):
 
         self.assertTrue(handler.cookie_retrieved)
 
+    @istest
+    def decodes_session_cookie_only_once_per_request(self):
+        class StubHandler(SessionMixin, NotificationMixin):
+            settings = {
+                'pycket': {
+                    'engine': 'redis',
+                }
+            }
+            cookie_reads = 0
+
+            def get_secure_cookie(self, name):
+                self.cookie_reads += 1
+                return 'some-id'
+
+        handler = StubHandler()
+        handler.session.set('foo', 'bar')
+        handler.session.get('foo')
+        'foo' in handler.session
+        handler.notifications.get('foo')
+
+        self.assertEqual(handler.cookie_reads, 1)
+        self.assertEqual(handler.session.request.cookie_decodes, 1)
+        self.assertIs(handler.notifications.request, handler.session.request)
+
     @istest
     def saves_session_object_on_redis_with_same_session_id_as_cookie(self):
         handler = StubHandler()
@@ -362,6 +417,19 @@ class SessionManagerTest(RedisTestCase):
 
         self.assertEqual(list(session.keys()), [])
 
+    @istest
+    def pops_objects_from_session(self):
+        handler = StubHandler()
+        manager = SessionManager(handler)
+
+        manager.set('foo', 'bar')
+        manager.set('baz', 'qux')
+
+        self.assertEqual(manager.pop('foo'), 'bar')
+        self.assertEqual(manager.pop('foo', 'default'), 'default')
+        self.assertEqual(manager.pop_all(), {'baz': 'qux'})
+        self.assertEqual(list(manager.keys()), [])
+
     @istest
     def deletes_item_using_command(self):
         handler = StubHandler()
@@ -426,6 +494,315 @@ class SessionManagerTest(RedisTestCase):
 
         self.assertEqual(iterations, 2)
 
+    @istest
+    def shares_driver_between_managers(self):
+        manager = SessionManager(StubHandler())
+        other_manager = SessionManager(StubHandler())
+
+        self.assertIs(manager.driver, other_manager.driver)
+
+    @istest
+    def refreshes_expiration_when_reading_with_sliding_expiration(self):
+        handler = StubHandler({
+            'pycket': {
+                'engine': 'redis',
+                'sliding_expiration': 60,
+            }
+        })
+        manager = SessionManager(handler)
+        self.client.set(handler.session_id, pickle.dumps({'foo': 'bar'}))
+        self.client.expire(handler.session_id, 10)
+
+        self.assertEqual(manager.get('foo'), 'bar')
+        self.assertGreater(self.client.ttl(handler.session_id), 10)
+
+
+class WriteBackSessionManagerTest(RedisTestCase):
+    def create_manager(self):
+        handler = StubHandler({
+            'pycket': {
+                'engine': 'redis',
+                'write_back': True,
+            }
+        })
+        return handler, SessionManager(handler)
+
+    @istest
+    def doesnt_write_session_before_flushing(self):
+        handler, manager = self.create_manager()
+
+        manager.set('foo', 'bar')
+
+        self.assertEqual(manager.get('foo'), 'bar')
+        self.assertIsNone(self.client.get(handler.session_id))
+
+        manager.flush()
+
+        session = pickle.loads(self.client.get(handler.session_id))
+        self.assertEqual(session, {'foo': 'bar'})
+
+    @istest
+    def loads_session_from_database_only_once(self):
+        handler, manager = self.create_manager()
+        self.client.set(handler.session_id, pickle.dumps({'foo': 'bar'}))
+        calls = []
+        original_get = manager.driver.get
+
+        def get(session_id):
+            calls.append(session_id)
+            return original_get(session_id)
+        manager.driver.get = get
+
+        manager.get('foo')
+        manager.set('baz', 'qux')
+        'foo' in manager
+        manager.keys()
+        manager.delete('foo')
+
+        self.assertEqual(calls, [handler.session_id])
+
+    @istest
+    def doesnt_write_session_if_nothing_changed(self):
+        handler, manager = self.create_manager()
+
+        manager.get('foo')
+        manager.delete('foo')
+        manager.flush()
+
+        self.assertIsNone(self.client.get(handler.session_id))
+
+    @istest
+    def pops_objects_before_flushing(self):
+        handler, manager = self.create_manager()
+        self.client.set(handler.session_id, pickle.dumps({'foo': 'bar', 'baz': 'qux'}))
+
+        self.assertEqual(manager.pop('foo'), 'bar')
+        self.assertEqual(manager.pop_all(), {'baz': 'qux'})
+        manager.flush()
+
+        self.assertEqual(pickle.loads(self.client.get(handler.session_id)), {})
+
+    @istest
+    def keeps_changes_flushed_by_concurrent_requests(self):
+        handler, manager = self.create_manager()
+        other_handler, other_manager = self.create_manager()
+
+        manager.get('foo')
+        other_manager.get('foo')
+        manager.set('foo', 'bar')
+        other_manager.set('baz', 'qux')
+        manager.flush()
+        other_manager.flush()
+
+        session = pickle.loads(self.client.get(handler.session_id))
+        self.assertEqual(session, {'foo': 'bar', 'baz': 'qux'})
+
+    @istest
+    def flushes_session_before_the_response_is_finished(self):
+        handler = StubHandler({
+            'pycket': {
+                'engine': 'redis',
+                'write_back': True,
+            }
+        })
+        finished = []
+        handler.finish = lambda chunk=None: finished.append((chunk, self.client.get(handler.session_id)))
+        manager = SessionManager(handler)
+
+        manager.set('foo', 'bar')
+        handler.finish('done')
+
+        self.assertEqual(len(finished), 1)
+        chunk, stored_session = finished[0]
+        self.assertEqual(chunk, 'done')
+        self.assertEqual(pickle.loads(stored_session), {'foo': 'bar'})
+
+    @istest
+    def raises_flush_errors_from_finish(self):
+        handler = StubHandler({
+            'pycket': {
+                'engine': 'redis',
+                'write_back': True,
+            }
+        })
+        finished = []
+        original_finish = handler.finish = lambda: finished.append(True)
+        manager = SessionManager(handler)
+        manager.set('foo', lambda: 'not picklable')
+
+        self.assertRaises(Exception, handler.finish)
+        self.assertEqual(finished, [])
+        self.assertIs(handler.finish, original_finish)
+
+
+class PrefixedSessionManagerTest(RedisTestCase):
+    def create_handler(self, write_back=True):
+        class StubHandler(SessionMixin, NotificationMixin):
+            settings = {
+                'pycket': {
+                    'engine': 'redis',
+                    'write_back': write_back,
+                    'storage': {
+                        'key_prefix': 'app:',
+                    },
+                }
+            }
+
+            def get_secure_cookie(self, name):
+                return 'session-id'
+
+        return StubHandler()
+
+    @istest
+    def loads_session_and_notifications_together(self):
+        self.client.set('app:sessions:session-id', pickle.dumps({'foo': 'bar'}))
+        self.client.set('app:notifications:session-id', pickle.dumps({'message': 'hi'}))
+        handler = self.create_handler()
+        calls = []
+        original_get_together = handler.session.driver.get_together
+
+        def get_together(session_id, drivers):
+            calls.append(session_id)
+            return original_get_together(session_id, drivers)
+        handler.session.driver.get_together = get_together
+
+        handler.session.load(handler.notifications)
+
+        self.assertEqual(calls, ['session-id'])
+        self.assertEqual(handler.session.get('foo'), 'bar')
+        self.assertEqual(handler.notifications.get('message'), 'hi')
+        self.assertIsNone(handler.notifications.get('message'))
+
+    @istest
+    def writes_session_and_notifications_with_prefixes(self):
+        handler = self.create_handler()
+
+        handler.session.load(handler.notifications)
+        handler.session.set('foo', 'bar')
+        handler.notifications.set('message', 'hi')
+        handler.session.flush()
+        handler.notifications.flush()
+
+        self.assertEqual(pickle.loads(self.client.get('app:sessions:session-id')), {'foo': 'bar'})
+        self.assertEqual(pickle.loads(self.client.get('app:notifications:session-id')), {'message': 'hi'})
+
+    @istest
+    @raises(ConfigurationError)
+    def cannot_load_together_without_write_back(self):
+        handler = self.create_handler(write_back=False)
+
+        handler.session.load(handler.notifications)
+
+
+class IndexedSessionManagerTest(RedisTestCase):
+    def create_manager(self, session_id, write_back=False, engine='redis'):
+        handler = StubHandler({
+            'pycket': {
+                'engine': engine,
+                'write_back': write_back,
+                'index': 'user',
+            }
+        })
+        handler.session_id = session_id
+        return SessionManager(handler)
+
+    @istest
+    def lists_the_sessions_of_a_user(self):
+        self.create_manager('session-1').set('user', 'john')
+        manager = self.create_manager('session-2', write_back=True)
+        manager.set('user', 'john')
+        manager.flush()
+
+        self.assertEqual(sorted(self.create_manager('other').sessions_of('john')), ['session-1', 'session-2'])
+
+    @istest
+    def deletes_the_sessions_of_a_user(self):
+        self.create_manager('session-1').set('user', 'john')
+        self.create_manager('session-2').set('user', 'john')
+        self.create_manager('session-3').set('user', 'jane')
+
+        deleted = self.create_manager('other').delete_sessions_of('john')
+
+        self.assertEqual(sorted(deleted), ['session-1', 'session-2'])
+        self.assertIsNone(self.create_manager('session-1').get('user'))
+        self.assertEqual(self.create_manager('session-3').get('user'), 'jane')
+
+    @istest
+    def removes_logged_out_sessions_from_the_index(self):
+        manager = self.create_manager('session-id', engine='redis_hash')
+        manager.set('user', 'john')
+
+        manager.delete('user')
+
+        self.assertEqual(manager.sessions_of('john'), [])
+
+    @istest
+    def discards_the_request_session_when_deleting_it(self):
+        manager = self.create_manager('session-id', write_back=True)
+        manager.set('user', 'john')
+        manager.flush()
+
+        manager.set('foo', 'bar')
+        manager.delete_sessions_of('john')
+        manager.flush()
+
+        self.assertIsNone(self.client.get('session-id'))
+        self.assertIsNone(manager.get('user'))
+
+    @istest
+    @raises(ConfigurationError)
+    def cannot_find_sessions_without_index(self):
+        SessionManager(StubHandler()).sessions_of('john')
+
+
+class RedisHashSessionManagerTest(RedisTestCase):
+    def create_manager(self, write_back=False):
+        handler = StubHandler({
+            'pycket': {
+                'engine': 'redis_hash',
+                'write_back': write_back,
+            }
+        })
+        return handler, SessionManager(handler)
+
+    @istest
+    def saves_each_object_in_its_own_field(self):
+        handler, manager = self.create_manager()
+
+        manager.set('foo', 'bar')
+        manager.set('baz', 'qux')
+
+        self.assertEqual(pickle.loads(self.client.hget(handler.session_id, 'foo')), 'bar')
+        self.assertEqual(manager.get('baz'), 'qux')
+        self.assertEqual(sorted(manager.keys()), ['baz', 'foo'])
+        self.assertIn('foo', manager)
+
+    @istest
+    def deletes_only_the_given_fields(self):
+        handler, manager = self.create_manager()
+
+        manager.set('foo', 'bar')
+        manager.set('baz', 'qux')
+        manager.delete('foo', 'unexistant')
+
+        self.assertEqual(self.client.hkeys(handler.session_id), [b'baz'])
+
+    @istest
+    def flushes_only_the_changed_fields(self):
+        handler, manager = self.create_manager(write_back=True)
+        self.client.hset(handler.session_id, 'foo', pickle.dumps('bar'))
+        self.client.hset(handler.session_id, 'baz', pickle.dumps('qux'))
+
+        manager.get('foo')
+        manager.set('new', 'value')
+        manager.delete('baz')
+        self.client.hset(handler.session_id, 'foo', pickle.dumps('changed elsewhere'))
+        manager.flush()
+
+        self.assertEqual(pickle.loads(self.client.hget(handler.session_id, 'foo')), 'changed elsewhere')
+        self.assertEqual(pickle.loads(self.client.hget(handler.session_id, 'new')), 'value')
+        self.assertFalse(self.client.hexists(handler.session_id, 'baz'))
+
 
 class StubHandler(object):
     session_id = 'session-id'
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from nose.tools import istest, raises
+
+from pycket.shared_memory import SharedMemoryStore
+
+
+class SharedMemoryTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sessions.shm')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class SharedMemoryStoreTest(SharedMemoryTestCase):
+    @istest
+    def returns_none_for_missing_keys(self):
+        store = SharedMemoryStore(self.path, slots=64)
+
+        self.assertIsNone(store.get('session-id'))
+
+    @istest
+    def stores_values(self):
+        store = SharedMemoryStore(self.path, slots=64)
+
+        store.set('session-id', b'foo', 60)
+        store.set('session-id', b'bar', 60)
+
+        self.assertEqual(store.get('session-id'), b'bar')
+        self.assertEqual(store.stats(), {'slots': 64, 'entries': 1, 'bytes': 3})
+
+    @istest
+    def shares_values_with_other_stores_of_the_same_file(self):
+        store = SharedMemoryStore(self.path, slots=64)
+        other_store = SharedMemoryStore(self.path, slots=64)
+
+        store.set('session-id', b'foo', 60)
+
+        self.assertEqual(other_store.get('session-id'), b'foo')
+
+    @istest
+    def shares_values_with_forked_processes(self):
+        store = SharedMemoryStore(self.path, slots=64)
+
+        pid = os.fork()
+        if pid == 0:
+            store.set('session-id', b'from child', 60)
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertEqual(store.get('session-id'), b'from child')
+
+    @istest
+    def expires_entries_in_place(self):
+        store = SharedMemoryStore(self.path, slots=64)
+
+        store.set('expired', b'foo', -1)
+        store.set('alive', b'bar', 60)
+
+        self.assertIsNone(store.get('expired'))
+        self.assertEqual(store.get('alive'), b'bar')
+        self.assertEqual(store.stats()['entries'], 1)
+
+    @istest
+    def touches_entries(self):
+        store = SharedMemoryStore(self.path, slots=64)
+
+        store.set('session-id', b'foo', 60)
+        store.touch('session-id', -1)
+
+        self.assertIsNone(store.get('session-id'))
+
+    @istest
+    def deletes_entries(self):
+        store = SharedMemoryStore(self.path, slots=64)
+        store.set('session-id', b'foo', 60)
+
+        store.delete('session-id')
+
+        self.assertIsNone(store.get('session-id'))
+
+    @istest
+    def replaces_the_entry_expiring_first_when_the_bucket_is_full(self):
+        store = SharedMemoryStore(self.path, slots=SharedMemoryStore.BUCKET_SLOTS)
+
+        store.set('first', b'foo', 10)
+        for index in range(SharedMemoryStore.BUCKET_SLOTS):
+            store.set('session-%d' % index, b'foo', 60)
+
+        self.assertIsNone(store.get('first'))
+        self.assertEqual(store.get('session-0'), b'foo')
+
+    @istest
+    def can_take_the_lock_again_in_the_same_thread(self):
+        store = SharedMemoryStore(self.path, slots=64)
+
+        with store.lock('session-id'):
+            store.set('session-id', b'foo', 60)
+
+        self.assertEqual(store.depths, [0] * store.stripes)
+
+    @istest
+    @raises(ValueError)
+    def refuses_values_larger_than_the_slots(self):
+        store = SharedMemoryStore(self.path, slots=64, slot_size=128)
+
+        store.set('session-id', b'x' * 128, 60)
+
+    @istest
+    @raises(ValueError)
+    def refuses_files_created_with_other_slot_settings(self):
+        SharedMemoryStore(self.path, slots=64)
+        SharedMemoryStore(self.path, slots=128)
+
+    @istest
+    @raises(ValueError)
+    def refuses_files_created_with_other_stripes(self):
+        SharedMemoryStore(self.path, slots=64, stripes=4)
+        SharedMemoryStore(self.path, slots=64, stripes=8)
+
+    @istest
+    def reopens_files_created_with_the_same_settings(self):
+        SharedMemoryStore(self.path, slots=64, stripes=4).set('session-id', b'foo', 60)
+
+        self.assertEqual(SharedMemoryStore(self.path, slots=64, stripes=4).get('session-id'), b'foo')
@@ -0,0 +1,309 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from nose.tools import istest, raises
+
+from pycket.sqlite import shared_store, SQLiteStore
+
+
+class SQLiteTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sessions.sqlite3')
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.directory)
+
+    def create_store(self, **settings):
+        store = SQLiteStore(self.path, **settings)
+        self.stores.append(store)
+        return store
+
+
+class SQLiteStoreTest(SQLiteTestCase):
+    @istest
+    def returns_none_for_missing_keys(self):
+        store = self.create_store()
+
+        self.assertIsNone(store.get('sessions', 'session-id'))
+
+    @istest
+    def stores_values(self):
+        store = self.create_store()
+
+        store.set('sessions', 'session-id', b'foo', 60)
+        store.set('sessions', 'session-id', b'bar', 60)
+
+        self.assertEqual(store.get('sessions', 'session-id'), b'bar')
+        self.assertIsNone(store.get('notifications', 'session-id'))
+
+    @istest
+    def keeps_values_after_reopening_the_database(self):
+        store = self.create_store()
+        store.set('sessions', 'session-id', b'foo', 60)
+        store.close()
+        self.stores.remove(store)
+
+        self.assertEqual(self.create_store().get('sessions', 'session-id'), b'foo')
+
+    @istest
+    def uses_wal_mode(self):
+        store = self.create_store()
+
+        journal_mode = store._connect().execute('PRAGMA journal_mode').fetchone()[0]
+
+        self.assertEqual(journal_mode, 'wal')
+
+    @istest
+    def doesnt_return_expired_values(self):
+        store = self.create_store()
+
+        store.set('sessions', 'session-id', b'foo', -1)
+
+        self.assertIsNone(store.get('sessions', 'session-id'))
+
+    @istest
+    def touches_and_deletes_values(self):
+        store = self.create_store()
+        store.set('sessions', 'session-id', b'foo', 60)
+        store.set('sessions', 'other-session-id', b'foo', 60)
+
+        store.touch('sessions', 'session-id', -1)
+        store.delete('sessions', 'other-session-id')
+
+        self.assertIsNone(store.get('sessions', 'session-id'))
+        self.assertIsNone(store.get('sessions', 'other-session-id'))
+
+    @istest
+    def commits_concurrent_writes_together(self):
+        store = self.create_store()
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(connection):
+            started.set()
+            release.wait()
+        blocker = threading.Thread(target=store.write, args=(block,))
+        blocker.start()
+        started.wait()
+        writers = [threading.Thread(target=store.set, args=('sessions', 'session-%d' % index, b'foo', 60))
+                   for index in range(10)]
+        for writer in writers:
+            writer.start()
+        while store.operations.qsize() < 10:
+            pass
+        release.set()
+        for thread in [blocker] + writers:
+            thread.join()
+
+        self.assertEqual(store.stats()['writes'], 11)
+        self.assertEqual(store.stats()['commits'], 2)
+        self.assertEqual(store.get('sessions', 'session-9'), b'foo')
+
+    @istest
+    @raises(ZeroDivisionError)
+    def raises_the_errors_of_writes(self):
+        store = self.create_store()
+
+        store.write(lambda connection: 1 / 0)
+
+    @istest
+    def doesnt_fail_other_writes_of_the_commit(self):
+        store = self.create_store()
+
+        try:
+            store.write(lambda connection: 1 / 0)
+        except ZeroDivisionError:
+            pass
+        store.set('sessions', 'session-id', b'foo', 60)
+
+        self.assertEqual(store.get('sessions', 'session-id'), b'foo')
+
+    @istest
+    def fails_all_the_writes_of_a_failed_commit(self):
+        store = self.create_store()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def block(connection):
+            started.set()
+            release.wait()
+
+        def write(function):
+            try:
+                store.write(function)
+            except sqlite3.OperationalError as error:
+                errors.append(error)
+        threads = [threading.Thread(target=write, args=(block,))]
+        threads[0].start()
+        started.wait()
+        # Ending the transaction early makes the COMMIT (and the ROLLBACK after it) fail.
+        threads.append(threading.Thread(target=write, args=(lambda connection: connection.execute('COMMIT'),)))
+        threads.append(threading.Thread(target=write, args=(
+            lambda connection: store.upsert(connection, 'sessions', 'session-id', b'foo', 60),)))
+        for thread in threads[1:]:
+            thread.start()
+        while store.operations.qsize() < 2:
+            pass
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(store.stats()['commits'], 1)
+        store.set('sessions', 'other-session-id', b'foo', 60)
+        self.assertEqual(store.get('sessions', 'other-session-id'), b'foo')
+
+    @istest
+    def keeps_writing_after_failing_to_connect(self):
+        store = FlakyStore(self.path)
+        self.stores.append(store)
+
+        try:
+            store.set('sessions', 'session-id', b'foo', 60)
+        except sqlite3.OperationalError:
+            pass
+        else:
+            self.fail('The first write should fail')
+        store.set('sessions', 'session-id', b'bar', 60)
+
+        self.assertEqual(store.get('sessions', 'session-id'), b'bar')
+
+    @istest
+    @raises(RuntimeError)
+    def refuses_writes_after_closing(self):
+        store = SQLiteStore(self.path)
+        store.close()
+
+        store.set('sessions', 'session-id', b'foo', 60)
+
+    @istest
+    @raises(RuntimeError)
+    def fails_the_writes_left_when_the_writer_stops(self):
+        store = SQLiteStore(self.path)
+        store.WRITER_CHECK_INTERVAL = 0.01
+        store.close()
+
+        def stop_after_the_write_is_queued():
+            while store.operations.empty():
+                time.sleep(0.001)
+        store.writer = threading.Thread(target=stop_after_the_write_is_queued)
+        store.writer.start()
+
+        store.set('sessions', 'session-id', b'foo', 60)
+
+    @istest
+    def skips_the_sweep_while_the_database_is_locked(self):
+        store = self.create_store(sweep_interval=3600)
+        locker = store._connect()
+        locker.execute('BEGIN IMMEDIATE')
+        connection = sqlite3.connect(self.path, timeout=0, isolation_level=None)
+        try:
+            swept = store._sweep_now(connection)
+        finally:
+            locker.execute('ROLLBACK')
+            locker.close()
+            connection.close()
+
+        self.assertEqual(swept, 0)
+
+    @istest
+    def sweeps_expired_rows_in_batches(self):
+        store = self.create_store(sweep_interval=3600)
+        store.write(lambda connection: connection.executemany(
+            'INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, 0)',
+            [('session-%d' % index, b'foo') for index in range(SQLiteStore.SWEEP_BATCH + 10)]))
+        store.set('sessions', 'alive', b'foo', 60)
+
+        swept = store.write(store.sweep)
+        swept_again = store.write(store.sweep)
+
+        self.assertEqual(swept, SQLiteStore.SWEEP_BATCH)
+        self.assertEqual(swept_again, 10)
+        self.assertEqual(store.get('sessions', 'alive'), b'foo')
+
+    @istest
+    def sweeps_expired_rows_periodically(self):
+        store = self.create_store(sweep_interval=0.01)
+        store.set('sessions', 'session-id', b'foo', -1)
+
+        started = time.time()
+        while not store.stats()['swept'] and time.time() - started < 5:
+            time.sleep(0.01)
+
+        self.assertEqual(store.stats()['swept'], 1)
+
+    @istest
+    def commits_the_queued_writes_before_closing(self):
+        store = SQLiteStore(self.path)
+        started = threading.Event()
+        release = threading.Event()
+
+        def block(connection):
+            started.set()
+            release.wait()
+        blocker = threading.Thread(target=store.write, args=(block,))
+        blocker.start()
+        started.wait()
+        writer = threading.Thread(target=store.set, args=('sessions', 'session-id', b'foo', 60))
+        writer.start()
+        while store.operations.qsize() < 1:
+            pass
+        closer = threading.Thread(target=store.close)
+        closer.start()
+        while store.operations.qsize() < 2:
+            pass
+        release.set()
+        for thread in (blocker, writer, closer):
+            thread.join()
+
+        self.assertEqual(self.create_store().get('sessions', 'session-id'), b'foo')
+
+    @istest
+    def accepts_bytes_keys(self):
+        store = self.create_store()
+
+        store.set('sessions', b'session-id', b'foo', 60)
+
+        self.assertEqual(store.get('sessions', 'session-id'), b'foo')
+
+    @istest
+    def shares_the_store_of_each_path(self):
+        store = shared_store(self.path)
+        self.stores.append(store)
+
+        self.assertIs(shared_store(self.path), store)
+
+    @istest
+    def doesnt_share_stores_created_before_forking(self):
+        store = shared_store(self.path)
+        self.stores.append(store)
+        store.pid = -1
+
+        forked_store = shared_store(self.path)
+        self.stores.append(forked_store)
+
+        self.assertIsNot(forked_store, store)
+
+
+class FlakyStore(SQLiteStore):
+    '''
+    Fails to open the database the first time the writer thread tries to.
+    '''
+
+    failed = False
+
+    def _connect(self):
+        if threading.current_thread() is getattr(self, 'writer', None) and not self.failed:
+            self.failed = True
+            raise sqlite3.OperationalError('unable to open database file')
+        return super(FlakyStore, self)._connect()